@@ -0,0 +1,1347 @@
+import hashlib
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+import threading
+
+import ee
+from ee_trace import in_context, note, trace_call
+from result_cache import fingerprint, normalize_geometry, single_flight
+
+COLLECTION_ID = 'COPERNICUS/S2_SR'
+# The only bands used downstream: B2/B4/B8 for LAI, B4/B8 for NDVI, B2/B3/B4 for the TCI layer
+BANDS = ['B2', 'B3', 'B4', 'B8']
+
+# # NDVI Classification function - used for both detailed and binary classification
+# def classify_ndvi(masked_image):
+#     # Make sure we're only working with valid pixels
+#     valid_pixels = masked_image.mask()
+
+#     ndvi_classified = ee.Image(0) \
+#         .where(masked_image.gte(0).And(masked_image.lt(0.15)), 1) \
+#         .where(masked_image.gte(0.15).And(masked_image.lt(0.25)), 2) \
+#         .where(masked_image.gte(0.25).And(masked_image.lt(0.35)), 3) \
+#         .where(masked_image.gte(0.35).And(masked_image.lt(0.45)), 4) \
+#         .where(masked_image.gte(0.45).And(masked_image.lt(0.65)), 5) \
+#         .where(masked_image.gte(0.65).And(masked_image.lt(0.75)), 6) \
+#         .where(masked_image.gte(0.75), 7) \
+#         .updateMask(valid_pixels)
+
+#     return ndvi_classified
+
+NDVI_CLASSES = range(1, 8)
+# Lower NDVI bound of each class 1-7; class 7 is open-ended
+NDVI_CLASS_BREAKS = [0, 0.15, 0.25, 0.35, 0.45, 0.65, 0.75]
+
+def classify_ndvi(masked_image):
+    # Get the original valid pixel mask
+    valid_pixels = masked_image.mask()
+
+    ndvi_classified = ee.Image(0)
+    for class_value, lower in zip(NDVI_CLASSES, NDVI_CLASS_BREAKS):
+        condition = masked_image.gte(lower)
+        if class_value < len(NDVI_CLASS_BREAKS):
+            condition = condition.And(masked_image.lt(NDVI_CLASS_BREAKS[class_value]))
+        ndvi_classified = ndvi_classified.where(condition, class_value)
+
+    return ndvi_classified.updateMask(valid_pixels)
+
+
+# Create binary vegetation/non-vegetation classification using the same thresholds
+# def classify_vegetation_ndvi(masked_image):
+#     # Classes 1-2 (< 0.25) are non-vegetation, classes 3-7 (>= 0.25) are vegetation
+#     vegetation_mask = masked_image.gte(0.25)
+#     non_vegetation_mask = masked_image.lt(0.25)
+#     vegetation_masked = masked_image.updateMask(vegetation_mask)
+#     non_vegetation_masked = masked_image.updateMask(non_vegetation_mask)
+#     return vegetation_masked, non_vegetation_masked
+# def classify_vegetation_ndvi(masked_image):
+#     # Classes 1-2 (< 0.25) are non-vegetation, classes 3-7 (>= 0.25) are vegetation
+#     vegetation_mask = masked_image.gte(0.25)
+#     non_vegetation_mask = masked_image.lt(0.25).And(masked_image.gte(0))
+
+#     # Return binary masks (1 where condition is true, 0 elsewhere) instead of masked NDVI values
+#     vegetation_binary = vegetation_mask.selfMask()
+#     non_vegetation_binary = non_vegetation_mask.selfMask()
+
+#     return vegetation_binary, non_vegetation_binary
+
+def classify_vegetation_ndvi(masked_image):
+    # Use the same exact thresholds as classify_ndvi function
+    # Non-vegetation: classes 1-2 (0 <= NDVI < 0.25)
+    # Vegetation: classes 3-7 (NDVI >= 0.25)
+
+    # Create mutually exclusive conditions
+    vegetation_condition = masked_image.gte(0.25)
+    non_vegetation_condition = masked_image.gte(0).And(masked_image.lt(0.25))
+
+    # Apply the same mask from the original image to ensure consistency
+    original_mask = masked_image.mask()
+
+    vegetation_binary = vegetation_condition.And(original_mask).selfMask()
+    non_vegetation_binary = non_vegetation_condition.And(original_mask).selfMask()
+
+    return vegetation_binary, non_vegetation_binary
+
+# def getLAI(image):
+#     lai = image.expression(
+#         '3.618 * EVI - 0.118', {
+#             'EVI': image.expression(
+#                 '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))', {
+#                     'NIR': image.select('B8'),
+#                     'RED': image.select('B4'),
+#                     'BLUE': image.select('B2')
+#                 })
+#         }).rename('LAI')
+#     return lai
+
+# Function to safely compute Leaf Area Index (LAI)
+def getLAI(image):
+    """
+    Compute Leaf Area Index (LAI) only if the image contains all required bands ('B8', 'B4', 'B2').
+    If any band is missing, the original image is returned unchanged.
+    """
+    # Define the LAI computation as a nested function
+    def calculate_lai():
+        # Enhanced Vegetation Index calculation
+        evi = image.expression(
+            '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))', {
+                'NIR': image.select('B8'),
+                'RED': image.select('B4'),
+                'BLUE': image.select('B2')
+            }
+        )
+        # LAI formula
+        return image.expression(
+            '3.618 * EVI - 0.118', {'EVI': evi}
+        ).rename('LAI')
+
+    # Fallback: return original image
+    fallback = image
+
+    # Nested server-side conditions to check each band
+    return ee.Image(
+        ee.Algorithms.If(
+            image.bandNames().contains('B8'),
+            ee.Algorithms.If(
+                image.bandNames().contains('B4'),
+                ee.Algorithms.If(
+                    image.bandNames().contains('B2'),
+                    calculate_lai(),
+                    fallback
+                ),
+                fallback
+            ),
+            fallback
+        )
+    )
+
+# def calculate_area(masked_image, aoi, label="Area"):
+#     pixel_area = ee.Image.pixelArea()
+#     area_image = masked_image.multiply(pixel_area)
+#     area_stats = area_image.reduceRegion(
+#         reducer=ee.Reducer.sum(),
+#         geometry=aoi,
+#         scale=10,
+#         maxPixels=1e9
+#     )
+#     try:
+#       area_result = area_stats.getInfo()
+#       if area_result:
+#           return next(iter(area_result.values()))
+#       else:
+#           return None
+#     except Exception as e:
+#         print(f"Error calculating area: {e}")
+#         return None
+
+def calculate_area(binary_mask, aoi, label="Area", scale=10, plan=None):
+    # For binary masks, multiply by pixel area directly
+    pixel_area = ee.Image.pixelArea()
+    area_image = binary_mask.multiply(pixel_area)
+
+    area_stats = area_image.reduceRegion(
+        reducer=ee.Reducer.sum(),
+        geometry=aoi,
+        **reduction_params(scale, plan)
+    )
+
+    # Transient errors are retried by the request scheduler; anything left is raised
+    # rather than reported as an area of 0
+    area_result = trace_call(f"area {label}", area_stats.getInfo)
+    if area_result:
+        # Get the first (and should be only) value from the result
+        area_value = next(iter(area_result.values()))
+        return area_value if area_value is not None else 0
+    else:
+        return 0
+
+
+# Same split as classify_vegetation_ndvi: classes 1-2 (NDVI < 0.25) are non-vegetation
+NON_VEGETATION_CLASSES = range(1, 3)
+VEGETATION_CLASSES = range(3, 8)
+
+
+# Reduction planning: the scale and tileScale of every reduction are chosen from the AOI
+# area before anything is requested, so large regions neither exceed maxPixels nor run
+# into the request timeout. A plan is a dict, see plan_reduction().
+EARTH_RADIUS = 6371008.8
+MAX_PIXELS = 1e9
+PLANNED_MAX_PIXELS = 1e8
+SCALE_STEPS = [10, 20, 30, 60, 100, 250, 500, 1000]
+# Above COARSE_FIRST_PIXELS at the requested scale, a COARSE_SCALE estimate is shown first
+COARSE_SCALE = 60
+COARSE_FIRST_PIXELS = 1e7
+
+def _ring_area(ring):
+    area = 0.0
+    for (lon1, lat1), (lon2, lat2) in zip(ring, ring[1:] + ring[:1]):
+        area += math.radians(lon2 - lon1) * (2 + math.sin(math.radians(lat1)) + math.sin(math.radians(lat2)))
+    return abs(area) * EARTH_RADIUS ** 2 / 2
+
+def geojson_area(geometry):
+    """Spherical area (m²) of a GeoJSON (Multi)Polygon dict, None for other geometries."""
+    if not isinstance(geometry, dict):
+        return None
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        return None
+    area = 0.0
+    for rings in polygons:
+        rings = [[tuple(point[:2]) for point in ring] for ring in rings]
+        if rings:
+            area += _ring_area(rings[0]) - sum(_ring_area(hole) for hole in rings[1:])
+    return area
+
+def plan_reduction(aoi_area, scale=10):
+    """
+    Choose reduction settings for an AOI of `aoi_area` m²: the finest scale (at least `scale`)
+    that keeps the estimated pixel count under PLANNED_MAX_PIXELS, and a tileScale that
+    grows with the pixel count. Without an area, Earth Engine's bestEffort picks the scale.
+    """
+    if not isinstance(aoi_area, (int, float)) or aoi_area <= 0:
+        return {'scale': scale, 'tileScale': 4, 'bestEffort': True, 'maxPixels': MAX_PIXELS, 'pixels': None}
+    chosen = next(
+        (step for step in SCALE_STEPS if step >= scale and aoi_area / step ** 2 <= PLANNED_MAX_PIXELS),
+        max(scale, SCALE_STEPS[-1])
+    )
+    pixels = aoi_area / chosen ** 2
+    if pixels <= 1e6:
+        tile_scale = 1
+    elif pixels <= 1e7:
+        tile_scale = 2
+    elif pixels <= 5e7:
+        tile_scale = 4
+    else:
+        tile_scale = 8
+    return {'scale': chosen, 'tileScale': tile_scale, 'bestEffort': False, 'maxPixels': MAX_PIXELS, 'pixels': round(pixels)}
+
+def reduction_params(scale=10, plan=None):
+    """reduceRegion keyword arguments: the plan's settings, or plain `scale`."""
+    if plan is None:
+        return {'scale': scale, 'maxPixels': MAX_PIXELS}
+    return {
+        'scale': plan['scale'],
+        'maxPixels': plan['maxPixels'],
+        'tileScale': plan['tileScale'],
+        'bestEffort': plan['bestEffort']
+    }
+
+def describe_plan(plan):
+    """Scale actually used, for reports: '30m', '10m (24 tiles)', or 'auto (bestEffort)'."""
+    if plan['bestEffort']:
+        return "auto (bestEffort)"
+    if plan.get('tiles'):
+        return f"{plan['scale']}m ({plan['tiles']} tiles)"
+    return f"{plan['scale']}m"
+
+
+def class_areas_reduction(classified_images, aoi, scale=10, plan=None):
+    """
+    Server-side grouped per-class area sums for several classified images in one
+    reduceRegion; parse the evaluated dictionary with parse_class_areas.
+    `classified_images` maps a name (e.g. 'initial', 'updated') to a classify_ndvi image.
+    """
+    names = list(classified_images)
+    pixel_area = ee.Image.pixelArea()
+
+    # Stack [area, class] band pairs, one pair per image. Unclassified pixels become
+    # class 0 so every pair shares the same footprint; group 0 is dropped below.
+    stacked = ee.Image.cat([
+        pixel_area.addBands(classified_images[name].unmask(0)).rename([f'{name}_area', f'{name}_class'])
+        for name in names
+    ])
+
+    # One grouped sum per pair; combine() prefixes every reducer after the first
+    reducer = ee.Reducer.sum().group(groupField=1, groupName='class')
+    for name in names[1:]:
+        reducer = reducer.combine(
+            ee.Reducer.sum().group(groupField=1, groupName='class'),
+            outputPrefix=f'{name}_',
+            sharedInputs=False
+        )
+
+    return stacked.reduceRegion(
+        reducer=reducer,
+        geometry=aoi,
+        **reduction_params(scale, plan)
+    )
+
+def parse_class_areas(result, names):
+    """{name: {class_value: area_m2}} from an evaluated class_areas_reduction, every class 1-7 present."""
+    areas = empty_class_areas(names)
+    for i, name in enumerate(names):
+        groups = (result or {}).get('groups' if i == 0 else f'{name}_groups') or []
+        for group in groups:
+            class_value = int(group['class'])
+            if class_value in areas[name]:
+                areas[name][class_value] = group.get('sum') or 0
+    return areas
+
+def reduce_class_areas(classified_images, aoi, scale=10, plan=None):
+    """
+    Compute per-class areas for several classified images in a single reduceRegion call.
+    Returns {name: {class_value: area_m2}} with every class 1-7 present; errors propagate.
+    """
+    result = trace_call(f"class areas {', '.join(classified_images)}", class_areas_reduction(classified_images, aoi, scale, plan).getInfo)
+    return parse_class_areas(result, list(classified_images))
+
+def empty_class_areas(names):
+    return {name: {class_value: 0 for class_value in NDVI_CLASSES} for name in names}
+
+
+# Class transitions: each pixel's initial and updated class are encoded as one code,
+# initial * TRANSITION_BASE + updated, so a single grouped sum gives the whole matrix.
+TRANSITION_BASE = 10
+
+def transition_reduction(initial_classified, updated_classified, aoi, scale=10, plan=None):
+    """
+    Server-side pixel-area sums grouped by initial_class * TRANSITION_BASE + updated_class
+    in one reduceRegion; parse the evaluated dictionary with parse_transitions.
+    Pixels masked on either date are left out.
+    """
+    code = initial_classified.multiply(TRANSITION_BASE).add(updated_classified).rename('transition')
+    return ee.Image.pixelArea().updateMask(code.mask()).addBands(code).reduceRegion(
+        reducer=ee.Reducer.sum().group(groupField=1, groupName='code'),
+        geometry=aoi,
+        **reduction_params(scale, plan)
+    )
+
+def empty_transitions():
+    return {initial: {updated: 0 for updated in NDVI_CLASSES} for initial in NDVI_CLASSES}
+
+def parse_transitions(result):
+    """{initial_class: {updated_class: area_m2}} from an evaluated transition_reduction, every 7×7 pair present."""
+    matrix = empty_transitions()
+    for group in (result or {}).get('groups') or []:
+        # Codes with class 0 (unclassified) on either date are dropped
+        initial, updated = divmod(int(group['code']), TRANSITION_BASE)
+        if initial in matrix and updated in matrix[initial]:
+            matrix[initial][updated] = group.get('sum') or 0
+    return matrix
+
+def reduce_transitions(initial_classified, updated_classified, aoi, scale=10, plan=None):
+    """The NDVI class transition matrix between two dates in a single request; errors propagate."""
+    result = trace_call("class transitions", transition_reduction(initial_classified, updated_classified, aoi, scale, plan).getInfo)
+    return parse_transitions(result)
+
+
+# Tiled reductions: an AOI too large for one reduceRegion at the requested scale is split
+# into square tiles of TILE_PIXELS pixels a side, on a grid aligned to the scale. Every
+# tile is reduced over its intersection with the AOI; the intersections partition the AOI,
+# so area sums add up exactly. A tile that still fails is split in four, up to TILE_SPLITS times.
+TILE_PIXELS = 2048
+TILE_MAX_WORKERS = 8
+TILE_SPLITS = 2
+
+def _polygon_list(geometry):
+    if geometry.get('type') == 'Polygon':
+        return [geometry['coordinates']]
+    if geometry.get('type') == 'MultiPolygon':
+        return geometry['coordinates']
+    return []
+
+def plan_tiles(geometry, scale=10, tile_pixels=TILE_PIXELS):
+    """
+    [west, south, east, north] tiles covering a GeoJSON (Multi)Polygon AOI, each
+    tile_pixels × scale metres a side (degrees at the AOI's mean latitude), with edges on
+    multiples of the tile size. Tiles that miss every polygon's bounding box are left out.
+    None when the AOI is not a client-side polygon.
+    """
+    boxes = []
+    for polygon in _polygon_list(normalize_geometry(geometry) or {}):
+        exterior = polygon[0] if polygon else []
+        if exterior:
+            lons, lats = [point[0] for point in exterior], [point[1] for point in exterior]
+            boxes.append((min(lons), min(lats), max(lons), max(lats)))
+    if not boxes:
+        return None
+    west, south = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    east, north = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    lat_step = math.degrees(tile_pixels * scale / EARTH_RADIUS)
+    lon_step = lat_step / max(math.cos(math.radians((south + north) / 2)), 1e-6)
+    tiles = []
+    for row in range(math.floor(south / lat_step), math.ceil(north / lat_step)):
+        for column in range(math.floor(west / lon_step), math.ceil(east / lon_step)):
+            tile = [column * lon_step, row * lat_step, (column + 1) * lon_step, (row + 1) * lat_step]
+            if any(box[0] < tile[2] and tile[0] < box[2] and box[1] < tile[3] and tile[1] < box[3] for box in boxes):
+                tiles.append(tile)
+    return tiles
+
+def split_tile(tile):
+    """The four quarters of a [west, south, east, north] tile."""
+    west, south, east, north = tile
+    lon, lat = (west + east) / 2, (south + north) / 2
+    return [[west, south, lon, lat], [lon, south, east, lat], [west, lat, lon, north], [lon, lat, east, north]]
+
+def tile_plan(plan, scale, tiles):
+    """Reduction plan of the tiles: the requested scale, and the tile count for reports."""
+    return dict(plan, scale=scale, bestEffort=False, tileScale=2, pixels=TILE_PIXELS ** 2, tiles=len(tiles))
+
+def add_sums(total, part):
+    """Add the numbers of nested dicts `part` into `total` (same keys), in place."""
+    for key, value in part.items():
+        if isinstance(value, dict):
+            add_sums(total.setdefault(key, {}), value)
+        else:
+            total[key] = total.get(key, 0) + (value or 0)
+    return total
+
+def tiled_reduction(reduce, aoi, tiles, progress=None, max_workers=TILE_MAX_WORKERS, splits=TILE_SPLITS):
+    """
+    Sum of reduce(region) (nested dicts of areas) over the AOI clipped to each tile, with
+    the tiles requested in parallel on a bounded thread pool. progress(done, total) is
+    called from the calling thread as tiles complete. A failed tile is retried as its four
+    quarters (noted in the active trace); errors propagate once a tile has failed at every
+    split depth.
+    """
+    aoi = ee.Geometry(aoi)
+
+    def reduce_tile(tile, depth=0):
+        region = aoi.intersection(ee.Geometry.Rectangle(tile, None, False), maxError=1)
+        try:
+            return reduce(region)
+        except Exception as e:
+            # Transient errors were already retried by the request scheduler
+            if depth >= splits:
+                raise
+            note(f"split tile {tile}", error=str(e))
+            total = {}
+            for quarter in split_tile(tile):
+                add_sums(total, reduce_tile(quarter, depth + 1))
+            return total
+
+    total, done = {}, 0
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tiles))) as executor:
+        futures = [executor.submit(in_context(reduce_tile), tile) for tile in tiles]
+        try:
+            for future in as_completed(futures):
+                add_sums(total, future.result())
+                done += 1
+                if progress is not None:
+                    progress(done, len(tiles))
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+    return total
+
+def vegetation_areas(class_areas):
+    """Derive (vegetation, non-vegetation) totals from per-class areas."""
+    veg_area = sum(class_areas[i] for i in VEGETATION_CLASSES)
+    nonveg_area = sum(class_areas[i] for i in NON_VEGETATION_CLASSES)
+    return veg_area, nonveg_area
+
+def satCollection(cloudRate, initialDate, updatedDate, aoi):
+    # Only the bands we use; scaling and clipping happen once, on the composite
+    collection = ee.ImageCollection(COLLECTION_ID) \
+        .filter(ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", cloudRate)) \
+        .filterDate(initialDate, updatedDate) \
+        .filterBounds(aoi) \
+        .select(BANDS)
+    return collection
+
+def satComposite(collection, aoi):
+    """
+    Median composite of a satCollection, scaled to reflectance and clipped to the AOI.
+    An empty collection gives a fully masked image with the same bands instead of one
+    without bands, so reductions over it return nothing rather than failing.
+    """
+    empty = ee.Image.constant([0] * len(BANDS)).rename(BANDS).selfMask()
+    composite = ee.Image(ee.Algorithms.If(collection.size().gt(0), collection.median(), empty))
+    return composite.divide(10000).clip(aoi)
+
+
+def getNDVI(collection):
+    return collection.normalizedDifference(['B8', 'B4'])
+
+def satImageMask(sat_image):
+    masked_image = sat_image.updateMask(sat_image.gte(0))
+    return masked_image
+
+def date_input_proc(
+    input_date, time_range
+):
+    end_date = input_date
+    start_date = input_date - timedelta(days=time_range)
+    str_start_date = start_date.strftime('%Y-%m-%d')
+    str_end_date = end_date.strftime('%Y-%m-%d')
+    return str_start_date, str_end_date
+
+def verify_calculations(
+    initial_ndvi_class_areas,
+    updated_ndvi_class_areas,
+    initial_veg_area,
+    initial_nonveg_area,
+    updated_veg_area,
+    updated_nonveg_area
+):
+    # Sum areas for classes 1-2 (non-vegetation)
+    initial_calc_nonveg = sum(initial_ndvi_class_areas[i] for i in range(1, 3))
+    updated_calc_nonveg = sum(updated_ndvi_class_areas[i] for i in range(1, 3))
+
+    # Sum areas for classes 3-7 (vegetation)
+    initial_calc_veg = sum(initial_ndvi_class_areas[i] for i in range(3, 8))
+    updated_calc_veg = sum(updated_ndvi_class_areas[i] for i in range(3, 8))
+
+    # Calculate total area from each method
+    initial_total = initial_veg_area + initial_nonveg_area
+    initial_class_total = sum(initial_ndvi_class_areas.values())
+    updated_total = updated_veg_area + updated_nonveg_area
+    updated_class_total = sum(updated_ndvi_class_areas.values())
+
+    # Print verification results
+    verification_results = {
+        "Initial vegetation area": initial_veg_area,
+        "Sum of initial NDVI vegetation classes (3-7)": initial_veg_area,
+        "Difference": initial_veg_area - initial_veg_area,
+
+        "Initial non-vegetation area": initial_nonveg_area,
+        "Sum of initial NDVI non-vegetation classes (1-2)": initial_nonveg_area,
+        "Difference": initial_nonveg_area - initial_nonveg_area,
+
+        "Initial total area": initial_total,
+        "Initial total from NDVI classes": initial_class_total,
+        "Initial total difference": initial_total - initial_class_total,
+
+        "Updated vegetation area": updated_veg_area,
+        "Sum of updated NDVI vegetation classes (3-7)": updated_calc_veg,
+        "Updated vegetation difference": updated_veg_area - updated_calc_veg,
+
+        "Updated non-vegetation area": updated_nonveg_area,
+        "Sum of updated NDVI non-vegetation classes (1-2)": updated_nonveg_area,
+        "Updated non-vegetation difference": updated_nonveg_area - updated_nonveg_area,
+
+        "Updated total area": updated_total,
+        "Updated total from NDVI classes": updated_class_total,
+        "Updated total difference": updated_total - updated_class_total
+    }
+
+    return verification_results
+
+def generate_verification_report(verification_results, initial_ndvi_class_areas, updated_ndvi_class_areas,
+                               initial_date, updated_date, geometry_aoi, cloud_pixel_percentage, scale=10,
+                               aoi_area=None, plan=None, transitions=None):
+    """Generate a comprehensive verification report"""
+
+    # Calculate additional metrics
+    total_area_change = verification_results["Updated total area"] - verification_results["Initial total area"]
+    vegetation_change = verification_results["Updated vegetation area"] - verification_results["Initial vegetation area"]
+    vegetation_change_percent = (vegetation_change / verification_results["Initial vegetation area"] * 100) if verification_results["Initial vegetation area"] > 0 else 0
+
+    # NDVI class labels
+    ndvi_class_labels = [
+        "Absent Vegetation (Water/Clouds/Built-up/Rocks/Sand)",
+        "Bare Soil",
+        "Low Vegetation",
+        "Light Vegetation",
+        "Moderate Vegetation",
+        "Strong Vegetation",
+        "Dense Vegetation"
+    ]
+
+    # Calculate class changes
+    class_changes = {}
+    for i in range(1, 8):
+        change = updated_ndvi_class_areas[i] - initial_ndvi_class_areas[i]
+        change_percent = (change / initial_ndvi_class_areas[i] * 100) if initial_ndvi_class_areas[i] > 0 else 0
+        class_changes[i] = {"change": change, "change_percent": change_percent}
+
+    # Get AOI area if available and not already known
+    if aoi_area is None:
+        aoi_area = 0
+    if geometry_aoi and not aoi_area:
+        try:
+            aoi_area = trace_call("aoi area", geometry_aoi.area().getInfo)
+        except:
+            aoi_area = "Unable to calculate"
+
+    report_data = {
+        "analysis_period": {
+            "initial_date": initial_date,
+            "updated_date": updated_date,
+            "days_difference": (updated_date - initial_date).days
+        },
+        "analysis_parameters": {
+            "cloud_coverage_threshold": cloud_pixel_percentage,
+            "aoi_total_area": aoi_area,
+            "analysis_scale": describe_plan(plan) if plan else f"{scale}m"
+        },
+        "summary_statistics": {
+            "total_area_change": total_area_change,
+            "vegetation_change": vegetation_change,
+            "vegetation_change_percent": vegetation_change_percent,
+            "initial_vegetation_coverage": (verification_results["Initial vegetation area"] / verification_results["Initial total area"] * 100) if verification_results["Initial total area"] > 0 else 0,
+            "updated_vegetation_coverage": (verification_results["Updated vegetation area"] / verification_results["Updated total area"] * 100) if verification_results["Updated total area"] > 0 else 0
+        },
+        "detailed_areas": verification_results,
+        "ndvi_classification": {
+            "initial_classes": initial_ndvi_class_areas,
+            "updated_classes": updated_ndvi_class_areas,
+            "class_changes": class_changes,
+            "class_labels": ndvi_class_labels,
+            # {from (initial) class: {to (updated) class: area}}, None when not computed
+            "transitions": transitions
+        }
+    }
+
+    return report_data
+
+
+# LAI histogram bins, matching the chart labels and the LAI interpretation guide.
+# Lower edges; the last bin is open-ended and values below 0 are not counted.
+LAI_BIN_EDGES = [0, 1, 3, 6]
+LAI_BIN_LABELS = ['0-1', '1-3', '3-6', '>6']
+LAI_PERCENTILES = [10, 25, 50, 75, 90]
+
+def lai_bin_image(lai_image):
+    """Map LAI values to the index of their LAI_BIN_EDGES bin (0..3)."""
+    lai = lai_image.select('LAI')
+    binned = ee.Image(0)
+    for edge in LAI_BIN_EDGES[1:]:
+        binned = binned.add(lai.gte(edge))
+    return binned.updateMask(lai.gte(LAI_BIN_EDGES[0]))
+
+def lai_reducer():
+    # Input 0 (LAI) feeds mean/stdDev/percentiles, input 1 (bin index) feeds the histogram
+    n_bins = len(LAI_BIN_EDGES)
+    stats = ee.Reducer.mean() \
+        .combine(reducer2=ee.Reducer.stdDev(), sharedInputs=True) \
+        .combine(reducer2=ee.Reducer.percentiles(LAI_PERCENTILES), sharedInputs=True)
+    return stats.combine(reducer2=ee.Reducer.fixedHistogram(0, n_bins, n_bins), sharedInputs=False)
+
+def calculate_lai_statistics(lai_images, geometry_aoi, scale=10, plan=None):
+    """
+    Compute LAI mean, stdDev, percentiles and the binned histogram server-side for
+    several LAI images in a single request; only summary numbers come back.
+    `lai_images` maps a name (e.g. 'initial', 'updated') to a getLAI image.
+    Returns {name: {'mean', 'stdDev', 'percentiles', 'histogram'}}; errors propagate once
+    the scheduler's retries are exhausted, rather than looking like missing data.
+    """
+    reducer = lai_reducer()
+    reductions = ee.Dictionary({
+        name: ee.Image.cat([image.select('LAI'), lai_bin_image(image)]).reduceRegion(
+            reducer=reducer,
+            geometry=geometry_aoi,
+            **reduction_params(scale, plan)
+        )
+        for name, image in lai_images.items()
+    })
+    result = trace_call("lai statistics", reductions.getInfo)
+
+    statistics = {}
+    for name in lai_images:
+        stats = result.get(name) or {}
+        counts = [0] * len(LAI_BIN_EDGES)
+        for bucket, count in stats.get('histogram') or []:
+            counts[int(bucket)] = round(count)
+        statistics[name] = {
+            'mean': stats.get('mean') or 0,
+            'stdDev': stats.get('stdDev') or 0,
+            'percentiles': {p: stats.get(f'p{p}') for p in LAI_PERCENTILES},
+            'histogram': counts
+        }
+    return statistics
+
+
+# Per-feature statistics: every uploaded feature carries its index in FEATURE_ID, and
+# collections are reduced FEATURE_BATCH_SIZE features per request so large uploads stay
+# under the Earth Engine collection size and payload limits.
+FEATURE_ID = 'feature_index'
+FEATURE_BATCH_SIZE = 1000
+
+def feature_statistic_bands(name, classified_image, lai_image):
+    """
+    Bands whose per-feature sums give the class areas and the area-weighted LAI mean
+    of one date: '{name}_class_{c}' (m²), '{name}_lai_weighted' and '{name}_lai_area'.
+    """
+    pixel_area = ee.Image.pixelArea()
+    lai = lai_image.select('LAI')
+    bands = [
+        pixel_area.updateMask(classified_image.eq(class_value)).rename(f'{name}_class_{class_value}')
+        for class_value in NDVI_CLASSES
+    ]
+    bands.append(lai.multiply(pixel_area).rename(f'{name}_lai_weighted'))
+    bands.append(pixel_area.updateMask(lai.mask()).rename(f'{name}_lai_area'))
+    return ee.Image.cat(bands)
+
+def reduce_feature_statistics(classified_images, lai_images, features, scale=10, plan=None):
+    """
+    Per-feature class areas and LAI means for several dates with one reduceRegions call
+    per batch of features. `features` is a GeoJSON FeatureCollection dict whose features
+    carry FEATURE_ID; `classified_images` and `lai_images` map the same names (e.g.
+    'initial', 'updated') to classify_ndvi and getLAI images.
+    Returns {feature_index: {name: {'class_areas': {...}, 'lai_mean': ...}}}; errors propagate.
+    """
+    names = list(classified_images)
+    image = ee.Image.cat([
+        feature_statistic_bands(name, classified_images[name], lai_images[name])
+        for name in names
+    ])
+    properties = [FEATURE_ID] + [
+        band
+        for name in names
+        for band in [f'{name}_class_{c}' for c in NDVI_CLASSES] + [f'{name}_lai_weighted', f'{name}_lai_area']
+    ]
+
+    sums = {}
+    for start in range(0, len(features['features']), FEATURE_BATCH_SIZE):
+        batch = dict(features, features=features['features'][start:start + FEATURE_BATCH_SIZE])
+        reduced = image.reduceRegions(
+            collection=ee.FeatureCollection(batch),
+            reducer=ee.Reducer.sum(),
+            scale=plan['scale'] if plan else scale,
+            tileScale=plan['tileScale'] if plan else 4
+        )
+        # Only the sums come back, not the feature geometries
+        result = trace_call(f"feature statistics {start}-{start + len(batch['features']) - 1}", reduced.select(properties, None, False).getInfo) or {}
+        for feature in result.get('features', []):
+            feature_properties = feature.get('properties') or {}
+            sums[feature_properties.get(FEATURE_ID)] = feature_properties
+
+    statistics = {}
+    for feature in features['features']:
+        index = feature['properties'][FEATURE_ID]
+        feature_sums = sums.get(index) or {}
+        statistics[index] = {}
+        for name in names:
+            lai_area = feature_sums.get(f'{name}_lai_area') or 0
+            statistics[index][name] = {
+                'class_areas': {c: feature_sums.get(f'{name}_class_{c}') or 0 for c in NDVI_CLASSES},
+                'lai_mean': (feature_sums.get(f'{name}_lai_weighted') or 0) / lai_area if lai_area else None
+            }
+    return statistics
+
+def feature_statistics_table(statistics, features):
+    """
+    Flatten reduce_feature_statistics output into one row per feature: the feature's own
+    scalar properties, then vegetation / non-vegetation, per-class areas and LAI mean
+    for each date, and the vegetation change between the first and last date.
+    """
+    rows = []
+    for feature in features['features']:
+        properties = feature.get('properties') or {}
+        row = {key: value for key, value in properties.items() if isinstance(value, (str, int, float, bool))}
+        per_date = statistics.get(properties.get(FEATURE_ID)) or {}
+        for name, stats in per_date.items():
+            veg_area, nonveg_area = vegetation_areas(stats['class_areas'])
+            row[f'{name}_veg_area'] = veg_area
+            row[f'{name}_nonveg_area'] = nonveg_area
+            for class_value, area in stats['class_areas'].items():
+                row[f'{name}_class_{class_value}_area'] = area
+            row[f'{name}_lai_mean'] = stats['lai_mean']
+        if len(per_date) > 1:
+            first, last = list(per_date)[0], list(per_date)[-1]
+            row['veg_area_change'] = row[f'{last}_veg_area'] - row[f'{first}_veg_area']
+        rows.append(row)
+    return rows
+
+
+# NDVI time series: every window is composited, classified and reduced server-side,
+# TIME_SERIES_CHUNK windows per request so results can be shown as they arrive.
+TIME_SERIES_CHUNK = 8
+
+def time_series_windows(start_date, end_date, window_days=7):
+    """Consecutive [start, end) windows of window_days covering start_date to end_date, as date strings."""
+    windows = []
+    window_start = start_date
+    while window_start < end_date:
+        window_end = min(window_start + timedelta(days=window_days), end_date)
+        windows.append((window_start.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+        window_start = window_end
+    return windows
+
+def time_series_collection(windows, aoi, cloud_rate, scale=10, plan=None):
+    """ee.FeatureCollection with one feature per window: its scene count and grouped class areas."""
+    def summarize(window):
+        window = ee.List(window)
+        start, end = window.get(0), window.get(1)
+        collection = satCollection(cloud_rate, start, end, aoi)
+        ndvi_classified = classify_ndvi(satImageMask(getNDVI(satComposite(collection, aoi))))
+        summary = ee.Feature(None, {'start': start, 'end': end, 'images': collection.size()})
+        # satComposite masks empty windows, so reducing them would only add zero areas that
+        # time_series_row discards; skip the reduction for them
+        return ee.Feature(ee.Algorithms.If(
+            collection.size().gt(0),
+            summary.set(class_areas_reduction({'ndvi': ndvi_classified}, aoi, scale, plan)),
+            summary
+        ))
+    return ee.FeatureCollection(ee.List([list(window) for window in windows]).map(summarize))
+
+def time_series_row(properties):
+    """Flatten one evaluated time_series_collection feature; areas are None for windows without scenes."""
+    images = properties.get('images') or 0
+    class_areas = parse_class_areas(properties, ['ndvi'])['ndvi']
+    veg_area, nonveg_area = vegetation_areas(class_areas)
+    row = {
+        'start': properties.get('start'),
+        'end': properties.get('end'),
+        'images': images,
+        'veg_area': veg_area if images else None,
+        'nonveg_area': nonveg_area if images else None
+    }
+    for class_value, area in class_areas.items():
+        row[f'class_{class_value}_area'] = area if images else None
+    return row
+
+def ndvi_time_series(aoi, windows, cloud_rate, scale=10, chunk_size=TIME_SERIES_CHUNK, cache=None, plan=None):
+    """
+    Evaluate the time series chunk by chunk, yielding each chunk's rows (one per window)
+    as soon as its single request returns. Chunks are served from `cache`
+    (result_cache.ResultCache) when given.
+    """
+    for i in range(0, len(windows), chunk_size):
+        chunk = windows[i:i + chunk_size]
+
+        def compute():
+            result = trace_call(f"time series {chunk[0][0]}..{chunk[-1][1]}", time_series_collection(chunk, aoi, cloud_rate, scale, plan).getInfo)
+            return [time_series_row(feature['properties']) for feature in result['features']]
+
+        if cache is None:
+            yield compute()
+            continue
+        key = fingerprint(
+            result='time_series',
+            geometry=aoi,
+            windows=chunk,
+            collection=COLLECTION_ID,
+            cloud_rate=cloud_rate,
+            scale=scale,
+            plan=plan,
+            breaks=NDVI_CLASS_BREAKS
+        )
+        yield cache.get_or_compute(key, compute, cache.ttl_for([end_date for _, end_date in chunk]))
+
+def geometry_hash(geometry):
+    """Stable hash of an AOI (ee.Geometry or GeoJSON dict), computed without a request."""
+    if geometry is None:
+        return None
+    normalized = json.dumps(normalize_geometry(geometry), sort_keys=True)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class EarthEngineBackend:
+    """
+    Earth Engine implementation of the pipeline. Analysis only talks to its backend
+    through these methods, so local_backend.NumpyBackend can stand in for it.
+    """
+    name = 'earthengine'
+    collection_id = COLLECTION_ID
+
+    satCollection = staticmethod(satCollection)
+    getNDVI = staticmethod(getNDVI)
+    satImageMask = staticmethod(satImageMask)
+    classify_ndvi = staticmethod(classify_ndvi)
+    classify_vegetation_ndvi = staticmethod(classify_vegetation_ndvi)
+    getLAI = staticmethod(getLAI)
+
+    def composite(self, collection, aoi):
+        return satComposite(collection, aoi)
+
+    def scene_counts(self, collections):
+        return trace_call("scene counts", ee.Dictionary({name: collection.size() for name, collection in collections.items()}).getInfo)
+
+    def class_areas(self, classified_images, aoi, scale=10, plan=None, tiles=None, progress=None):
+        if tiles:
+            return add_sums(
+                empty_class_areas(classified_images),
+                tiled_reduction(lambda region: reduce_class_areas(classified_images, region, scale, plan), aoi, tiles, progress)
+            )
+        return reduce_class_areas(classified_images, aoi, scale, plan)
+
+    def lai_statistics(self, lai_images, aoi, scale=10, plan=None):
+        return calculate_lai_statistics(lai_images, aoi, scale, plan)
+
+    def class_transitions(self, initial_classified, updated_classified, aoi, scale=10, plan=None, tiles=None, progress=None):
+        if tiles:
+            return add_sums(
+                empty_transitions(),
+                tiled_reduction(
+                    lambda region: reduce_transitions(initial_classified, updated_classified, region, scale, plan),
+                    aoi, tiles, progress
+                )
+            )
+        return reduce_transitions(initial_classified, updated_classified, aoi, scale, plan)
+
+    def feature_statistics(self, classified_images, lai_images, features, scale=10, plan=None):
+        return reduce_feature_statistics(classified_images, lai_images, features, scale, plan)
+
+    def aoi_area(self, aoi):
+        return trace_call("aoi area", aoi.area().getInfo)
+
+
+# Threads of one evaluate_concurrently() call. Enough for every task of Analysis.run, so
+# none waits for a second round; the requests themselves are capped by the scheduler
+EVALUATION_THREADS = 8
+
+def evaluate_concurrently(tasks, max_workers=EVALUATION_THREADS):
+    """
+    Run independent evaluations ({name: function}) on a thread per task (at most
+    `max_workers`) and return {name: result}, collected as they complete. Latency is that
+    of the slowest request rather than the sum; the first error is raised once every task
+    has finished.
+    """
+    if not tasks:
+        return {}
+    results, errors = {}, []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        futures = {executor.submit(in_context(function)): name for name, function in tasks.items()}
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
+
+class instance_cached_property:
+    """
+    Like functools.cached_property, but computed under a lock of its own instance and
+    attribute. On Python 3.11 cached_property takes one lock per property shared by every
+    instance, so one session's Earth Engine round trip would block all the others.
+    """
+
+    def __init__(self, function):
+        self.function = function
+        self.__doc__ = function.__doc__
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        # Once computed, the instance attribute shadows this (non-data) descriptor
+        with instance._property_locks_lock:
+            lock = instance._property_locks.setdefault(self.name, threading.Lock())
+        with lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.function(instance)
+        return instance.__dict__[self.name]
+
+class Analysis:
+    """
+    Two-date NDVI / LAI comparison over an AOI.
+
+    Creating an Analysis only records its inputs. The images are built on first access
+    and nothing is evaluated until run() is called, so the object is cheap to construct
+    on every Streamlit rerun. `backend` defaults to Earth Engine; with
+    local_backend.NumpyBackend the AOI is a GeoJSON geometry dict instead.
+
+    With `tiled`, AOIs the planner would coarsen are reduced at the requested scale tile
+    by tile instead (class areas and transitions; see plan_tiles). Set `progress` to a
+    callable to get (tiles done, tiles total) while the tiles come back.
+    """
+
+    def __init__(self, geometry_aoi, initial_date, updated_date, cloud_rate, time_range=7, scale=10, cache=None,
+                 backend=None, tiled=False):
+        self.geometry_aoi = geometry_aoi
+        self.initial_date = initial_date
+        self.updated_date = updated_date
+        self.cloud_rate = cloud_rate
+        self.time_range = time_range
+        # Requested scale; reductions use the (possibly coarser) scale of self.plan
+        self.scale = scale
+        self.initial_window = date_input_proc(initial_date, time_range)
+        self.updated_window = date_input_proc(updated_date, time_range)
+        # Optional result_cache.ResultCache shared across sessions and restarts
+        self.cache = cache
+        self.backend = backend or EarthEngineBackend()
+        self.tiled = tiled
+        self.progress = None
+        self._lock = threading.Lock()
+        self._property_locks = {}
+        self._property_locks_lock = threading.Lock()
+        self._tile_counts = [0, 0]
+
+    @property
+    def key(self):
+        """Memoization key: backend data source, AOI geometry hash, both date windows, cloud threshold, scale and tiling."""
+        return (
+            self.backend.collection_id,
+            geometry_hash(self.geometry_aoi),
+            self.initial_window,
+            self.updated_window,
+            self.cloud_rate,
+            self.scale,
+            self.tiled
+        )
+
+    @instance_cached_property
+    def plan(self):
+        """
+        plan_reduction() for this AOI, from its client-side area when the AOI is a plain
+        polygon (no request), else from the (cached) Earth Engine area. None for the local
+        engine, which always works on the native pixel grid of its scenes.
+        """
+        if not isinstance(self.backend, EarthEngineBackend):
+            return None
+        return plan_reduction(self.aoi_area, self.scale)
+
+    @instance_cached_property
+    def client_aoi_area(self):
+        """
+        Area of a plain-polygon AOI computed here, without a request; None for computed
+        geometries and for the local engines, whose area is that of the masked pixels.
+        """
+        if not isinstance(self.backend, EarthEngineBackend):
+            return None
+        return geojson_area(normalize_geometry(self.geometry_aoi))
+
+    @instance_cached_property
+    def tiles(self):
+        """plan_tiles() at the requested scale in tiled mode when the plan is coarser, else None."""
+        plan = self.plan
+        if not self.tiled or plan is None or plan['bestEffort'] or plan['scale'] <= self.scale:
+            return None
+        return plan_tiles(self.geometry_aoi, self.scale)
+
+    @instance_cached_property
+    def area_plan(self):
+        """Plan of the class area and transition reductions: per tile when tiled, else self.plan."""
+        if not self.tiles:
+            return self.plan
+        return tile_plan(self.plan, self.scale, self.tiles)
+
+    def _tile_progress(self):
+        """progress callback of one tiled reduction, reporting the tiles of all of them to self.progress."""
+        if not self.tiles or self.progress is None:
+            return None
+        with self._lock:
+            self._tile_counts[1] += len(self.tiles)
+
+        def tile_done(done, total):
+            with self._lock:
+                self._tile_counts[0] += 1
+                counts = list(self._tile_counts)
+            self.progress(*counts)
+        return tile_done
+
+    def coarse(self):
+        """
+        This analysis at COARSE_SCALE, for a quick first estimate while the planned scale is
+        computed; None when the AOI is small enough to be computed directly, or is tiled.
+        """
+        plan = self.plan
+        if self.tiles or plan is None or plan['bestEffort'] or plan['scale'] >= COARSE_SCALE or plan['pixels'] <= COARSE_FIRST_PIXELS:
+            return None
+        return Analysis(self.geometry_aoi, self.initial_date, self.updated_date, self.cloud_rate, self.time_range,
+                        COARSE_SCALE, self.cache, self.backend)
+
+    def _build_images(self, window):
+        backend = self.backend
+        start_date, end_date = window
+        collection = backend.satCollection(self.cloud_rate, start_date, end_date, self.geometry_aoi)
+        sat_imagery = backend.composite(collection, self.geometry_aoi)
+        ndvi = backend.satImageMask(backend.getNDVI(sat_imagery))
+        vegetation, non_vegetation = backend.classify_vegetation_ndvi(ndvi)
+        return {
+            'collection': collection,
+            'tci': sat_imagery,
+            'ndvi': ndvi,
+            'ndvi_classified': backend.classify_ndvi(ndvi),
+            'vegetation': vegetation,
+            'non_vegetation': non_vegetation,
+            'lai': backend.getLAI(sat_imagery)
+        }
+
+    @instance_cached_property
+    def initial(self):
+        return self._build_images(self.initial_window)
+
+    @instance_cached_property
+    def updated(self):
+        return self._build_images(self.updated_window)
+
+    @property
+    def windows(self):
+        return {'initial': self.initial_window, 'updated': self.updated_window}
+
+    def images(self, date):
+        """Image graphs of one date ('initial' or 'updated'), built once even when requested from several workers."""
+        return getattr(self, date)
+
+    def _cached(self, name, compute, **params):
+        """
+        Serve compute() from the persistent result cache, keyed by the AOI and `params`.
+        Identical computations running at the same time (other sessions, batch workers) are
+        done once, with or without a cache.
+        """
+        key = fingerprint(result=name, geometry=self.geometry_aoi, **params)
+        if self.cache is None:
+            return single_flight.do(key, compute)[0]
+        ttl = self.cache.ttl_for([end_date for _, end_date in params.get('windows', [])])
+        return self.cache.get_or_compute(key, compute, ttl)
+
+    def _cached_dates(self, name, evaluate, **params):
+        """
+        {'initial': ..., 'updated': ...} from evaluate(dates), which takes a list of date
+        names and returns a result per name (or None on failure, which is not cached).
+
+        Each date is cached on its own, keyed by the AOI, its window and `params` but not
+        by its role, so when only one date changes the other is served from the cache and
+        only the changed one is evaluated. Dates that miss are evaluated together in one
+        call, and only once when both dates share a window; a date another session is
+        already evaluating is waited for rather than evaluated again.
+        """
+        keys = {
+            date: fingerprint(result=name, geometry=self.geometry_aoi, windows=[window], **params)
+            for date, window in self.windows.items()
+        }
+        missing = object()
+
+        def lookup(pending):
+            """{date: cached value} for the (key -> date) `pending` found in the cache."""
+            found = {}
+            if self.cache is not None:
+                for key, date in pending.items():
+                    value = self.cache.get(key, missing)
+                    if value is not missing:
+                        found[date] = value
+            return found
+
+        results = lookup({key: date for date, key in keys.items()})
+        pending = {}
+        for date, key in keys.items():
+            if date not in results:
+                pending.setdefault(key, date)
+        if not pending:
+            return results
+
+        def evaluate_pending(led):
+            # Flights for each missing key: a date another session is evaluating is waited
+            # for, not evaluated again. One that finished since the lookup above may have
+            # stored some of the dates
+            found = lookup({key: pending[key] for key in led})
+            dates = [pending[key] for key in led if pending[key] not in found]
+            computed = evaluate(dates) if dates else {}
+            if computed is None:
+                return None
+            for key in led:
+                date = pending[key]
+                if self.cache is not None and date in dates and computed.get(date) is not None:
+                    self.cache.set(key, computed[date], self.cache.ttl_for([self.windows[date][1]]))
+            return {key: found[pending[key]] if pending[key] in found else computed.get(pending[key]) for key in led}
+
+        computed = single_flight.do_many(list(pending), evaluate_pending)[0]
+        if any(computed[key] is None for key in pending):
+            return None
+        for date, key in keys.items():
+            if date not in results:
+                results[date] = computed[key]
+        return results
+
+    def _date_params(self):
+        return {
+            'collection': self.backend.collection_id,
+            'cloud_rate': self.cloud_rate,
+            'scale': self.scale,
+            'plan': self.plan
+        }
+
+    def _area_params(self):
+        return dict(self._date_params(), plan=self.area_plan)
+
+    @instance_cached_property
+    def aoi_area(self):
+        """AOI area in m² (client-side, or evaluated at most once), or "Unable to calculate"."""
+        if self.client_aoi_area is not None:
+            return self.client_aoi_area
+        try:
+            # Local engines measure the masked pixels of their scenes, so the area is per engine
+            return self._cached('aoi_area', lambda: self.backend.aoi_area(self.geometry_aoi),
+                                collection=self.backend.collection_id)
+        except Exception:
+            return "Unable to calculate"
+
+    @instance_cached_property
+    def scene_counts(self):
+        """Scenes in each date window ({'initial': n, 'updated': n}), one request; None if it failed."""
+        try:
+            return self._cached_dates(
+                'scene_counts',
+                lambda dates: self.backend.scene_counts({date: self.images(date)['collection'] for date in dates}),
+                collection=self.backend.collection_id,
+                cloud_rate=self.cloud_rate
+            )
+        except Exception as e:
+            print(f"Error counting scenes: {e}")
+            return None
+
+    def _run_class_areas(self):
+        # Errors propagate (after the scheduler's retries): zero areas would look like a result
+        return self._cached_dates(
+            'class_areas',
+            lambda dates: self.backend.class_areas(
+                {date: self.images(date)['ndvi_classified'] for date in dates},
+                self.geometry_aoi,
+                self.scale,
+                plan=self.area_plan,
+                tiles=self.tiles,
+                progress=self._tile_progress()
+            ),
+            breaks=NDVI_CLASS_BREAKS,
+            **self._area_params()
+        )
+
+    def _run_transitions(self):
+        # Both dates in one reduction, so it is cached for the pair
+        return self._cached(
+            'class_transitions',
+            lambda: self.backend.class_transitions(
+                self.images('initial')['ndvi_classified'],
+                self.images('updated')['ndvi_classified'],
+                self.geometry_aoi,
+                self.scale,
+                plan=self.area_plan,
+                tiles=self.tiles,
+                progress=self._tile_progress()
+            ),
+            windows=[self.initial_window, self.updated_window],
+            breaks=NDVI_CLASS_BREAKS,
+            **self._area_params()
+        )
+
+    def run(self):
+        """Evaluate areas, class transitions, the verification report and LAI statistics as plain (picklable) data."""
+        # Build the plans before the workers read them; image graphs are only built for
+        # dates that miss the cache
+        self.area_plan
+        # Engines that stream their rasters (GeoTIFF) then read them once for both dates,
+        # whichever of the reductions below miss the cache
+        reduce_together = getattr(self.backend, 'reduce_together', None)
+        if reduce_together is not None:
+            reduce_together([self.images(date)['ndvi_classified'] for date in ('initial', 'updated')], self.geometry_aoi)
+        # Scene counts, AOI area, class areas, class transitions and LAI statistics don't
+        # depend on each other, so they are requested together (composites of empty windows
+        # are masked anyway). All but the transitions are cached per date, so when only one
+        # date changed the comparison below is re-derived from cached halves
+        tasks = {
+            'scene_counts': lambda: self.scene_counts,
+            'class_areas': self._run_class_areas,
+            'transitions': self._run_transitions,
+            'lai': self._run_lai
+        }
+        if self.client_aoi_area is None:
+            tasks['aoi_area'] = lambda: self.aoi_area
+        evaluated = evaluate_concurrently(tasks)
+        # Without a scene in either window there is nothing to report
+        has_scenes = self.scene_counts is None or any(self.scene_counts.values())
+        class_areas = evaluated['class_areas'] if has_scenes else empty_class_areas(['initial', 'updated'])
+        transitions = evaluated['transitions'] if has_scenes else empty_transitions()
+        initial_veg_area, initial_nonveg_area = vegetation_areas(class_areas['initial'])
+        updated_veg_area, updated_nonveg_area = vegetation_areas(class_areas['updated'])
+
+        verification = verify_calculations(
+            class_areas['initial'],
+            class_areas['updated'],
+            initial_veg_area,
+            initial_nonveg_area,
+            updated_veg_area,
+            updated_nonveg_area
+        )
+        report_data = generate_verification_report(
+            verification,
+            class_areas['initial'],
+            class_areas['updated'],
+            self.initial_date,
+            self.updated_date,
+            self.geometry_aoi,
+            self.cloud_rate,
+            self.scale,
+            aoi_area=self.aoi_area,
+            plan=self.area_plan,
+            transitions=transitions
+        )
+
+        return {
+            'initial_ndvi_class_areas': class_areas['initial'],
+            'updated_ndvi_class_areas': class_areas['updated'],
+            'initial_veg_area': initial_veg_area,
+            'initial_nonveg_area': initial_nonveg_area,
+            'updated_veg_area': updated_veg_area,
+            'updated_nonveg_area': updated_nonveg_area,
+            'transitions': transitions,
+            'verification': verification,
+            'report_data': report_data,
+            'lai': evaluated['lai'] if has_scenes else None,
+            'scale': self.area_plan['scale'] if self.area_plan else self.scale,
+            'plan': self.area_plan,
+            'scene_counts': self.scene_counts
+        }
+
+    def _run_lai(self):
+        statistics = self._cached_dates(
+            'lai_statistics',
+            lambda dates: self.backend.lai_statistics(
+                {date: self.images(date)['lai'] for date in dates},
+                self.geometry_aoi,
+                self.scale,
+                plan=self.plan
+            ),
+            bins=LAI_BIN_EDGES,
+            percentiles=LAI_PERCENTILES,
+            **self._date_params()
+        )
+        if not statistics:
+            return None
+        return {
+            'initial_stats': statistics['initial'],
+            'updated_stats': statistics['updated'],
+            'initial_dist': statistics['initial']['histogram'],
+            'updated_dist': statistics['updated']['histogram']
+        }
+
+    def run_features(self, features):
+        """
+        Per-feature table for a GeoJSON FeatureCollection dict of the AOI's parcels (each
+        carrying FEATURE_ID): areas and LAI means for both dates, one row per feature.
+        """
+        def evaluate(dates):
+            statistics = self.backend.feature_statistics(
+                {date: self.images(date)['ndvi_classified'] for date in dates},
+                {date: self.images(date)['lai'] for date in dates},
+                features,
+                self.scale,
+                plan=self.plan
+            )
+            # {feature: {date: ...}} -> {date: {feature: ...}}, to be cached per date
+            return {date: {index: per_date[date] for index, per_date in statistics.items()} for date in dates}
+
+        per_date = self._cached_dates(
+            'feature_statistics',
+            evaluate,
+            features=features,
+            breaks=NDVI_CLASS_BREAKS,
+            **self._date_params()
+        )
+        statistics = {
+            feature['properties'][FEATURE_ID]: {date: per_date[date][feature['properties'][FEATURE_ID]] for date in per_date}
+            for feature in features['features']
+        }
+        return feature_statistics_table(statistics, features)
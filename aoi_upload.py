@@ -0,0 +1,347 @@
+"""
+Client-side ingestion of uploaded AOI GeoJSON files.
+
+Files are parsed into plain polygon coordinates once (callers key the result by the
+file's content hash), and the centroid and bounds used to place the map are computed
+locally with vectorized shoelace sums, so ingesting an upload costs no Earth Engine calls.
+
+Every Earth Engine request that uses the AOI carries its full coordinate list, so rings
+are repaired and simplified on the way in: Douglas-Peucker to half an analysis pixel,
+and coarser (up to a whole pixel) while the file is over the payload budget. Earth Engine
+rejects or mismeasures rings that cross themselves or each other, so self-intersecting
+uploads are rejected and a simplification that would create a crossing is retried at a
+smaller tolerance, then abandoned for the repaired rings.
+"""
+import hashlib
+import json
+
+import numpy as np
+
+from analysis import EARTH_RADIUS, FEATURE_ID
+
+SIMPLIFY_SCALE = 10
+COORDINATE_DECIMALS = 7  # ~1 cm
+# Halvings of the tolerance tried when a simplified polygon is not simple
+SIMPLIFY_RETRIES = 3
+PAYLOAD_BUDGET_BYTES = 1_000_000
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_geometries(geojson_data):
+    """(geometry, properties) pairs of a FeatureCollection, Feature, GeometryCollection or bare geometry."""
+    if 'features' in geojson_data and isinstance(geojson_data['features'], list):
+        return [(feature.get('geometry') or {}, feature.get('properties') or {}) for feature in geojson_data['features']]
+    if 'geometries' in geojson_data and isinstance(geojson_data['geometries'], list):
+        return [(geometry, {}) for geometry in geojson_data['geometries']]
+    if geojson_data.get('type') == 'Feature':
+        return [(geojson_data.get('geometry') or {}, geojson_data.get('properties') or {})]
+    return [(geojson_data, {})]
+
+
+def payload_size(coordinates):
+    """Bytes the coordinates add to every serialized request."""
+    return len(json.dumps(coordinates, separators=(',', ':')))
+
+
+def repair_ring(ring):
+    """
+    A closed, finite, 2D ring without repeated vertices, as an (n, 2) array, or None when
+    fewer than three distinct vertices or no area are left, or when it crosses itself.
+    """
+    ring = np.asarray(ring, dtype=float)
+    if ring.ndim != 2 or ring.shape[1] < 2:
+        return None
+    ring = ring[:, :2]
+    ring = ring[np.isfinite(ring).all(axis=1)]
+    if len(ring):
+        ring = ring[np.r_[True, (np.diff(ring, axis=0) != 0).any(axis=1)]]
+    if len(ring) and (ring[0] != ring[-1]).any():
+        ring = np.vstack([ring, ring[:1]])
+    if len(ring) < 4 or _signed_area(ring) == 0 or not rings_are_simple([ring]):
+        return None
+    return ring
+
+
+def _signed_area(ring):
+    x0, y0 = ring[:-1].T
+    x1, y1 = ring[1:].T
+    return float((x0 * y1 - x1 * y0).sum()) / 2
+
+
+def _point_in_ring(point, ring):
+    """Even-odd test of one point against a closed ring."""
+    (x0, y0), (x1, y1) = ring[:-1].T, ring[1:].T
+    x, y = point
+    crosses = (y0 > y) != (y1 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_cross = x0 + (y - y0) * (x1 - x0) / (y1 - y0)
+    return bool(np.count_nonzero(crosses & (x < x_cross)) % 2)
+
+
+def rings_are_simple(rings):
+    """
+    True when no two edges of the closed rings touch or cross, other than neighbours
+    sharing their vertex, and every ring after the first (the holes) starts inside the
+    first. Edges are swept in order of their left end, so only edges whose x ranges
+    overlap are compared.
+    """
+    rings = [np.asarray(ring, dtype=float)[:, :2] for ring in rings]
+    a = np.concatenate([ring[:-1] for ring in rings])
+    b = np.concatenate([ring[1:] for ring in rings])
+    ring_ids = np.concatenate([np.full(len(ring) - 1, i) for i, ring in enumerate(rings)])
+    edge_ids = np.concatenate([np.arange(len(ring) - 1) for ring in rings])
+    last_edge = np.concatenate([np.full(len(ring) - 1, len(ring) - 2) for ring in rings])
+    low, high = np.minimum(a, b), np.maximum(a, b)
+
+    # Pairs (i, j) with j after i in left-end order and starting before i ends
+    order = np.argsort(low[:, 0], kind='stable')
+    stops = np.searchsorted(low[order, 0], high[order, 0], side='right')
+    counts = np.maximum(stops - np.arange(1, len(order) + 1), 0)
+    total = int(counts.sum())
+    first = np.repeat(np.arange(len(order)), counts)
+    second = first + 1 + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    i, j = order[first], order[second]
+    offset = np.abs(edge_ids[i] - edge_ids[j])
+    neighbours = (ring_ids[i] == ring_ids[j]) & ((offset == 1) | (offset == last_edge[i]))
+    keep = ~neighbours & (low[i, 1] <= high[j, 1]) & (low[j, 1] <= high[i, 1])
+    i, j = i[keep], j[keep]
+
+    def orientation(p, q, r):
+        return (q[:, 0] - p[:, 0]) * (r[:, 1] - p[:, 1]) - (q[:, 1] - p[:, 1]) * (r[:, 0] - p[:, 0])
+    # With overlapping bounding boxes, opposite (or zero) orientations on both sides mean
+    # the edges meet, collinear overlaps included
+    meet = ((orientation(a[i], b[i], a[j]) * orientation(a[i], b[i], b[j]) <= 0)
+            & (orientation(a[j], b[j], a[i]) * orientation(a[j], b[j], b[i]) <= 0))
+    if meet.any():
+        return False
+    return all(_point_in_ring(hole[0], rings[0]) for hole in rings[1:])
+
+
+def _metres(ring):
+    """Local equirectangular projection of a lon/lat ring, good enough for tolerances."""
+    lat0 = np.radians(ring[:, 1].mean())
+    return np.radians(ring) * EARTH_RADIUS * np.array([np.cos(lat0), 1.0])
+
+
+def douglas_peucker(points, tolerance):
+    """
+    Boolean mask of the vertices kept by Douglas-Peucker. All open segments of one
+    refinement level are handled together, so each level is a few array operations.
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    keep[[0, -1]] = True
+    starts, ends = np.array([0]), np.array([len(points) - 1])
+    while len(starts):
+        lengths = ends - starts - 1
+        has_inner = lengths > 0
+        starts, ends, lengths = starts[has_inner], ends[has_inner], lengths[has_inner]
+        if not len(starts):
+            break
+        offsets = np.cumsum(lengths) - lengths
+        segment = np.repeat(np.arange(len(starts)), lengths)
+        inner = starts[segment] + 1 + np.arange(lengths.sum()) - offsets[segment]
+        a, b, p = points[starts[segment]], points[ends[segment]], points[inner]
+        direction = b - a
+        norm = np.hypot(direction[:, 0], direction[:, 1])
+        # Closed rings start with a zero-length segment: fall back to the point distance
+        distance = np.where(
+            norm > 0,
+            np.abs(direction[:, 0] * (p[:, 1] - a[:, 1]) - direction[:, 1] * (p[:, 0] - a[:, 0])) / np.where(norm > 0, norm, 1),
+            np.hypot(p[:, 0] - a[:, 0], p[:, 1] - a[:, 1])
+        )
+        # Farthest inner vertex of each segment
+        farthest = np.lexsort((-distance, segment))[offsets]
+        split = distance[farthest] > tolerance
+        farthest = inner[farthest]
+        keep[farthest[split]] = True
+        starts, ends = np.r_[starts[split], farthest[split]], np.r_[farthest[split], ends[split]]
+    return keep
+
+
+def _simplify_ring(ring, tolerance, exterior):
+    """One repaired ring simplified to `tolerance` metres (unless it would collapse or flip), oriented and rounded."""
+    area = _signed_area(ring)
+    if tolerance > 0:
+        simplified = ring[douglas_peucker(_metres(ring), tolerance)]
+        if len(simplified) >= 4 and _signed_area(simplified) * area > 0:
+            ring = simplified
+    if (area > 0) != exterior:
+        ring = ring[::-1]
+    return np.round(ring, COORDINATE_DECIMALS)
+
+
+def simplify_polygon(polygon, tolerance):
+    """
+    Repair and simplify one polygon (exterior plus holes) to `tolerance` metres, with the
+    exterior counter-clockwise and holes clockwise. Rings that would collapse or flip are
+    kept unsimplified, self-intersecting holes are dropped, and when the simplified rings
+    cross (or a hole leaves the exterior) the tolerance is halved, SIMPLIFY_RETRIES times,
+    before falling back to the unsimplified rings. Returns None when the exterior is
+    unusable or the polygon is not simple even unsimplified.
+    """
+    rings = []
+    for ring_index, ring in enumerate(polygon):
+        ring = repair_ring(ring)
+        if ring is None:
+            if ring_index == 0:
+                return None
+            continue
+        rings.append(ring)
+    for attempt in range(SIMPLIFY_RETRIES + 2):
+        # The last attempt keeps the repaired rings as they are
+        attempt_tolerance = tolerance / 2 ** attempt if attempt <= SIMPLIFY_RETRIES else 0
+        simplified = [_simplify_ring(ring, attempt_tolerance, ring_index == 0) for ring_index, ring in enumerate(rings)]
+        if rings_are_simple(simplified):
+            return [ring.tolist() for ring in simplified]
+    return None
+
+
+def prepare_polygons(polygons, scale=SIMPLIFY_SCALE):
+    """
+    Repaired and simplified copies of `polygons` (None for unusable ones) and the tolerance
+    used: half a `scale` pixel, doubled up to a whole pixel while over the payload budget.
+    """
+    tolerance = scale / 2
+    while True:
+        simplified = [simplify_polygon(polygon, tolerance) for polygon in polygons]
+        if tolerance >= scale or payload_size(simplified) <= PAYLOAD_BUDGET_BYTES:
+            return simplified, tolerance
+        tolerance = min(tolerance * 2, scale)
+
+
+def polygon_moments(polygons):
+    """
+    Planar (lon/lat) area and first moments of polygons with holes, as (area, mx, my).
+    All rings are processed as one batch of segments; holes count negatively.
+    """
+    starts, ends, ring_ids, ring_signs = [], [], [], []
+    for polygon in polygons:
+        for ring_index, ring in enumerate(polygon):
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            if len(ring) < 3:
+                continue
+            starts.append(ring)
+            ends.append(np.roll(ring, -1, axis=0))
+            ring_ids.append(np.full(len(ring), len(ring_signs)))
+            ring_signs.append(1.0 if ring_index == 0 else -1.0)
+    if not starts:
+        return 0.0, 0.0, 0.0
+    (x0, y0), (x1, y1) = np.concatenate(starts).T, np.concatenate(ends).T
+    ring_ids = np.concatenate(ring_ids)
+    cross = x0 * y1 - x1 * y0
+    n_rings = len(ring_signs)
+    area = np.bincount(ring_ids, cross, n_rings) / 2
+    mx = np.bincount(ring_ids, (x0 + x1) * cross, n_rings) / 6
+    my = np.bincount(ring_ids, (y0 + y1) * cross, n_rings) / 6
+    # Orient every ring so exteriors add and holes subtract, whatever their winding
+    weights = np.asarray(ring_signs) * np.sign(area)
+    return float((weights * area).sum()), float((weights * mx).sum()), float((weights * my).sum())
+
+
+def _summary(polygons, area, mx, my):
+    if not polygons:
+        return None, None
+    coordinates = np.concatenate([np.asarray(ring, dtype=float)[:, :2] for polygon in polygons for ring in polygon])
+    (west, south), (east, north) = coordinates.min(axis=0), coordinates.max(axis=0)
+    if area > 0:
+        centroid = [mx / area, my / area]
+    else:
+        # Degenerate polygons: fall back to the vertex mean
+        centroid = coordinates.mean(axis=0).tolist()
+    return centroid, [[float(south), float(west)], [float(north), float(east)]]
+
+
+def _vertex_count(polygons):
+    return sum(len(ring) for polygon in polygons for ring in polygon)
+
+
+def parse_geojson(data, name=None, scale=SIMPLIFY_SCALE):
+    """
+    Parse one uploaded GeoJSON file (bytes or str). Returns a dict with the Polygon /
+    MultiPolygon 'features' (simplified geometry plus scalar properties), their 'polygons'
+    as plain coordinate lists, the planar 'area' and moments, 'centroid' [lon, lat],
+    'bounds' [[south, west], [north, east]] and the 'simplification' report: polygons
+    rejected as unusable or self-intersecting, vertex counts and payload bytes before and
+    after, and the tolerance in metres.
+    """
+    geojson_data = json.loads(data)
+    entries = []
+    for geometry, properties in _file_geometries(geojson_data):
+        if geometry.get('type') == 'Polygon':
+            entries.append((properties, [geometry['coordinates']]))
+        elif geometry.get('type') == 'MultiPolygon':
+            entries.append((properties, geometry['coordinates']))
+    raw_polygons = [polygon for _, feature_polygons in entries for polygon in feature_polygons]
+    simplified, tolerance = prepare_polygons(raw_polygons, scale)
+
+    features, polygons, position = [], [], 0
+    for properties, feature_polygons in entries:
+        count = len(feature_polygons)
+        feature_polygons = [polygon for polygon in simplified[position:position + count] if polygon is not None]
+        position += count
+        if not feature_polygons:
+            continue
+        # Keep scalar properties (names, IDs) so per-field rows can be matched back to the fields
+        properties = {key: value for key, value in properties.items() if isinstance(value, (str, int, float, bool))}
+        if name is not None:
+            properties['source_file'] = name
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'MultiPolygon', 'coordinates': feature_polygons},
+            'properties': properties
+        })
+        polygons.extend(feature_polygons)
+
+    area, mx, my = polygon_moments(polygons)
+    centroid, bounds = _summary(polygons, area, mx, my)
+    return {
+        'features': features,
+        'polygons': polygons,
+        'area': area,
+        'moments': (mx, my),
+        'centroid': centroid,
+        'bounds': bounds,
+        'simplification': {
+            'rejected_polygons': sum(polygon is None for polygon in simplified),
+            'vertices_before': _vertex_count(raw_polygons),
+            'vertices_after': _vertex_count(polygons),
+            'payload_bytes_before': payload_size(raw_polygons),
+            'payload_bytes_after': payload_size(polygons),
+            'tolerance_m': tolerance
+        }
+    }
+
+
+def merge_uploads(parsed_files):
+    """
+    Combine parse_geojson results into one AOI: 'geometry' (MultiPolygon dict), 'features'
+    (FeatureCollection dict, numbered by FEATURE_ID), 'centroid', 'bounds' and the summed
+    'simplification' report. Returns None when no file holds a polygon.
+    """
+    polygons, features = [], []
+    area = mx = my = 0.0
+    for parsed in parsed_files:
+        polygons.extend(parsed['polygons'])
+        for feature in parsed['features']:
+            features.append(dict(feature, properties=dict(feature['properties'], **{FEATURE_ID: len(features)})))
+        area += parsed['area']
+        mx += parsed['moments'][0]
+        my += parsed['moments'][1]
+    if not polygons:
+        return None
+    centroid, bounds = _summary(polygons, area, mx, my)
+    simplification = {
+        key: sum(parsed['simplification'][key] for parsed in parsed_files)
+        for key in ('rejected_polygons', 'vertices_before', 'vertices_after', 'payload_bytes_before', 'payload_bytes_after')
+    }
+    simplification['tolerance_m'] = max(parsed['simplification']['tolerance_m'] for parsed in parsed_files)
+    return {
+        'geometry': {'type': 'MultiPolygon', 'coordinates': polygons},
+        'features': {'type': 'FeatureCollection', 'features': features},
+        'centroid': centroid,
+        'bounds': bounds,
+        'simplification': simplification
+    }
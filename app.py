@@ -1,33 +1,47 @@
 import streamlit as st
 import ee
-from ee import oauth
-from google.oauth2 import service_account
-import folium
-from folium import WmsTileLayer
-from streamlit_folium import folium_static
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import base64
 import json
-import requests
+import os
 import streamlit.components.v1 as components
-
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import threading
+from analysis import Analysis, COARSE_SCALE, EarthEngineBackend, ndvi_time_series, time_series_windows
+from result_cache import ResultCache, fingerprint
+from charts import chart_payload, lai_spec, ndvi_class_specs, vegetation_specs
+from map_layers import fetch_thumbnails, get_tile_url, resolve_tile_urls
+from ee_trace import stage, start_trace
+from scheduler import PREFETCH, request_scheduler, with_priority
+from aoi_upload import PAYLOAD_BUDGET_BYTES, content_hash, merge_uploads, parse_geojson
+
+# Heavy modules (folium and the pandas it pulls in, google-auth, the local engines) are
+# imported where they are first used, so a new process paints the page before loading them
+EE_PROJECT = 'ndvi-441403'
+
+@st.cache_resource(show_spinner="Connecting to Earth Engine...")
 def initialize_earth_engine():
-    try:
-        if 'earth_engine' in st.secrets:
-            service_account_info = json.loads(st.secrets["earth_engine"]["service_account"])
-            credentials = service_account.Credentials.from_service_account_info(
-                service_account_info,
-                scopes=ee.oauth.SCOPES
-            )
-            ee.Initialize(credentials)
-            st.success("Earth Engine initialized successfully!")
-        else:
-            ee.Initialize(project='ndvi-441403')
-    except Exception as e:
-        st.error(f"Earth Engine initialization failed: {str(e)}")
-        st.stop()
+    """
+    Initialize Earth Engine once per process: with the service account in the secrets
+    ([earth_engine] service_account, or json_key) if there is one, else the default
+    project credentials. Returns the account or project used; failures are not cached.
+    """
+    if 'earth_engine' in st.secrets:
+        service_account_info = json.loads(st.secrets["earth_engine"]["service_account"])
+    elif 'json_key' in st.secrets:
+        service_account_info = json.loads(st.secrets["json_key"])
+    else:
+        ee.Initialize(project=EE_PROJECT)
+        return EE_PROJECT
+    if "client_email" not in service_account_info:
+        raise ValueError("Service account email address missing in json key")
+    from google.oauth2 import service_account
+
+    credentials = service_account.Credentials.from_service_account_info(service_account_info, scopes=ee.oauth.SCOPES)
+    ee.Initialize(credentials)
+    return service_account_info["client_email"]
 
-# Initialize the app
-initialize_earth_engine()
 st.set_page_config(
     page_title="Vegalytics",
     page_icon="https://cdn-icons-png.flaticon.com/512/2516/2516640.png",
@@ -63,309 +77,250 @@ st.markdown(
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data(persist=True)
-def ee_authenticate():
-    if "json_key" in st.secrets:
-        json_creds = st.secrets["json_key"]
-        service_account_info = json.loads(json_creds)
-        if "client_email" not in service_account_info:
-            raise ValueError("Service account email address missing in json key")
-        creds = service_account.Credentials.from_service_account_info(service_account_info, scopes=oauth.SCOPES)
-        ee.Initialize(creds)
-    else:
-        ee.Initialize(project='ndvi-441403')
+def _ee_tile_layer(url_format, name):
+    import folium
+
+    return folium.raster_layers.TileLayer(
+        tiles=url_format,
+        attr='Map Data &copy; <a href="https://earthengine.google.com/">Google Earth Engine</a>',
+        name=name,
+        overlay=True,
+        control=True
+    )
 
 def add_ee_layer(self, ee_image_object, vis_params, name):
     try:
-        map_id_dict = ee.Image(ee_image_object).getMapId(vis_params)
-        # map_id_dict = ee.Image(ee_image_object).getMapId(vis_params)
-        layer = folium.raster_layers.TileLayer(
-            tiles=map_id_dict['tile_fetcher'].url_format,
-            attr='Map Data &copy; <a href="https://earthengine.google.com/">Google Earth Engine</a>',
-            name=name,
-            overlay=True,
-            control=True
-        )
+        layer = _ee_tile_layer(get_tile_url(ee_image_object, vis_params, name=name), name)
         layer.add_to(self)
         return layer
     except Exception as e:
         print(f"Error adding Earth Engine layer: {e}")
         None
-folium.Map.add_ee_layer = add_ee_layer
-
-# # NDVI Classification function - used for both detailed and binary classification
-# def classify_ndvi(masked_image):
-#     # Make sure we're only working with valid pixels
-#     valid_pixels = masked_image.mask()
-
-#     ndvi_classified = ee.Image(0) \
-#         .where(masked_image.gte(0).And(masked_image.lt(0.15)), 1) \
-#         .where(masked_image.gte(0.15).And(masked_image.lt(0.25)), 2) \
-#         .where(masked_image.gte(0.25).And(masked_image.lt(0.35)), 3) \
-#         .where(masked_image.gte(0.35).And(masked_image.lt(0.45)), 4) \
-#         .where(masked_image.gte(0.45).And(masked_image.lt(0.65)), 5) \
-#         .where(masked_image.gte(0.65).And(masked_image.lt(0.75)), 6) \
-#         .where(masked_image.gte(0.75), 7) \
-#         .updateMask(valid_pixels)
-
-#     return ndvi_classified
-
-def classify_ndvi(masked_image):
-    # Get the original valid pixel mask
-    valid_pixels = masked_image.mask()
-
-    ndvi_classified = ee.Image(0) \
-        .where(masked_image.gte(0).And(masked_image.lt(0.15)), 1) \
-        .where(masked_image.gte(0.15).And(masked_image.lt(0.25)), 2) \
-        .where(masked_image.gte(0.25).And(masked_image.lt(0.35)), 3) \
-        .where(masked_image.gte(0.35).And(masked_image.lt(0.45)), 4) \
-        .where(masked_image.gte(0.45).And(masked_image.lt(0.65)), 5) \
-        .where(masked_image.gte(0.65).And(masked_image.lt(0.75)), 6) \
-        .where(masked_image.gte(0.75), 7) \
-        .updateMask(valid_pixels)
-
-    return ndvi_classified
-
-
-# Create binary vegetation/non-vegetation classification using the same thresholds
-# def classify_vegetation_ndvi(masked_image):
-#     # Classes 1-2 (< 0.25) are non-vegetation, classes 3-7 (>= 0.25) are vegetation
-#     vegetation_mask = masked_image.gte(0.25)
-#     non_vegetation_mask = masked_image.lt(0.25)
-#     vegetation_masked = masked_image.updateMask(vegetation_mask)
-#     non_vegetation_masked = masked_image.updateMask(non_vegetation_mask)
-#     return vegetation_masked, non_vegetation_masked
-# def classify_vegetation_ndvi(masked_image):
-#     # Classes 1-2 (< 0.25) are non-vegetation, classes 3-7 (>= 0.25) are vegetation
-#     vegetation_mask = masked_image.gte(0.25)
-#     non_vegetation_mask = masked_image.lt(0.25).And(masked_image.gte(0))
-
-#     # Return binary masks (1 where condition is true, 0 elsewhere) instead of masked NDVI values
-#     vegetation_binary = vegetation_mask.selfMask()
-#     non_vegetation_binary = non_vegetation_mask.selfMask()
-
-#     return vegetation_binary, non_vegetation_binary
-
-def classify_vegetation_ndvi(masked_image):
-    # Use the same exact thresholds as classify_ndvi function
-    # Non-vegetation: classes 1-2 (0 <= NDVI < 0.25)
-    # Vegetation: classes 3-7 (NDVI >= 0.25)
-
-    # Create mutually exclusive conditions
-    vegetation_condition = masked_image.gte(0.25)
-    non_vegetation_condition = masked_image.gte(0).And(masked_image.lt(0.25))
-
-    # Apply the same mask from the original image to ensure consistency
-    original_mask = masked_image.mask()
-
-    vegetation_binary = vegetation_condition.And(original_mask).selfMask()
-    non_vegetation_binary = non_vegetation_condition.And(original_mask).selfMask()
-
-    return vegetation_binary, non_vegetation_binary
-
-# def getLAI(image):
-#     lai = image.expression(
-#         '3.618 * EVI - 0.118', {
-#             'EVI': image.expression(
-#                 '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))', {
-#                     'NIR': image.select('B8'),
-#                     'RED': image.select('B4'),
-#                     'BLUE': image.select('B2')
-#                 })
-#         }).rename('LAI')
-#     return lai
-
-# Function to safely compute Leaf Area Index (LAI)
-def getLAI(image):
+
+def add_ee_layers(self, layers):
+    """Add (ee_image_object, vis_params, name) layers in order, resolving their map IDs concurrently."""
+    added = []
+    for (_, _, name), url_format in zip(layers, resolve_tile_urls(layers)):
+        if url_format is not None:
+            layer = _ee_tile_layer(url_format, name)
+            layer.add_to(self)
+            added.append(layer)
+    return added
+
+def load_folium():
+    """folium, with add_ee_layer / add_ee_layers on folium.Map."""
+    import folium
+
+    folium.Map.add_ee_layer = add_ee_layer
+    folium.Map.add_ee_layers = add_ee_layers
+    return folium
+
+@st.cache_resource
+def get_result_cache():
+    # Persistent across sessions and restarts; see result_cache.py for size/TTL settings
+    return ResultCache()
+
+EARTH_ENGINE = "Google Earth Engine"
+LOCAL_ENGINE = "Local scenes (NumPy)"
+GEOTIFF_ENGINE = "Local GeoTIFFs (out-of-core)"
+ENGINE_OPTIONS = [EARTH_ENGINE, LOCAL_ENGINE, GEOTIFF_ENGINE]
+LOCAL_ENGINES = (LOCAL_ENGINE, GEOTIFF_ENGINE)
+# The GeoTIFF engine only opens the manifests (and band files) inside this directory
+GEOTIFF_SCENES_DIR = os.environ.get('VEGALYTICS_SCENES_DIR')
+
+TWO_DATE_MODE = "Two-date comparison"
+TIME_SERIES_MODE = "NDVI time series"
+MODE_OPTIONS = [TWO_DATE_MODE, TIME_SERIES_MODE]
+
+@st.cache_resource(max_entries=2)
+def load_local_backend(scene_bytes):
+    from local_backend import NumpyBackend
+
+    return NumpyBackend.from_npz(scene_bytes)
+
+def geotiff_manifests():
+    """The JSON manifests under GEOTIFF_SCENES_DIR, as paths relative to it."""
+    if not GEOTIFF_SCENES_DIR or not os.path.isdir(GEOTIFF_SCENES_DIR):
+        return []
+    manifests = []
+    for directory, _, files in os.walk(GEOTIFF_SCENES_DIR):
+        manifests.extend(os.path.relpath(os.path.join(directory, name), GEOTIFF_SCENES_DIR)
+                         for name in files if name.endswith('.json'))
+    return sorted(manifests)
+
+@st.cache_resource(max_entries=2)
+def load_geotiff_backend(manifest, manifest_mtime):
     """
-    Compute Leaf Area Index (LAI) only if the image contains all required bands ('B8', 'B4', 'B2').
-    If any band is missing, the original image is returned unchanged.
+    The backend of a manifest under GEOTIFF_SCENES_DIR. `manifest_mtime` is only part of
+    the cache key, so an edited manifest is read again.
     """
-    # Define the LAI computation as a nested function
-    def calculate_lai():
-        # Enhanced Vegetation Index calculation
-        evi = image.expression(
-            '2.5 * ((NIR - RED) / (NIR + 6 * RED - 7.5 * BLUE + 1))', {
-                'NIR': image.select('B8'),
-                'RED': image.select('B4'),
-                'BLUE': image.select('B2')
+    from geotiff_backend import GeoTiffBackend, within
+
+    path = os.path.join(GEOTIFF_SCENES_DIR, manifest)
+    if not within(path, GEOTIFF_SCENES_DIR):
+        raise ValueError(f"{manifest} is outside the scenes directory")
+    # Scenes stay on disk, memory-mapped; only the scene list is read here
+    return GeoTiffBackend.from_manifest(path, root=GEOTIFF_SCENES_DIR)
+
+# Shared by all sessions and bounded. Streamlit computes a missing key once while other
+# sessions asking for it wait, and the result cache coalesces the individual requests
+RESULT_ENTRIES = 128
+
+@st.cache_data(show_spinner="Running analysis...", max_entries=RESULT_ENTRIES)
+def run_analysis(analysis_key, _analysis):
+    # _analysis is not hashed; analysis_key (AOI hash, date windows, cloud threshold, scale)
+    # decides whether the cached result can be reused
+    return _analysis.run()
+
+@st.cache_resource
+def get_refinements():
+    # Full-scale runs of large AOIs, computed in the background while a coarse estimate is shown
+    return {'executor': ThreadPoolExecutor(max_workers=2), 'futures': {}}
+
+def refined_results(analysis):
+    """Results at the planned scale if the background run has finished, else None (starting it if needed)."""
+    futures = get_refinements()['futures']
+    future = futures.get(analysis.key)
+    if future is None:
+        # Finished runs stay available for later submits; only the last few are kept
+        for key in [key for key, done in futures.items() if done.done()][:-16]:
+            del futures[key]
+        # Background refinements queue behind the requests of interactive reruns
+        futures[analysis.key] = get_refinements()['executor'].submit(with_priority(PREFETCH, analysis.run))
+        return None
+    if not future.done():
+        return None
+    try:
+        return future.result()
+    except Exception as e:
+        print(f"Error refining results: {e}")
+        del futures[analysis.key]
+        return None
+
+def tile_progress_bar(tiles):
+    """A progress bar and the (done, total) callback that fills it as an analysis reduces its tiles."""
+    bar = st.progress(0.0, text=f"Reducing {tiles} tiles...")
+    ctx = get_script_run_ctx()
+
+    def update(done, total):
+        # Tiles are collected on worker threads, which need this session's context to draw
+        add_script_run_ctx(threading.current_thread(), ctx)
+        bar.progress(done / total, text=f"{done} / {total} tiles reduced")
+    return bar, update
+
+@st.cache_data(show_spinner="Computing per-field statistics...", max_entries=RESULT_ENTRIES)
+def run_feature_statistics(analysis_key, features_key, _analysis, _features):
+    return _analysis.run_features(_features)
+
+def render_time_series(geometry_aoi, start_date, end_date, cloud_pixel_percentage, window_days, plan=None):
+    """NDVI areas for consecutive windows between the two dates, charted as each chunk of windows returns."""
+    st.subheader("NDVI Time Series")
+    windows = time_series_windows(start_date, end_date, window_days)
+    if not windows:
+        st.warning("Pick an updated date after the initial date to build a time series.")
+        return
+    import pandas as pd
+
+    chart = st.empty()
+    progress = st.progress(0.0, text=f"0 / {len(windows)} windows")
+    rows = []
+    try:
+        for chunk_rows in ndvi_time_series(geometry_aoi, windows, cloud_pixel_percentage, cache=get_result_cache(), plan=plan):
+            rows.extend(chunk_rows)
+            series = pd.DataFrame(rows).set_index('start')
+            chart.line_chart(series[['veg_area', 'nonveg_area']])
+            progress.progress(len(rows) / len(windows), text=f"{len(rows)} / {len(windows)} windows")
+    except Exception as e:
+        st.error(f"Error computing the NDVI time series: {e}")
+    progress.empty()
+    if rows:
+        table = pd.DataFrame(rows)
+        st.dataframe(table, hide_index=True)
+        st.download_button(
+            "Download time series (CSV)",
+            table.to_csv(index=False),
+            file_name="ndvi_time_series.csv",
+            mime="text/csv"
+        )
+
+def render_trace(trace):
+    """Collapsible waterfall of this run's Earth Engine calls, grouped by stage."""
+    spans = trace.to_dict()['spans']
+    calls = [span for span in spans if span['kind'] not in ('stage', 'event')]
+    with st.expander(f"⏱️ Earth Engine calls ({len(calls)})", expanded=False):
+        if not spans:
+            st.caption("No Earth Engine calls in this run (results came from the caches).")
+            return
+        import pandas as pd
+
+        timeline = pd.DataFrame(spans)
+        timeline['start_ms'] = timeline['start_s'] * 1000
+        timeline['end_ms'] = (timeline['start_s'] + timeline['duration_s']) * 1000
+        timeline['stage'] = timeline['stage'].fillna('(none)')
+        # One row per span, in start order, so repeated labels don't overlap
+        timeline['row'] = [f"{i:02d} {label}" for i, label in enumerate(timeline['label'])]
+        st.vega_lite_chart(timeline, {
+            'mark': {'type': 'bar', 'tooltip': True},
+            'encoding': {
+                'y': {'field': 'row', 'type': 'ordinal', 'sort': None, 'title': None},
+                'x': {'field': 'start_ms', 'type': 'quantitative', 'title': 'ms since rerun start'},
+                'x2': {'field': 'end_ms'},
+                'color': {'field': 'stage', 'type': 'nominal'},
+                'opacity': {'condition': {'test': "datum.kind == 'stage'", 'value': 0.35}, 'value': 1},
+                'tooltip': [
+                    {'field': 'label'}, {'field': 'kind'}, {'field': 'stage'}, {'field': 'thread'},
+                    {'field': 'duration_s', 'format': '.3f'}, {'field': 'queued_s', 'format': '.3f'},
+                    {'field': 'attempts'}, {'field': 'priority'}, {'field': 'response_bytes'}, {'field': 'error'}
+                ]
             }
+        }, use_container_width=True)
+        scheduler = request_scheduler.stats()
+        st.caption(
+            f"Request queue: {scheduler['active']} / {scheduler['max_concurrent']} in flight, {scheduler['queued']} waiting, "
+            f"{scheduler['retries']} retries since start ({scheduler['queued_s']:.1f} s queued in total)."
         )
-        # LAI formula
-        return image.expression(
-            '3.618 * EVI - 0.118', {'EVI': evi}
-        ).rename('LAI')
-
-    # Fallback: return original image
-    fallback = image
-
-    # Nested server-side conditions to check each band
-    return ee.Image(
-        ee.Algorithms.If(
-            image.bandNames().contains('B8'),
-            ee.Algorithms.If(
-                image.bandNames().contains('B4'),
-                ee.Algorithms.If(
-                    image.bandNames().contains('B2'),
-                    calculate_lai(),
-                    fallback
-                ),
-                fallback
-            ),
-            fallback
+        summary = pd.DataFrame.from_dict(trace.summary(), orient='index')
+        if not summary.empty:
+            st.dataframe(summary)
+        st.download_button(
+            "Download trace (JSON spans)",
+            trace.to_json(),
+            file_name="ee_trace.json",
+            mime="application/json"
         )
-    )
 
-# def calculate_area(masked_image, aoi, label="Area"):
-#     pixel_area = ee.Image.pixelArea()
-#     area_image = masked_image.multiply(pixel_area)
-#     area_stats = area_image.reduceRegion(
-#         reducer=ee.Reducer.sum(),
-#         geometry=aoi,
-#         scale=10,
-#         maxPixels=1e9
-#     )
-#     try:
-#       area_result = area_stats.getInfo()
-#       if area_result:
-#           return next(iter(area_result.values()))
-#       else:
-#           return None
-#     except Exception as e:
-#         print(f"Error calculating area: {e}")
-#         return None
-
-def calculate_area(binary_mask, aoi, label="Area"):
-    # For binary masks, multiply by pixel area directly
-    pixel_area = ee.Image.pixelArea()
-    area_image = binary_mask.multiply(pixel_area)
-
-    area_stats = area_image.reduceRegion(
-        reducer=ee.Reducer.sum(),
-        geometry=aoi,
-        scale=10,
-        maxPixels=1e9
-    )
+def ingest_uploads(upload_files):
+    """
+    The uploaded AOI (aoi_upload.merge_uploads) or None. Each file is parsed once per
+    content hash and kept in this session's state, so reruns parse nothing and no
+    Earth Engine call is made.
+    """
+    parsed_files = st.session_state.setdefault('parsed_uploads', {})
+    digests = []
+    for upload_file in upload_files or []:
+        data = upload_file.getvalue()
+        digest = content_hash(data)
+        if digest not in parsed_files:
+            parsed_files[digest] = parse_geojson(data, upload_file.name)
+        digests.append(digest)
+    # Forget files that were removed from the uploader
+    for digest in set(parsed_files) - set(digests):
+        del parsed_files[digest]
+
+    merged = st.session_state.get('merged_upload')
+    if merged is None or merged[0] != digests:
+        merged = (digests, merge_uploads([parsed_files[digest] for digest in digests]))
+        st.session_state['merged_upload'] = merged
+    return merged[1]
 
-    try:
-        area_result = area_stats.getInfo()
-        if area_result:
-            # Get the first (and should be only) value from the result
-            area_value = next(iter(area_result.values()))
-            return area_value if area_value is not None else 0
-        else:
-            return 0
-    except Exception as e:
-        print(f"Error calculating area for {label}: {e}")
-        return 0
-
-
-def calculate_ndvi_class_areas(ndvi_classified, geometry_aoi):
-    areas = {}
-    for class_value in range(1, 8):  # Classes 1-7 as per your classification
-        class_mask = ndvi_classified.eq(class_value)
-        class_area = calculate_area(class_mask, geometry_aoi, f"NDVI Class {class_value}")
-        areas[class_value] = class_area or 0
-    return areas
-
-def satCollection(cloudRate, initialDate, updatedDate, aoi):
-    collection = ee.ImageCollection('COPERNICUS/S2_SR') \
-        .filter(ee.Filter.lt("CLOUDY_PIXEL_PERCENTAGE", cloudRate)) \
-        .filterDate(initialDate, updatedDate) \
-        .filterBounds(aoi)
-    def clipCollection(image):
-        return image.clip(aoi).divide(10000)
-    collection = collection.map(clipCollection)
-    return collection
-
-last_uploaded_centroid = None
 def upload_files_proc(upload_files):
-    global last_uploaded_centroid
-    geometry_aoi_list = []
-    for upload_file in upload_files:
-        bytes_data = upload_file.read()
-        geojson_data = json.loads(bytes_data)
-        if 'features' in geojson_data and isinstance(geojson_data['features'], list):
-            features = geojson_data['features']
-        elif 'geometries' in geojson_data and isinstance(geojson_data['geometries'], list):
-            features = [{'geometry': geo} for geo in geojson_data['geometries']]
-        else:
-            continue
-        for feature in features:
-            if 'geometry' in feature and 'coordinates' in feature['geometry']:
-                coordinates = feature['geometry']['coordinates']
-                geometry = ee.Geometry.Polygon(coordinates) if feature['geometry']['type'] == 'Polygon' else ee.Geometry.MultiPolygon(coordinates)
-                geometry_aoi_list.append(geometry)
-                last_uploaded_centroid = geometry.centroid(maxError=1).getInfo()['coordinates']
-    if geometry_aoi_list:
-        geometry_aoi = ee.Geometry.MultiPolygon(geometry_aoi_list)
-    else:
-        # geometry_aoi = ee.Geometry.Point([27.98, 36.13])
-        geometry_aoi = None
-    return geometry_aoi
-
-def date_input_proc(
-    input_date, time_range
-):
-    end_date = input_date
-    start_date = input_date - timedelta(days=time_range)
-    str_start_date = start_date.strftime('%Y-%m-%d')
-    str_end_date = end_date.strftime('%Y-%m-%d')
-    return str_start_date, str_end_date
-
-def verify_calculations(
-    initial_ndvi_class_areas,
-    updated_ndvi_class_areas,
-    initial_veg_area,
-    initial_nonveg_area,
-    updated_veg_area,
-    updated_nonveg_area
-):
-    # Sum areas for classes 1-2 (non-vegetation)
-    initial_calc_nonveg = sum(initial_ndvi_class_areas[i] for i in range(1, 3))
-    updated_calc_nonveg = sum(updated_ndvi_class_areas[i] for i in range(1, 3))
-
-    # Sum areas for classes 3-7 (vegetation)
-    initial_calc_veg = sum(initial_ndvi_class_areas[i] for i in range(3, 8))
-    updated_calc_veg = sum(updated_ndvi_class_areas[i] for i in range(3, 8))
-
-    # Calculate total area from each method
-    initial_total = initial_veg_area + initial_nonveg_area
-    initial_class_total = sum(initial_ndvi_class_areas.values())
-    updated_total = updated_veg_area + updated_nonveg_area
-    updated_class_total = sum(updated_ndvi_class_areas.values())
-
-    # Print verification results
-    verification_results = {
-        "Initial vegetation area": initial_veg_area,
-        "Sum of initial NDVI vegetation classes (3-7)": initial_veg_area,
-        "Difference": initial_veg_area - initial_veg_area,
-
-        "Initial non-vegetation area": initial_nonveg_area,
-        "Sum of initial NDVI non-vegetation classes (1-2)": initial_nonveg_area,
-        "Difference": initial_nonveg_area - initial_nonveg_area,
-
-        "Initial total area": initial_total,
-        "Initial total from NDVI classes": initial_class_total,
-        "Initial total difference": initial_total - initial_class_total,
-
-        "Updated vegetation area": updated_veg_area,
-        "Sum of updated NDVI vegetation classes (3-7)": updated_calc_veg,
-        "Updated vegetation difference": updated_veg_area - updated_calc_veg,
-
-        "Updated non-vegetation area": updated_nonveg_area,
-        "Sum of updated NDVI non-vegetation classes (1-2)": updated_nonveg_area,
-        "Updated non-vegetation difference": updated_nonveg_area - updated_nonveg_area,
-
-        "Updated total area": updated_total,
-        "Updated total from NDVI classes": updated_class_total,
-        "Updated total difference": updated_total - updated_class_total
-    }
+    """Ingest the uploaded files and build the (client-side) Earth Engine AOI geometry."""
+    aoi = ingest_uploads(upload_files)
+    geometry_aoi = ee.Geometry.MultiPolygon(aoi['geometry']['coordinates']) if aoi else None
+    return geometry_aoi, aoi
 
-    return verification_results
-
-def create_report_html(report_data):
-    """Create HTML report for verification results"""
+def create_report_html(report_data, images=None):
+    """Create HTML report for verification results, with (title, PNG bytes) images inlined"""
 
     html_content = f"""
     <div style="font-family: Arial, sans-serif; max-width: 1200px; margin: 0 auto; padding: 20px;">
@@ -520,7 +475,61 @@ def create_report_html(report_data):
 
     html_content += """
             </table>
-        </div>
+        </div>"""
+
+    transitions = report_data['ndvi_classification'].get('transitions')
+    if transitions:
+        labels = report_data['ndvi_classification']['class_labels']
+        html_content += """
+
+        <!-- NDVI Class Transitions -->
+        <div style="background: #fff; padding: 20px; border: 1px solid #dee2e6; border-radius: 8px; margin-bottom: 25px;">
+            <h2 style="color: #2E8B57; margin-top: 0;">NDVI Class Transitions</h2>
+            <p style="color: #666;">Area (m²) of each initial class (rows) found in each updated class (columns). The diagonal is unchanged.</p>
+            <table style="width: 100%; border-collapse: collapse; font-size: 13px;">
+                <tr style="background: #2E8B57; color: white;">
+                    <th style="padding: 8px; border: 1px solid #dee2e6; text-align: left;">From \\ To</th>"""
+        for label in labels:
+            html_content += f"""
+                    <th style="padding: 8px; border: 1px solid #dee2e6; text-align: right;">{label}</th>"""
+        html_content += """
+                    <th style="padding: 8px; border: 1px solid #dee2e6; text-align: right;">Total</th>
+                </tr>"""
+        for i, (from_class, row) in enumerate(transitions.items()):
+            bg_color = "#f8f9fa" if i % 2 == 0 else "white"
+            html_content += f"""
+                <tr style="background: {bg_color};">
+                    <td style="padding: 8px; border: 1px solid #dee2e6;">{labels[from_class - 1]}</td>"""
+            for to_class, area in row.items():
+                # Unchanged pixels on the diagonal
+                weight = "font-weight: bold; background: #e8f5e9;" if to_class == from_class else ""
+                html_content += f"""
+                    <td style="padding: 8px; border: 1px solid #dee2e6; text-align: right; font-family: monospace; {weight}">{area:,.2f}</td>"""
+            html_content += f"""
+                    <td style="padding: 8px; border: 1px solid #dee2e6; text-align: right; font-family: monospace;">{sum(row.values()):,.2f}</td>
+                </tr>"""
+        html_content += """
+            </table>
+        </div>"""
+
+    if images:
+        html_content += """
+
+        <!-- Imagery -->
+        <div style="background: #fff; padding: 20px; border: 1px solid #dee2e6; border-radius: 8px; margin-bottom: 25px;">
+            <h2 style="color: #2E8B57; margin-top: 0;">Imagery</h2>
+            <div style="display: grid; grid-template-columns: repeat(auto-fit, minmax(300px, 1fr)); gap: 15px;">"""
+        for title, png in images:
+            html_content += f"""
+                <figure style="margin: 0; text-align: center;">
+                    <img src="data:image/png;base64,{base64.b64encode(png).decode('ascii')}" alt="{title}" style="max-width: 100%; border: 1px solid #dee2e6;">
+                    <figcaption style="color: #666; margin-top: 5px;">{title}</figcaption>
+                </figure>"""
+        html_content += """
+            </div>
+        </div>"""
+
+    html_content += """
 
         <!-- Footer -->
         <div style="text-align: center; padding: 20px; border-top: 1px solid #dee2e6; margin-top: 30px; color: #6c757d;">
@@ -533,70 +542,6 @@ def create_report_html(report_data):
     return html_content
 
 
-def generate_verification_report(verification_results, initial_ndvi_class_areas, updated_ndvi_class_areas,
-                               initial_date, updated_date, geometry_aoi, cloud_pixel_percentage):
-    """Generate a comprehensive verification report"""
-
-    # Calculate additional metrics
-    total_area_change = verification_results["Updated total area"] - verification_results["Initial total area"]
-    vegetation_change = verification_results["Updated vegetation area"] - verification_results["Initial vegetation area"]
-    vegetation_change_percent = (vegetation_change / verification_results["Initial vegetation area"] * 100) if verification_results["Initial vegetation area"] > 0 else 0
-
-    # NDVI class labels
-    ndvi_class_labels = [
-        "Absent Vegetation (Water/Clouds/Built-up/Rocks/Sand)",
-        "Bare Soil",
-        "Low Vegetation",
-        "Light Vegetation",
-        "Moderate Vegetation",
-        "Strong Vegetation",
-        "Dense Vegetation"
-    ]
-
-    # Calculate class changes
-    class_changes = {}
-    for i in range(1, 8):
-        change = updated_ndvi_class_areas[i] - initial_ndvi_class_areas[i]
-        change_percent = (change / initial_ndvi_class_areas[i] * 100) if initial_ndvi_class_areas[i] > 0 else 0
-        class_changes[i] = {"change": change, "change_percent": change_percent}
-
-    # Get AOI area if available
-    aoi_area = 0
-    if geometry_aoi:
-        try:
-            aoi_area = geometry_aoi.area().getInfo()
-        except:
-            aoi_area = "Unable to calculate"
-
-    report_data = {
-        "analysis_period": {
-            "initial_date": initial_date,
-            "updated_date": updated_date,
-            "days_difference": (updated_date - initial_date).days
-        },
-        "analysis_parameters": {
-            "cloud_coverage_threshold": cloud_pixel_percentage,
-            "aoi_total_area": aoi_area,
-            "analysis_scale": "10m"
-        },
-        "summary_statistics": {
-            "total_area_change": total_area_change,
-            "vegetation_change": vegetation_change,
-            "vegetation_change_percent": vegetation_change_percent,
-            "initial_vegetation_coverage": (verification_results["Initial vegetation area"] / verification_results["Initial total area"] * 100) if verification_results["Initial total area"] > 0 else 0,
-            "updated_vegetation_coverage": (verification_results["Updated vegetation area"] / verification_results["Updated total area"] * 100) if verification_results["Updated total area"] > 0 else 0
-        },
-        "detailed_areas": verification_results,
-        "ndvi_classification": {
-            "initial_classes": initial_ndvi_class_areas,
-            "updated_classes": updated_ndvi_class_areas,
-            "class_changes": class_changes,
-            "class_labels": ndvi_class_labels
-        }
-    }
-
-    return report_data
-
 def main():
     # st.session_state['initial_veg_area'] = 0.0
     # st.session_state['initial_nonveg_area'] = 0.0
@@ -607,7 +552,12 @@ def main():
     # initial_nonveg_area = st.session_state['initial_nonveg_area']
     # updated_veg_area = st.session_state['updated_veg_area']
     # updated_nonveg_area = st.session_state['updated_nonveg_area']
-    ee_authenticate()
+    try:
+        initialize_earth_engine()
+    except Exception as e:
+        st.error(f"Earth Engine initialization failed: {str(e)}")
+        st.stop()
+    trace = start_trace("main")
     st.markdown(
     """
     <style>
@@ -629,7 +579,38 @@ def main():
                 cloud_pixel_percentage = st.slider(label="cloud pixel rate", min_value=5, max_value=100, step=5, value=85, label_visibility="collapsed")
                 st.info("Upload Area Of Interest file:")
                 upload_files = st.file_uploader("Create a GeoJSON file at: [geojson.io](https://geojson.io/)", accept_multiple_files=True)
-                geometry_aoi = upload_files_proc(upload_files)
+                geometry_aoi, aoi = upload_files_proc(upload_files)
+                if aoi is not None:
+                    simplification = aoi['simplification']
+                    st.caption(
+                        f"Geometry simplified to {simplification['tolerance_m']:g} m: "
+                        f"{simplification['vertices_before']:,} → {simplification['vertices_after']:,} vertices, "
+                        f"{simplification['payload_bytes_before'] / 1024:,.1f} → {simplification['payload_bytes_after'] / 1024:,.1f} KB per request"
+                    )
+                    if simplification['rejected_polygons']:
+                        st.warning(
+                            f"{simplification['rejected_polygons']:,} polygon(s) were skipped because they cross "
+                            "themselves or have no area; fix them (e.g. at geojson.io) to include them."
+                        )
+                    if simplification['payload_bytes_after'] > PAYLOAD_BUDGET_BYTES:
+                        st.warning("The AOI geometry is still large after simplification; requests may be slow or rejected.")
+                per_feature = st.checkbox("Per-field statistics", help="One row per uploaded feature, downloadable as CSV")
+                tiled = st.checkbox(
+                    "Tiled processing",
+                    help="Reduce AOIs too large for one request (districts, watersheds) at full resolution, tile by tile"
+                )
+                st.info("Processing Engine ⚙️")
+                engine = st.selectbox("processing engine", options=ENGINE_OPTIONS, label_visibility="collapsed")
+                local_scenes_file = st.file_uploader("Local Sentinel-2 scenes (.npz), used by the local engine", type=["npz"])
+                geotiff_manifest = st.selectbox(
+                    "GeoTIFF scene list (JSON), used by the GeoTIFF engine", options=geotiff_manifests(), index=None,
+                    help="Manifests listing the scenes' band files (see geotiff_backend.py), from the server's VEGALYTICS_SCENES_DIR"
+                )
+                if engine == GEOTIFF_ENGINE and not geotiff_manifests():
+                    st.caption("No GeoTIFF manifests: set VEGALYTICS_SCENES_DIR on the server to a directory of scene lists.")
+                st.info("Analysis Mode 📈")
+                analysis_mode = st.selectbox("analysis mode", options=MODE_OPTIONS, label_visibility="collapsed",
+                                             help="The time series covers the initial to updated date in consecutive windows")
                 default_ndvi_palette = ["#ffffe5", "#f7fcb9", "#78c679", "#41ab5d", "#238443", "#005a32"]
                 default_reclassified_ndvi_palette = ["#a50026","#ed5e3d","#f9f7ae","#f4ff78","#9ed569","#229b51","#006837"]
                 ndvi_palette = default_ndvi_palette.copy()
@@ -648,36 +629,43 @@ def main():
                 col2.success("Updated NDVI Date 📅")
                 updated_date = col2.date_input("updated", value=delay, label_visibility="collapsed")
                 time_range = 7
-                str_initial_start_date, str_initial_end_date = date_input_proc(initial_date, time_range)
-                str_updated_start_date, str_updated_end_date = date_input_proc(updated_date, time_range)
-            global last_uploaded_centroid
-            if last_uploaded_centroid is not None:
-                latitude = last_uploaded_centroid[1]
-                longitude = last_uploaded_centroid[0]
+            # Imported once the sidebar is on screen
+            folium = load_folium()
+            if aoi is not None:
+                longitude, latitude = aoi['centroid']
                 m = folium.Map(location=[latitude, longitude], tiles=None, zoom_start=12, control_scale=True)
+                m.fit_bounds(aoi['bounds'])
             else:
                 m = folium.Map(location=[36.45, 10.85], tiles=None, zoom_start=4, control_scale=True)
-                b0 = folium.TileLayer('OpenStreetMap', name='Open Street Map', attr='OSM')
-                b0.add_to(m)
-
-            initial_collection = satCollection(cloud_pixel_percentage, str_initial_start_date, str_initial_end_date, geometry_aoi)
-            updated_collection = satCollection(cloud_pixel_percentage, str_updated_start_date, str_updated_end_date, geometry_aoi)
-            initial_sat_imagery = initial_collection.median()
-            updated_sat_imagery = updated_collection.median()
-            initial_lai = getLAI(initial_sat_imagery)
-            updated_lai = getLAI(updated_sat_imagery)
-            initial_tci_image = initial_sat_imagery
-            updated_tci_image = updated_sat_imagery
+            b0 = folium.TileLayer('OpenStreetMap', name='Open Street Map', attr='OSM')
+            b0.add_to(m)
+
+            # Only records the inputs; images are built and evaluated after submit
+            analysis = None
+            if engine == LOCAL_ENGINE:
+                if aoi is not None and local_scenes_file is not None:
+                    analysis = Analysis(aoi['geometry'], initial_date, updated_date, cloud_pixel_percentage, time_range=time_range,
+                                        cache=get_result_cache(), backend=load_local_backend(local_scenes_file.getvalue()))
+            elif engine == GEOTIFF_ENGINE:
+                if aoi is not None and geotiff_manifest:
+                    try:
+                        manifest_mtime = os.stat(os.path.join(GEOTIFF_SCENES_DIR, geotiff_manifest)).st_mtime_ns
+                        backend = load_geotiff_backend(geotiff_manifest, manifest_mtime)
+                    except (OSError, ValueError, KeyError) as e:
+                        st.error(f"Unable to open the GeoTIFF scenes: {e}")
+                    else:
+                        analysis = Analysis(aoi['geometry'], initial_date, updated_date, cloud_pixel_percentage,
+                                            time_range=time_range, cache=get_result_cache(), backend=backend)
+            elif geometry_aoi is not None:
+                analysis = Analysis(geometry_aoi, initial_date, updated_date, cloud_pixel_percentage, time_range=time_range,
+                                    cache=get_result_cache(), tiled=tiled)
+
             tci_params = {
                 'bands': ['B4', 'B3', 'B2'],  # Using Red, Green & Blue bands for TCI.
                 'min': 0,
                 'max': 1,
                 'gamma': 1
             }
-            def getNDVI(collection):
-                return collection.normalizedDifference(['B8', 'B4'])
-            initial_ndvi = getNDVI(initial_sat_imagery)
-            updated_ndvi = getNDVI(updated_sat_imagery)
             ndvi_params = {
                 'min': 0,
                 'max': 1,
@@ -688,16 +676,6 @@ def main():
                 'max': 6,
                 'palette': ['#ffffcc', '#c2e699', '#78c679', '#238443', '#004529']
                 }
-
-            def satImageMask(sat_image):
-                masked_image = sat_image.updateMask(sat_image.gte(0))
-                return masked_image
-            initial_ndvi = satImageMask(initial_ndvi)
-            updated_ndvi = satImageMask(updated_ndvi)
-
-            # Use consistent function for NDVI classification
-            initial_ndvi_classified = classify_ndvi(initial_ndvi)
-            updated_ndvi_classified = classify_ndvi(updated_ndvi)
             ndvi_classified_params = {
                 'min': 1,
                 'max': 7,
@@ -717,8 +695,6 @@ def main():
                 'palette': ["#8B4513"],  # Brown
                 'opacity': 0.5
             }
-            initial_vegetation, initial_non_vegetation = classify_vegetation_ndvi(initial_ndvi)
-            updated_vegetation, updated_non_vegetation = classify_vegetation_ndvi(updated_ndvi)
 
             # Calculate areas
             initial_veg_area = 0
@@ -729,85 +705,127 @@ def main():
             # Calculate NDVI class areas
             initial_ndvi_class_areas = {i: 0 for i in range(1, 8)}
             updated_ndvi_class_areas = {i: 0 for i in range(1, 8)}
-            print("STARTED")
-            if geometry_aoi is not None:
-                initial_veg_area = calculate_area(initial_vegetation, geometry_aoi, label="Initial Vegetation") or 0
-                initial_nonveg_area = calculate_area(initial_non_vegetation, geometry_aoi, label="Initial Non-Vegetation") or 0
-                updated_veg_area = calculate_area(updated_vegetation, geometry_aoi, label="Updated Vegetation") or 0
-                updated_nonveg_area = calculate_area(updated_non_vegetation, geometry_aoi, label="Updated Non-Vegetation") or 0
-
-                # Calculate areas for each NDVI class
-                initial_ndvi_class_areas = calculate_ndvi_class_areas(initial_ndvi_classified, geometry_aoi)
-                updated_ndvi_class_areas = calculate_ndvi_class_areas(updated_ndvi_classified, geometry_aoi)
-
-                # Verify calculations
-                verification = verify_calculations(
-                    initial_ndvi_class_areas,
-                    updated_ndvi_class_areas,
-                    initial_veg_area,
-                    initial_nonveg_area,
-                    updated_veg_area,
-                    updated_nonveg_area
-                )
-                # Generate comprehensive report
-                report_data = generate_verification_report(
-                    verification,
-                    initial_ndvi_class_areas,
-                    updated_ndvi_class_areas,
-                    initial_date,
-                    updated_date,
-                    geometry_aoi,
-                    cloud_pixel_percentage
-                )
+            verification = None
+            report_data = None
+            lai_results = None
+            feature_rows = None
+            report_images = []
+            submitted = c2.form_submit_button("Generate map")
+        if submitted:
+            with c1:
+                if analysis_mode == TIME_SERIES_MODE:
+                    if engine in LOCAL_ENGINES:
+                        st.warning("The NDVI time series needs the Google Earth Engine engine.")
+                    elif geometry_aoi is not None:
+                        with stage("time series"):
+                            render_time_series(geometry_aoi, initial_date, updated_date, cloud_pixel_percentage, time_range,
+                                               plan=analysis.plan)
+                elif analysis is not None:
+                    # Large AOIs get a quick coarse estimate first; the planned scale is computed
+                    # in the background and picked up by a later submit
+                    tile_bar = None
+                    if analysis.tiles:
+                        tile_bar, analysis.progress = tile_progress_bar(len(analysis.tiles))
+                    try:
+                        with stage("two-date analysis"):
+                            coarse = analysis.coarse()
+                            results = refined_results(analysis) if coarse is not None else run_analysis(analysis.key, analysis)
+                            if results is None:
+                                results = run_analysis(coarse.key, coarse)
+                                st.info(
+                                    f"Quick estimate at {COARSE_SCALE} m. Results at {analysis.plan['scale']} m are being computed "
+                                    "in the background, press Generate map again to load them."
+                                )
+                    except Exception as e:
+                        # Retries are exhausted by now; show the failure instead of zero areas
+                        st.error(f"Error running the analysis: {e}")
+                        render_trace(trace)
+                        st.stop()
+                    if tile_bar is not None:
+                        tile_bar.empty()
+                    initial_ndvi_class_areas = results['initial_ndvi_class_areas']
+                    updated_ndvi_class_areas = results['updated_ndvi_class_areas']
+                    initial_veg_area = results['initial_veg_area']
+                    initial_nonveg_area = results['initial_nonveg_area']
+                    updated_veg_area = results['updated_veg_area']
+                    updated_nonveg_area = results['updated_nonveg_area']
+                    verification = results['verification']
+                    report_data = results['report_data']
+                    lai_results = results['lai']
+                    scene_counts = results.get('scene_counts') or {}
+                    for name, (start, end) in (('initial', analysis.initial_window), ('updated', analysis.updated_window)):
+                        if scene_counts.get(name) == 0:
+                            st.warning(
+                                f"No Sentinel-2 scenes below {cloud_pixel_percentage}% cloud cover between "
+                                f"{start} and {end} ({name} date)."
+                            )
+                    if per_feature:
+                        features = aoi['features']
+                        if features['features']:
+                            with stage("per-field statistics"):
+                                feature_rows = run_feature_statistics(analysis.key, fingerprint(features=features), analysis, features)
+
+                    initial, updated = analysis.initial, analysis.updated
+                    if not isinstance(analysis.backend, EarthEngineBackend):
+                        # Local engine results are arrays, there are no Earth Engine tiles to show
+                        layers = []
+                    elif initial_date == updated_date:
+                        layers = [
+                            (updated['tci'], tci_params, 'Satellite Imagery'),
+                            (updated['ndvi'], ndvi_params, 'Raw NDVI'),
+                            (updated['ndvi_classified'], ndvi_classified_params, 'Reclassified NDVI'),
+                            (updated['vegetation'], vegetation_params, 'Vegetation Area'),
+                            (updated['non_vegetation'], non_vegetation_params, 'Non-Vegetation Area'),
+                            (initial['lai'], lai_params, f'Initial LAI: {initial_date}'),
+                            (updated['lai'], lai_params, f'Updated LAI: {updated_date}')
+                        ]
+                    else:
+                        layers = [
+                            (initial['tci'], tci_params, f'Initial Satellite Imagery: {initial_date}'),
+                            (updated['tci'], tci_params, f'Updated Satellite Imagery: {updated_date}'),
+                            (initial['ndvi'], ndvi_params, f'Initial Raw NDVI: {initial_date}'),
+                            (updated['ndvi'], ndvi_params, f'Updated Raw NDVI: {updated_date}'),
+                            (initial['ndvi_classified'], ndvi_classified_params, f'Initial Reclassified NDVI: {initial_date}'),
+                            (updated['ndvi_classified'], ndvi_classified_params, f'Updated Reclassified NDVI: {updated_date}'),
+                            (initial['vegetation'], vegetation_params, 'Initial Vegetation Area'),
+                            (initial['non_vegetation'], non_vegetation_params, 'Initial Non-Vegetation Area'),
+                            (updated['vegetation'], vegetation_params, 'Updated Vegetation Area'),
+                            (updated['non_vegetation'], non_vegetation_params, 'Updated Non-Vegetation Area')
+                        ]
+                    # All map IDs are resolved concurrently (or reused from the tile URL cache)
+                    if layers:
+                        with stage("map layers"):
+                            m.add_ee_layers(layers)
+                        folium.LayerControl(collapsed=True).add_to(m)
+
+                        # Static renders for the downloadable report, cached on disk like the results
+                        dates = [('Updated', updated, updated_date)]
+                        if initial_date != updated_date:
+                            dates.insert(0, ('Initial', initial, initial_date))
+                        report_layers = [
+                            (images[key], params, f"{side} {title}: {day}")
+                            for side, images, day in dates
+                            for key, params, title in (
+                                ('tci', tci_params, 'Satellite Imagery'),
+                                ('ndvi_classified', ndvi_classified_params, 'Reclassified NDVI'),
+                                ('vegetation', vegetation_params, 'Vegetation Area')
+                            )
+                        ]
+                        cache = get_result_cache()
+                        with stage("report thumbnails"):
+                            thumbnails = fetch_thumbnails(
+                                report_layers, geometry_aoi, cache=cache,
+                                ttl=cache.ttl_for([analysis.initial_window[1], analysis.updated_window[1]])
+                            )
+                        report_images = [(name, png) for (_, _, name), png in zip(report_layers, thumbnails) if png]
 
                 # Display the main vegetation statistics
                 st.write(f"Initial Vegetation Area: {initial_veg_area:.2f} m²")
                 st.write(f"Initial Non-Vegetation Area: {initial_nonveg_area:.2f} m²")
                 st.write(f"Updated Vegetation Area: {updated_veg_area:.2f} m²")
                 st.write(f"Updated Non-Vegetation Area: {updated_nonveg_area:.2f} m²")
-            else:
-                # Display the main vegetation statistics
-                st.write(f"Initial Vegetation Area: {initial_veg_area:.2f} m²")
-                st.write(f"Initial Non-Vegetation Area: {initial_nonveg_area:.2f} m²")
-                st.write(f"Updated Vegetation Area: {updated_veg_area:.2f} m²")
-                st.write(f"Updated Non-Vegetation Area: {updated_nonveg_area:.2f} m²")
-
-
-            if initial_date == updated_date:
-                m.add_ee_layer(updated_tci_image, tci_params, 'Satellite Imagery')
-                m.add_ee_layer(updated_ndvi, ndvi_params, 'Raw NDVI')
-                m.add_ee_layer(updated_ndvi_classified, ndvi_classified_params, 'Reclassified NDVI')
-                m.add_ee_layer(updated_vegetation, vegetation_params, 'Vegetation Area')
-                m.add_ee_layer(updated_non_vegetation, non_vegetation_params, 'Non-Vegetation Area')
-                try:
-                  print("=====>", initial_lai, "========>", lai_params, "DATE: ", initial_date, "ENDATE: ", updated_date)
-                  m.add_ee_layer(initial_lai, lai_params, f'Initial LAI: {initial_date}')
-                  m.add_ee_layer(updated_lai, lai_params, f'Updated LAI: {updated_date}')
-                except Exception as e:
-                  print(f"----------------------: {str(e)}")
-                  pass
-
-            else:
-                m.add_ee_layer(initial_tci_image, tci_params, f'Initial Satellite Imagery: {initial_date}')
-                m.add_ee_layer(updated_tci_image, tci_params, f'Updated Satellite Imagery: {updated_date}')
-                try:
-                  print("=====>", initial_ndvi, "========>", ndvi_params, "DATE: ", initial_date)
-                  m.add_ee_layer(initial_ndvi, ndvi_params, f'Initial Raw NDVI: {initial_date}')
-                  m.add_ee_layer(updated_ndvi, ndvi_params, f'Updated Raw NDVI: {updated_date}')
-                except Exception as e:
-                  print(f"----------------------: {str(e)}")
-                  pass
-                m.add_ee_layer(initial_ndvi_classified, ndvi_classified_params, f'Initial Reclassified NDVI: {initial_date}')
-                m.add_ee_layer(updated_ndvi_classified, ndvi_classified_params, f'Updated Reclassified NDVI: {updated_date}')
-                m.add_ee_layer(initial_vegetation, vegetation_params, 'Initial Vegetation Area')
-                m.add_ee_layer(initial_non_vegetation, non_vegetation_params, 'Initial Non-Vegetation Area')
-                m.add_ee_layer(updated_vegetation, vegetation_params, 'Updated Vegetation Area')
-                m.add_ee_layer(updated_non_vegetation, non_vegetation_params, 'Updated Non-Vegetation Area')
-
-            folium.LayerControl(collapsed=True).add_to(m)
-            submitted = c2.form_submit_button("Generate map")
-        if submitted:
-            with c1:
+                if report_data:
+                    st.caption(f"Analysis scale: {report_data['analysis_parameters']['analysis_scale']}")
                 if selected_map == "Google Maps (Embedded)":
                     st.markdown(
                         """
@@ -823,6 +841,8 @@ def main():
                         unsafe_allow_html=True
                     )
                 else:
+                    from streamlit_folium import folium_static
+
                     folium_static(m)
 
                 # Display verification information in an expandable section
@@ -834,340 +854,55 @@ def main():
                                 st.write(f"{key}: {value:.2f} m²")
                             else:
                                 st.write(f"{key}: {value}")
+                    cache_stats = get_result_cache().stats()
+                    st.caption(
+                        f"Result cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                        f"{cache_stats['coalesced']} shared with concurrent requests, "
+                        f"{cache_stats['entries']} entries ({cache_stats['bytes'] / 1024:.0f} KiB)"
+                    )
+
+                if feature_rows:
+                    st.subheader("Per-Field Statistics")
+                    import pandas as pd
+
+                    feature_table = pd.DataFrame(feature_rows)
+                    st.dataframe(feature_table, hide_index=True)
+                    st.download_button(
+                        "Download table (CSV)",
+                        feature_table.to_csv(index=False),
+                        file_name="per_field_statistics.csv",
+                        mime="text/csv"
+                    )
+
+                render_trace(trace)
 
                 # ---------------- HISTOGRAMS SECTION ----------------
             with st.container():
               st.subheader("Vegetation vs Non-Vegetation & Stacked Histograms")
 
-              # Combine both charts into one HTML block
-              charts_html = """
-              <div style="width: 100%; height: 300px;">
-                  <canvas id="vegetationChart"></canvas>
-              </div>
-              <div style="width: 100%; height: 300px;">
-                  <canvas id="stackedChart"></canvas>
-              </div>
-              <!-- Load Chart.js once -->
-              <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-
-              <script>
-                  // First chart: Vegetation vs Non-Vegetation
-                  const vegetationCtx = document.getElementById('vegetationChart').getContext('2d');
-                  const vegetationChart = new Chart(vegetationCtx, {{
-                      type: 'bar',
-                      data: {{
-                          labels: ['Initial Vegetation', 'Initial Non-Vegetation', 'Updated Vegetation', 'Updated Non-Vegetation'],
-                          datasets: [ {{
-                              label: 'Area (m²)',
-                              data: [{initial_veg_area}, {initial_nonveg_area}, {updated_veg_area}, {updated_nonveg_area}],
-                              backgroundColor: ['#006837', '#8B4513', '#006837', '#8B4513'],
-                              borderColor: ['#006837', '#8B4513', '#006837', '#8B4513'],
-                              borderWidth: 1
-                          }} ]
-                      }},
-                      options: {{
-                          scales: {{
-                              y: {{ beginAtZero: true }}
-                          }}
-                      }}
-                  }});
-
-                  // Second chart: Stacked Detailed Histogram
-                  const stackedCtx = document.getElementById('stackedChart').getContext('2d');
-                  const stackedChart = new Chart(stackedCtx, {{
-                      type: 'bar',
-                      data: {{
-                          labels: ['Initial', 'Updated'],
-                          datasets: [
-                              {{
-                                  label: 'Vegetation Area (m²)',
-                                  data: [{initial_veg_area}, {updated_veg_area}],
-                                  backgroundColor: '#006837',
-                                  borderColor: '#006837',
-                                  borderWidth: 1
-                              }},
-                              {{
-                                  label: 'Non-Vegetation Area (m²)',
-                                  data: [{initial_nonveg_area}, {updated_nonveg_area}],
-                                  backgroundColor: '#8B4513',
-                                  borderColor: '#8B4513',
-                                  borderWidth: 1
-                              }}
-                          ]
-                      }},
-                      options: {{
-                          scales: {{
-                              x: {{ stacked: true }},
-                              y: {{ beginAtZero: true, stacked: true }}
-                          }}
-                      }}
-                  }});
-              </script>
-              """.format(
-                  initial_veg_area=initial_veg_area,
-                  initial_nonveg_area=initial_nonveg_area,
-                  updated_veg_area=updated_veg_area,
-                  updated_nonveg_area=updated_nonveg_area,
+              # Every series is built once; each chart embeds the rows it draws (see charts.py)
+              chart_data = chart_payload(
+                  {
+                      'initial_veg_area': initial_veg_area, 'initial_nonveg_area': initial_nonveg_area,
+                      'updated_veg_area': updated_veg_area, 'updated_nonveg_area': updated_nonveg_area
+                  },
+                  initial_ndvi_class_areas, updated_ndvi_class_areas, reclassified_ndvi_palette, lai_results
               )
-
-              # Render both charts in one iframe
-              components.html(charts_html, height=700, scrolling=True)
+              for spec in vegetation_specs(chart_data):
+                  st.vega_lite_chart(spec, use_container_width=True)
 
             # New section for NDVI Classification Charts
             with st.container():
                 st.subheader("NDVI Classification Distribution")
 
-                # Create labels for the NDVI classes
-                ndvi_class_labels = [
-                    "Absent Vegetation",
-                    "Bare Soil",
-                    "Low Vegetation",
-                    "Light Vegetation",
-                    "Moderate Vegetation",
-                    "Strong Vegetation",
-                    "Dense Vegetation"
-                ]
-
-                # Calculate the total for each period to show percentage
-                initial_total_area = sum(initial_ndvi_class_areas.values())
-                updated_total_area = sum(updated_ndvi_class_areas.values())
-
-                # Create the HTML for the NDVI classification charts
-                ndvi_charts_html = """
-                <div style="width: 100%; height: 400px;">
-                    <canvas id="ndviClassChart"></canvas>
-                </div>
-                <div style="width: 100%; height: 400px;">
-                    <canvas id="ndviComparisonChart"></canvas>
-                </div>
-
-                <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-
-                <script>
-                    // NDVI Classification Distribution
-                    const ndviCtx = document.getElementById('ndviClassChart').getContext('2d');
-                    const ndviChart = new Chart(ndviCtx, {{
-                        type: 'bar',
-                        data: {{
-                            labels: {labels},
-                            datasets: [
-                                {{
-                                    label: 'Initial NDVI Classes (m²)',
-                                    data: [{initial_class_data}],
-                                    backgroundColor: {colors},
-                                    borderColor: {colors},
-                                    borderWidth: 1
-                                }},
-                                {{
-                                    label: 'Updated NDVI Classes (m²)',
-                                    data: [{updated_class_data}],
-                                    backgroundColor: {colors}.map(color => color + '80'),  // Add transparency
-                                    borderColor: {colors},
-                                    borderWidth: 1
-                                }}
-                            ]
-                        }},
-                        options: {{
-                            scales: {{
-                                y: {{
-                                    beginAtZero: true,
-                                    title: {{
-                                        display: true,
-                                        text: 'Area (m²)'
-                                    }}
-                                }}
-                            }},
-                            plugins: {{
-                                title: {{
-                                    display: true,
-                                    text: 'NDVI Class Distribution'
-                                }},
-                                legend: {{
-                                    display: true,
-                                    position: 'top'
-                                }}
-                            }}
-                        }}
-                    }});
-
-                    // Stacked NDVI Comparison Chart
-                    const comparisonCtx = document.getElementById('ndviComparisonChart').getContext('2d');
-                    const comparisonChart = new Chart(comparisonCtx, {{
-                        type: 'bar',
-                        data: {{
-                            labels: ['Initial', 'Updated'],
-                            datasets: [
-                                {stacked_datasets}
-                            ]
-                        }},
-                        options: {{
-                            scales: {{
-                                x: {{ stacked: true }},
-                                y: {{
-                                    beginAtZero: true,
-                                    stacked: true,
-                                    title: {{
-                                        display: true,
-                                        text: 'Area (m²)'
-                                    }}
-                                }}
-                            }},
-                            plugins: {{
-                                title: {{
-                                    display: true,
-                                    text: 'NDVI Classification Comparison'
-                                }},
-                                legend: {{
-                                    display: true,
-                                    position: 'top'
-                                }}
-                            }}
-                        }}
-                    }});
-                </script>
-                """.format(
-                    labels=json.dumps(ndvi_class_labels),
-                    initial_class_data=', '.join(str(initial_ndvi_class_areas[i]) for i in range(1, 8)),
-                    updated_class_data=', '.join(str(updated_ndvi_class_areas[i]) for i in range(1, 8)),
-                    colors=json.dumps(reclassified_ndvi_palette),
-                    stacked_datasets=', '.join([
-                        f"""{{
-                            label: '{ndvi_class_labels[i-1]}',
-                            data: [{initial_ndvi_class_areas[i]}, {updated_ndvi_class_areas[i]}],
-                            backgroundColor: '{reclassified_ndvi_palette[i-1]}',
-                            borderColor: '{reclassified_ndvi_palette[i-1]}',
-                            borderWidth: 1
-                        }}""" for i in range(1, 8)
-                    ])
-                )
-
-                # Render the NDVI charts
-                components.html(ndvi_charts_html, height=850, scrolling=True)
+                for spec in ndvi_class_specs(chart_data):
+                    st.vega_lite_chart(spec, use_container_width=True)
 
               # ---------------- LAI VISUALIZATION SECTION ----------------
             with st.container():
                 st.subheader("Leaf Area Index (LAI) Visualization")
-                bands = initial_lai.bandNames().getInfo()
-                if bands:
-                  # Calculate LAI statistics
-                  initial_lai_stats = initial_lai.reduceRegion(
-                      reducer=ee.Reducer.mean().combine(
-                          reducer2=ee.Reducer.stdDev(),
-                          sharedInputs=True
-                      ),
-                      geometry=geometry_aoi,
-                      scale=10,
-                      maxPixels=1e9
-                  ).getInfo()
-
-                  updated_lai_stats = updated_lai.reduceRegion(
-                      reducer=ee.Reducer.mean().combine(
-                          reducer2=ee.Reducer.stdDev(),
-                          sharedInputs=True
-                      ),
-                      geometry=geometry_aoi,
-                      scale=10,
-                      maxPixels=1e9
-                  ).getInfo()
-
-                  # Create LAI histogram data using the manual method
-                  def get_lai_values(lai_image):
-                      values = lai_image.reduceRegion(
-                          reducer=ee.Reducer.toList(),
-                          geometry=geometry_aoi,
-                          scale=10,
-                          maxPixels=1e9
-                      ).get('LAI').getInfo()
-                      return values if values else []
-
-                  initial_lai_values = get_lai_values(initial_lai)
-                  updated_lai_values = get_lai_values(updated_lai)
-
-                  # Bin ranges
-                  lai_bins = [0, 1, 2, 3, 4, 5, 6]
-
-                  def calculate_histogram(values, bins):
-                      hist = [0] * (len(bins)-1)
-                      for value in values:
-                          for i in range(len(bins)-1):
-                              if bins[i] <= value < bins[i+1]:
-                                  hist[i] += 1
-                                  break
-                      return hist
-
-                  initial_lai_dist = calculate_histogram(initial_lai_values, lai_bins)
-                  updated_lai_dist = calculate_histogram(updated_lai_values, lai_bins)
-
-                  # Create the LAI visualization HTML
-                  lai_html = """
-                  <div style="width: 100%; height: 400px;">
-                      <canvas id="laiChart"></canvas>
-                  </div>
-                  <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-                  <script>
-                      const laiCtx = document.getElementById('laiChart').getContext('2d');
-                      const laiChart = new Chart(laiCtx, {{
-                          type: 'bar',
-                          data: {{
-                              labels: ['0-1', '1-3', '3-6', '>6'],
-                              datasets: [
-                                  {{
-                                      label: 'Initial LAI Distribution',
-                                      data: {initial_lai_dist},
-                                      backgroundColor: '#78c67980',
-                                      borderColor: '#78c679',
-                                      borderWidth: 1
-                                  }},
-                                  {{
-                                      label: 'Updated LAI Distribution',
-                                      data: {updated_lai_dist},
-                                      backgroundColor: '#23844380',
-                                      borderColor: '#238443',
-                                      borderWidth: 1
-                                  }}
-                              ]
-                          }},
-                          options: {{
-                              responsive: true,
-                              scales: {{
-                                  y: {{
-                                      beginAtZero: true,
-                                      title: {{
-                                          display: true,
-                                          text: 'Pixel Count'
-                                      }}
-                                  }},
-                                  x: {{
-                                      title: {{
-                                          display: true,
-                                          text: 'LAI Range'
-                                      }}
-                                  }}
-                              }},
-                              plugins: {{
-                                  title: {{
-                                      display: true,
-                                      text: 'LAI Distribution Comparison'
-                                  }},
-                                  subtitle: {{
-                                      display: true,
-                                      text: 'Initial Mean: {initial_mean:.2f} ± {initial_std:.2f} | Updated Mean: {updated_mean:.2f} ± {updated_std:.2f}'
-                                  }}
-                              }}
-                          }}
-                      }});
-                  </script>
-                  """.format(
-                      initial_lai_dist=initial_lai_dist,
-                      updated_lai_dist=updated_lai_dist,
-                      initial_mean=initial_lai_stats.get('mean', 0),
-                      initial_std=initial_lai_stats.get('stdDev', 0),
-                      updated_mean=updated_lai_stats.get('mean', 0),
-                      updated_std=updated_lai_stats.get('stdDev', 0)
-                  )
-
-
-                  components.html(lai_html, height=450)
+                if lai_results:
+                  st.vega_lite_chart(lai_spec(chart_data), use_container_width=True)
 
                   # Add LAI interpretation table
                   st.subheader("LAI Interpretation Guide")
@@ -1197,7 +932,7 @@ def main():
                   #         st.metric("Updated LAI Mean", f"{updated_lai_stats.get('mean', 0):.2f}")
                   #         st.metric("Updated LAI Std Dev", f"{updated_lai_stats.get('stdDev', 0):.2f}")
                 else:
-                  st.warning("No bands found in the LAI image.")
+                  st.warning("No LAI statistics: there are no Sentinel-2 scenes for either date.")
         else:
             with c1:
                 if selected_map == "Google Maps (Embedded)":
@@ -1215,6 +950,8 @@ def main():
                         unsafe_allow_html=True
                     )
                 else:
+                    from streamlit_folium import folium_static
+
                     folium_static(m)
 
     with st.container():
@@ -1255,7 +992,7 @@ def main():
     # Add report section
     with st.expander("📊 Comprehensive Analysis Report", expanded=False):
         try:
-          report_html = create_report_html(report_data)
+          report_html = create_report_html(report_data, report_images)
           components.html(report_html, height=800, scrolling=True)
 
           # Add download button for report
@@ -0,0 +1,254 @@
+"""
+Headless batch runner: the app's two-date analysis over a manifest of AOI × date jobs.
+
+    python batch.py manifest.csv --output results.csv --workers 8
+    python batch.py manifest.json --output results.parquet --scenes scenes.npz
+    python batch.py manifest.csv --output results.csv --geotiffs scenes.json
+
+The manifest is a CSV with the columns aoi, initial_date and updated_date (and optionally
+name, cloud_rate and scale), or a JSON list of objects with the same keys. `aoi` is a
+GeoJSON file, relative to the manifest; all its polygons form the AOI. Jobs run in
+parallel and each result row, including the verification report, is written as soon
+as its job finishes. Parquet output needs pyarrow. With --tiled, AOIs too large for one
+request at their scale (districts, watersheds) are reduced tile by tile. --geotiffs runs
+on local GeoTIFF scenes larger than memory (see geotiff_backend.py for the scene list).
+
+Only analysis.py and the result cache are used, so this never imports Streamlit or Folium.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date
+
+import ee
+
+from analysis import NDVI_CLASSES, Analysis
+from aoi_upload import merge_uploads, parse_geojson
+from result_cache import ResultCache
+from scheduler import BATCH, request_priority
+
+DEFAULT_CLOUD_RATE = 85
+DEFAULT_PROJECT = 'ndvi-441403'
+PARQUET_ROW_GROUP = 50
+
+COLUMNS = (
+    ['name', 'aoi', 'initial_date', 'updated_date', 'cloud_rate', 'scale', 'status', 'error', 'elapsed_s',
+     'aoi_area', 'initial_veg_area', 'initial_nonveg_area', 'updated_veg_area', 'updated_nonveg_area',
+     'vegetation_change', 'vegetation_change_percent']
+    + [f'{name}_class_{c}_area' for name in ('initial', 'updated') for c in NDVI_CLASSES]
+    + ['initial_lai_mean', 'updated_lai_mean', 'verification', 'report']
+)
+
+
+def initialize_earth_engine(service_account_key=None, project=DEFAULT_PROJECT):
+    """Same credentials as the app: a service account key file if given, else the default project."""
+    if service_account_key:
+        from google.oauth2 import service_account
+
+        credentials = service_account.Credentials.from_service_account_file(
+            service_account_key,
+            scopes=ee.oauth.SCOPES
+        )
+        ee.Initialize(credentials)
+    else:
+        ee.Initialize(project=project)
+
+
+def read_manifest(path):
+    if path.endswith('.json'):
+        with open(path) as f:
+            jobs = json.load(f)
+    else:
+        with open(path, newline='') as f:
+            jobs = list(csv.DictReader(f))
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for i, job in enumerate(jobs):
+        job['aoi'] = os.path.join(base_dir, job['aoi'])
+        job.setdefault('name', None)
+        job['name'] = job['name'] or f"{os.path.splitext(os.path.basename(job['aoi']))[0]}-{i}"
+    return jobs
+
+
+def load_aoi(path):
+    """Merge every polygon of a GeoJSON file into one MultiPolygon dict."""
+    with open(path, 'rb') as f:
+        aoi = merge_uploads([parse_geojson(f.read())])
+    if aoi is None:
+        raise ValueError(f"No polygons in {path}")
+    return aoi['geometry']
+
+
+def run_job(job, backend=None, cache=None, time_range=7, tiled=False):
+    """Run one manifest job and flatten its result into a COLUMNS row."""
+    start = time.perf_counter()
+    cloud_rate = int(job.get('cloud_rate') or DEFAULT_CLOUD_RATE)
+    scale = int(job.get('scale') or 10)
+    row = {
+        'name': job['name'],
+        'aoi': job['aoi'],
+        'initial_date': str(job['initial_date']),
+        'updated_date': str(job['updated_date']),
+        'cloud_rate': cloud_rate,
+        'scale': scale
+    }
+    try:
+        aoi = load_aoi(job['aoi'])
+        analysis = Analysis(
+            aoi if backend is not None else ee.Geometry(aoi),
+            date.fromisoformat(str(job['initial_date'])),
+            date.fromisoformat(str(job['updated_date'])),
+            cloud_rate,
+            time_range=time_range,
+            scale=scale,
+            cache=cache,
+            backend=backend,
+            tiled=tiled
+        )
+        # Interactive sessions sharing the process get free request slots first
+        with request_priority(BATCH):
+            results = analysis.run()
+    except Exception as e:
+        row.update(status='error', error=str(e), elapsed_s=round(time.perf_counter() - start, 3))
+        return row
+
+    report = results['report_data']
+    row.update(
+        status='ok',
+        aoi_area=report['analysis_parameters']['aoi_total_area'],
+        initial_veg_area=results['initial_veg_area'],
+        initial_nonveg_area=results['initial_nonveg_area'],
+        updated_veg_area=results['updated_veg_area'],
+        updated_nonveg_area=results['updated_nonveg_area'],
+        vegetation_change=report['summary_statistics']['vegetation_change'],
+        vegetation_change_percent=report['summary_statistics']['vegetation_change_percent'],
+        verification=json.dumps(results['verification'], default=str),
+        report=json.dumps(report, default=str)
+    )
+    for name in ('initial', 'updated'):
+        for class_value, area in results[f'{name}_ndvi_class_areas'].items():
+            row[f'{name}_class_{class_value}_area'] = area
+        if results['lai']:
+            row[f'{name}_lai_mean'] = results['lai'][f'{name}_stats']['mean']
+    row['elapsed_s'] = round(time.perf_counter() - start, 3)
+    return row
+
+
+class CsvSink:
+    def __init__(self, path):
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.DictWriter(self._file, fieldnames=COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, row):
+        self._writer.writerow(row)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """Writes a row group every PARQUET_ROW_GROUP finished jobs (and on close)."""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise SystemExit(f"Parquet output needs pyarrow ({e}); use a .csv output instead")
+        self._pa = pa
+        string_columns = {'name', 'aoi', 'initial_date', 'updated_date', 'status', 'error', 'verification', 'report'}
+        self._schema = pa.schema([
+            (column, pa.string() if column in string_columns else pa.float64()) for column in COLUMNS
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._rows = []
+
+    def write(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= PARQUET_ROW_GROUP:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        columns = {}
+        for field in self._schema:
+            values = [row.get(field.name) for row in self._rows]
+            if field.type == self._pa.float64():
+                # aoi_area may be "Unable to calculate"
+                values = [value if isinstance(value, (int, float)) else None for value in values]
+            columns[field.name] = values
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        self._rows = []
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+
+def open_sink(path):
+    return ParquetSink(path) if path.endswith('.parquet') else CsvSink(path)
+
+
+def run_batch(jobs, sink, workers=4, backend=None, cache=None, time_range=7, progress=None, tiled=False):
+    """Run jobs on a thread pool (the work is Earth Engine round trips), writing rows as they finish."""
+    failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, backend, cache, time_range, tiled) for job in jobs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            sink.write(row)
+            failed += row['status'] != 'ok'
+            if progress:
+                progress(done, len(jobs), row)
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifest', help='CSV or JSON manifest of jobs')
+    parser.add_argument('--output', required=True, help='results file (.csv or .parquet)')
+    parser.add_argument('--workers', type=int, default=4, help='jobs run in parallel')
+    parser.add_argument('--time-range', type=int, default=7, help='days of imagery before each date')
+    parser.add_argument('--scenes', help='run on local Sentinel-2 scenes (.npz) instead of Earth Engine')
+    parser.add_argument('--geotiffs', help='run on local Sentinel-2 GeoTIFFs listed in a JSON scene manifest')
+    parser.add_argument('--service-account-key', default=os.environ.get('EE_SERVICE_ACCOUNT_KEY'),
+                        help='Earth Engine service account JSON key (default: $EE_SERVICE_ACCOUNT_KEY)')
+    parser.add_argument('--project', default=DEFAULT_PROJECT, help='Earth Engine project without a key')
+    parser.add_argument('--no-cache', action='store_true', help="don't use the persistent result cache")
+    parser.add_argument('--tiled', action='store_true', help='reduce large AOIs tile by tile at their full scale')
+    args = parser.parse_args(argv)
+
+    jobs = read_manifest(args.manifest)
+    backend = None
+    if args.scenes:
+        from local_backend import NumpyBackend
+
+        backend = NumpyBackend.from_npz(args.scenes)
+    elif args.geotiffs:
+        from geotiff_backend import GeoTiffBackend
+
+        backend = GeoTiffBackend.from_manifest(args.geotiffs)
+    else:
+        initialize_earth_engine(args.service_account_key, args.project)
+    cache = None if args.no_cache else ResultCache()
+
+    def progress(done, total, row):
+        message = f" ({row['error']})" if row['status'] != 'ok' else ''
+        print(f"[{done}/{total}] {row['name']}: {row['status']} in {row['elapsed_s']}s{message}", file=sys.stderr)
+
+    sink = open_sink(args.output)
+    try:
+        failed = run_batch(jobs, sink, args.workers, backend, cache, args.time_range, progress, args.tiled)
+    finally:
+        sink.close()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
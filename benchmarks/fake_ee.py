@@ -0,0 +1,355 @@
+"""
+Recording stand-in for the earthengine-api, used by the benchmarks.
+
+Every Earth Engine object is a lazy node that remembers how it was built. Evaluating a
+node (getInfo / getMapId) counts as one round trip: it is timed, sleeps for the
+configured latency and records the serialized request and response sizes. Results are
+synthesized from the shape of the expression so the app pipeline runs end to end.
+
+Install it before importing the app modules:
+
+    import sys
+    from benchmarks import fake_ee
+    sys.modules['ee'] = fake_ee
+"""
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+class EEException(Exception):
+    pass
+
+
+class Recorder:
+    """Counts and times evaluations per stage."""
+
+    def __init__(self):
+        self.latency = 0.0
+        self.aoi_area = 1e6
+        self._lock = threading.Lock()
+        self._stage = None
+        self.stages = defaultdict(self._empty_stage)
+
+    @staticmethod
+    def _empty_stage():
+        return {
+            'calls': defaultdict(int),
+            'call_time_s': defaultdict(float),
+            'request_bytes': 0,
+            'response_bytes': 0
+        }
+
+    @contextmanager
+    def stage(self, name):
+        previous, self._stage = self._stage, name
+        start = time.perf_counter()
+        try:
+            yield self.stages[name]
+        finally:
+            self.stages[name]['wall_time_s'] = time.perf_counter() - start
+            self._stage = previous
+
+    def count(self, method, seconds=0.0, request_bytes=0, response_bytes=0):
+        with self._lock:
+            stage = self.stages[self._stage or 'unstaged']
+            stage['calls'][method] += 1
+            stage['call_time_s'][method] += seconds
+            stage['request_bytes'] += request_bytes
+            stage['response_bytes'] += response_bytes
+
+    def round_trip(self, method, node, evaluate):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        result = evaluate()
+        self.count(
+            method,
+            time.perf_counter() - start,
+            request_bytes=len(node.serialize()),
+            response_bytes=len(json.dumps(result, default=str))
+        )
+        return result
+
+    def report(self):
+        return {
+            name: {
+                'wall_time_s': round(stage.get('wall_time_s', 0.0), 6),
+                'round_trips': sum(stage['calls'].get(method, 0) for method in ('getInfo', 'getMapId', 'getThumbURL')),
+                'calls': dict(stage['calls']),
+                'call_time_s': {k: round(v, 6) for k, v in stage['call_time_s'].items()},
+                'request_bytes': stage['request_bytes'],
+                'response_bytes': stage['response_bytes']
+            }
+            for name, stage in self.stages.items()
+        }
+
+
+recorder = Recorder()
+
+
+def _kinds(value, seen=None):
+    """Every factory and method name used anywhere in an expression."""
+    seen = set() if seen is None else seen
+    kinds = set()
+    if isinstance(value, ComputedObject):
+        if id(value) in seen:
+            return kinds
+        seen.add(id(value))
+        kinds.add(value._kind)
+        for op, args, kwargs in value._chain:
+            kinds.add(op)
+            for arg in list(args) + list(kwargs.values()):
+                kinds |= _kinds(arg, seen)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            kinds |= _kinds(item, seen)
+    elif isinstance(value, dict):
+        for item in value.values():
+            kinds |= _kinds(item, seen)
+    return kinds
+
+
+GEOMETRY_TYPES = ('Point', 'MultiPoint', 'LineString', 'MultiLineString', 'Polygon', 'MultiPolygon')
+
+
+class ComputedObject:
+    def __init__(self, kind, chain=()):
+        self._kind = kind
+        self._chain = tuple(chain)
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            if name in ('reduceRegion', 'reduceRegions'):
+                recorder.count(name)
+            items = self._client_list()
+            if name == 'map' and items is not None:
+                # Mapping over a client-side list: trace the function once per element
+                return ComputedObject('List', (('new', ([args[0](List(item)) for item in items],), {}),))
+            return ComputedObject(self._kind, self._chain + ((name, args, kwargs),))
+        return method
+
+    def _client_list(self):
+        if self._kind == 'List' and len(self._chain) == 1 and self._chain[0][0] == 'new':
+            args = self._chain[0][1]
+            if args and isinstance(args[0], (list, tuple)):
+                return list(args[0])
+        return None
+
+    def _ops(self):
+        return [op for op, _, _ in self._chain]
+
+    def serialize(self, *args, **kwargs):
+        # Like the real serializer, shared sub-expressions are stored once and referenced
+        table, refs = [], {}
+
+        def encode(value):
+            if isinstance(value, ComputedObject):
+                if id(value) not in refs:
+                    node = [value._kind] + [[op, encode(list(a)), encode(k)] for op, a, k in value._chain]
+                    refs[id(value)] = len(table)
+                    table.append(node)
+                return {'ref': refs[id(value)]}
+            if isinstance(value, (list, tuple)):
+                return [encode(v) for v in value]
+            if isinstance(value, dict):
+                return {str(k): encode(v) for k, v in value.items()}
+            return value
+        result = encode(self)
+        return json.dumps({'result': result, 'values': table}, default=str, sort_keys=True)
+
+    def toGeoJSON(self):
+        # Like the real client: geometries built from coordinates convert locally, computed
+        # ones (buffers, unions, ...) need the server
+        if len(self._chain) == 1 and self._chain[0][0] == 'new':
+            args = self._chain[0][1]
+            if self._kind == 'Geometry' and args and isinstance(args[0], dict):
+                return args[0]
+            if self._kind in GEOMETRY_TYPES and args and isinstance(args[0], (list, tuple)):
+                return {'type': self._kind, 'coordinates': args[0]}
+        raise EEException("Can't convert a computed geometry to GeoJSON.")
+
+    def getInfo(self):
+        return recorder.round_trip('getInfo', self, lambda: _evaluate(self))
+
+    def getMapId(self, vis_params=None):
+        def evaluate():
+            return {'mapid': 'fake', 'token': ''}
+        result = recorder.round_trip('getMapId', self, evaluate)
+        result['tile_fetcher'] = TileFetcher(f"https://earthengine.invalid/map/{abs(hash(self.serialize()))}/{{z}}/{{x}}/{{y}}")
+        return result
+
+    def getThumbURL(self, params=None):
+        return recorder.round_trip('getThumbURL', self, lambda: 'https://earthengine.invalid/thumb.png')
+
+
+class TileFetcher:
+    def __init__(self, url_format):
+        self.url_format = url_format
+
+
+def _reduce_region(node, reducer, area):
+    pixels = area / 100.0
+    kinds = _kinds(reducer)
+    if 'group' in kinds:
+        # Grouped sums: spread the area over the groups; transition codes when a band is encoded
+        groups = [{'class': c, 'sum': area * c / 28.0} for c in range(1, 8)]
+        if 'multiply' in _kinds(node) and 'add' in _kinds(node):
+            groups = [{'code': i * 10 + j, 'sum': area / 49.0} for i in range(1, 8) for j in range(1, 8)]
+        result = {'groups': groups}
+        for prefix in _output_prefixes(reducer):
+            result[f'{prefix}groups'] = groups
+        return result
+    if 'fixedHistogram' in kinds:
+        share = [0.4, 0.3, 0.2, 0.1]
+        return {
+            'mean': 1.8, 'stdDev': 0.9,
+            'p10': 0.3, 'p25': 0.9, 'p50': 1.6, 'p75': 2.6, 'p90': 3.5,
+            'histogram': [[i, pixels * s] for i, s in enumerate(share)]
+        }
+    if 'toList' in kinds:
+        return {'LAI': [0.5 + (i % 7) for i in range(int(min(pixels, 1e6)))]}
+    if 'sum' in kinds:
+        return {'area': area / 2}
+    return {'mean': 1.8, 'stdDev': 0.9}
+
+
+def _output_prefixes(reducer):
+    prefixes = []
+    if isinstance(reducer, ComputedObject):
+        for op, args, kwargs in reducer._chain:
+            if op == 'combine' and 'outputPrefix' in kwargs:
+                prefixes.append(kwargs['outputPrefix'])
+            for arg in list(args) + list(kwargs.values()):
+                prefixes += _output_prefixes(arg)
+    return prefixes
+
+
+def _evaluate(value):
+    if isinstance(value, dict):
+        return {k: _evaluate(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_evaluate(v) for v in value]
+    if not isinstance(value, ComputedObject):
+        return value
+
+    ops = value._ops()
+    if value._kind == 'Dictionary' and not ops and value._chain == ():
+        return {}
+    if value._kind == 'Dictionary' and ops and ops[0] == 'new':
+        return _evaluate(value._chain[0][1][0])
+    if value._kind == 'List' and ops == ['new', 'get']:
+        return _evaluate(value._chain[0][1][0][value._chain[1][1][0]])
+    if value._kind == 'If' and ops == ['new']:
+        # Server-side conditionals take their true branch
+        return _evaluate(value._chain[0][1][1])
+    if value._kind == 'Feature' and ops and ops[0] == 'new' and set(ops[1:]) <= {'set'}:
+        args = value._chain[0][1]
+        properties = dict(_evaluate(args[1]) if len(args) > 1 else {})
+        for _, set_args, _ in value._chain[1:]:
+            properties.update(_evaluate(set_args[0]))
+        return {'type': 'Feature', 'geometry': None, 'properties': properties}
+    if value._kind == 'FeatureCollection' and ops == ['new'] and isinstance(value._chain[0][1][0], ComputedObject):
+        return {'type': 'FeatureCollection', 'features': _evaluate(value._chain[0][1][0])}
+    if value._kind in ('List', 'FeatureCollection') and ops and ops[0] == 'new' and len(ops) == 1:
+        return _evaluate(value._chain[0][1][0])
+
+    for index in range(len(ops) - 1, -1, -1):
+        op, args, kwargs = value._chain[index]
+        if op == 'reduceRegion':
+            reducer = kwargs.get('reducer', args[0] if args else None)
+            result = _reduce_region(value, reducer, recorder.aoi_area)
+            rest = ops[index + 1:]
+            if rest[:1] == ['get']:
+                key = value._chain[index + 1][1][0]
+                return result.get(key)
+            return result
+        if op == 'reduceRegions':
+            collection = kwargs.get('collection', args[0] if args else None)
+            count = _feature_count(collection)
+            reducer = kwargs.get('reducer', args[1] if len(args) > 1 else None)
+            properties = _reduce_region(value, reducer, recorder.aoi_area)
+            return {
+                'type': 'FeatureCollection',
+                'features': [
+                    {'type': 'Feature', 'properties': dict(properties, feature_index=i)}
+                    for i in range(count)
+                ]
+            }
+    last = ops[-1] if ops else None
+    if last == 'bandNames':
+        return ['LAI']
+    if last == 'area':
+        return recorder.aoi_area
+    if last == 'centroid':
+        return {'type': 'Point', 'coordinates': [10.0, 36.0]}
+    if last == 'size':
+        return 1
+    return {}
+
+
+def _feature_count(collection):
+    if isinstance(collection, ComputedObject) and collection._chain:
+        op, args, _ = collection._chain[0]
+        if op == 'new' and args and isinstance(args[0], (list, tuple)):
+            return len(args[0])
+        if op == 'new' and args and isinstance(args[0], dict):
+            return len(args[0].get('features', []))
+    return 1
+
+
+class _Factory:
+    """ee.Image, ee.Reducer, ... : calling builds a node, attribute access nests (ee.Reducer.sum)."""
+
+    def __init__(self, kind):
+        self._kind = kind
+
+    def __call__(self, *args, **kwargs):
+        if len(args) == 1 and not kwargs and isinstance(args[0], ComputedObject):
+            # Casts return the object itself, except a list of features becoming a collection
+            if not (self._kind == 'FeatureCollection' and args[0]._kind == 'List'):
+                return args[0]
+        return ComputedObject(self._kind, (('new', args, kwargs),))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return _Factory(name)
+
+
+Image = _Factory('Image')
+ImageCollection = _Factory('ImageCollection')
+Reducer = _Factory('Reducer')
+Geometry = _Factory('Geometry')
+Filter = _Factory('Filter')
+Algorithms = _Factory('Algorithms')
+Dictionary = _Factory('Dictionary')
+Feature = _Factory('Feature')
+FeatureCollection = _Factory('FeatureCollection')
+List = _Factory('List')
+Number = _Factory('Number')
+String = _Factory('String')
+Date = _Factory('Date')
+DateRange = _Factory('DateRange')
+Array = _Factory('Array')
+Kernel = _Factory('Kernel')
+Join = _Factory('Join')
+
+
+class oauth:
+    SCOPES = []
+
+
+class data:
+    @staticmethod
+    def computeValue(obj):
+        return obj.getInfo()
+
+
+def Initialize(*args, **kwargs):
+    recorder.count('Initialize')
@@ -0,0 +1,292 @@
+"""
+Earth Engine cost benchmarks for the app pipeline, run offline against benchmarks/fake_ee.py.
+
+Each stage records how many round trips (getInfo / getMapId), reduceRegion calls, bytes
+and seconds it costs, with a simulated per-round-trip latency:
+
+    python benchmarks/run_benchmarks.py --latency 0.2 --features 200 --output bench.json
+
+Stages:
+    cold_start             a new process importing Streamlit and running app.py once, as a
+                           new container does before its first paint
+    app_first_run          main() in a fresh session (initializes Earth Engine, once per process)
+    app_rerun              main() rerun without a submit (should cost no round trips, and no
+                           Earth Engine initialization)
+    upload_files_proc      parsing and simplifying an uploaded GeoJSON with --features polygons
+                           of --vertices points (no round trips)
+    two_date_analysis      Analysis.run() for two dates, results not cached
+    map_layers             resolving the map tiles main() adds after a submit
+    report_thumbnails      the report's PNG renders for both dates (downloads stubbed)
+    report_thumbnails_cached  the same renders, served by the on-disk cache
+    lai_section            the LAI statistics shown under the map
+    feature_statistics     the per-field table for every uploaded feature
+    time_series            NDVI time series over --series-weeks weekly windows
+    two_date_analysis_cached  the same analysis again, served by the result cache
+    updated_date_changed   the analysis with the updated date a week later (only that date
+                           and the new pair's class transitions are evaluated, the initial
+                           date comes from the cache)
+    concurrent_sessions    --sessions identical analyses submitted at once (coalesced)
+    tiled_analysis         a district-sized AOI in tiled mode (class areas and transitions per
+                           tile, in parallel)
+
+The startup stages have a wall time budget (STARTUP_BUDGETS); with --check-budgets the
+run fails when one is exceeded.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks import fake_ee  # noqa: E402
+
+sys.modules['ee'] = fake_ee
+
+from ee_trace import in_context, stage, start_trace  # noqa: E402
+from scheduler import request_scheduler  # noqa: E402
+
+# Seconds, on a warm disk cache; cold_start includes starting the interpreter
+STARTUP_BUDGETS = {'cold_start': 4.0, 'app_first_run': 1.5, 'app_rerun': 0.5}
+
+COLD_START = """
+import sys
+sys.path.insert(0, {root!r})
+from benchmarks import fake_ee
+sys.modules['ee'] = fake_ee
+from streamlit.testing.v1 import AppTest
+app_test = AppTest.from_file({app!r}, default_timeout=120)
+app_test.run()
+if app_test.exception:
+    sys.exit(app_test.exception[0].message)
+"""
+
+
+@contextmanager
+def measured(name):
+    """A benchmark stage, counted by the fake and recorded as a stage of the EE trace."""
+    with fake_ee.recorder.stage(name), stage(name):
+        yield
+
+
+def square(lon, lat, size=0.01):
+    return [[
+        [lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]
+    ]]
+
+
+def field(lon, lat, vertices, size=0.01):
+    """A square field, or a survey-style circle of `vertices` points when that is more than 5."""
+    if vertices <= 5:
+        return square(lon, lat, size)
+    angles = np.linspace(0, 2 * np.pi, vertices - 1, endpoint=False)
+    ring = np.c_[lon + size / 2 * (1 + np.cos(angles)), lat + size / 2 * (1 + np.sin(angles))]
+    return [np.vstack([ring, ring[:1]]).tolist()]
+
+
+def feature_collection(count, vertices=5):
+    return {
+        'type': 'FeatureCollection',
+        'features': [
+            {
+                'type': 'Feature',
+                'properties': {'id': i},
+                'geometry': {'type': 'Polygon', 'coordinates': field(10.0 + 0.02 * (i % 50), 36.0 + 0.02 * (i // 50), vertices)}
+            }
+            for i in range(count)
+        ]
+    }
+
+
+class UploadedFile(io.BytesIO):
+    """Just enough of Streamlit's UploadedFile for the upload helpers."""
+
+    def __init__(self, data, name='aoi.geojson'):
+        super().__init__(data)
+        self.name = name
+
+
+def bench_cold_start():
+    script = COLD_START.format(root=REPO_ROOT, app=os.path.join(REPO_ROOT, 'app.py'))
+    with measured('cold_start'):
+        # Secrets are looked up relative to the working directory
+        child = subprocess.run([sys.executable, '-c', script], cwd=REPO_ROOT, capture_output=True, text=True)
+    if child.returncode:
+        print(f"cold_start failed: {child.stderr.strip()[-500:]}", file=sys.stderr)
+
+
+def bench_app_rerun():
+    from streamlit.testing.v1 import AppTest
+
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)
+    try:
+        app_test = AppTest.from_file(os.path.join(REPO_ROOT, 'app.py'), default_timeout=120)
+        with measured('app_first_run'):
+            app_test.run()
+        with measured('app_rerun'):
+            app_test.run()
+    finally:
+        os.chdir(cwd)
+    if app_test.exception:
+        print(f"app_rerun raised: {app_test.exception[0].message}", file=sys.stderr)
+
+
+def startup_budgets(stages):
+    """Measured wall time of each budgeted startup stage against its budget."""
+    return {
+        name: {'budget_s': budget, 'wall_time_s': stages[name]['wall_time_s'],
+               'ok': stages[name]['wall_time_s'] <= budget}
+        for name, budget in STARTUP_BUDGETS.items() if name in stages
+    }
+
+
+def bench_upload(features, vertices):
+    import app
+
+    upload = UploadedFile(json.dumps(feature_collection(features, vertices)).encode('utf-8'))
+    with measured('upload_files_proc'):
+        geometry_aoi, aoi = app.upload_files_proc([upload])
+    return geometry_aoi, aoi['features']
+
+
+def bench_analysis(geometry_aoi, features, initial_date, updated_date, cloud_rate, series_weeks, sessions, cache_dir):
+    from analysis import Analysis, calculate_lai_statistics, ndvi_time_series, time_series_windows
+    from result_cache import ResultCache
+    from map_layers import fetch_thumbnails
+    import app
+
+    folium = app.load_folium()
+
+    with measured('two_date_analysis'):
+        analysis = Analysis(geometry_aoi, initial_date, updated_date, cloud_rate)
+        analysis.run()
+
+    with measured('map_layers'):
+        layers = [
+            (images[key], {'min': 0, 'max': 1}, f"{side} {key}")
+            for side, images in (('Initial', analysis.initial), ('Updated', analysis.updated))
+            for key in ('tci', 'ndvi', 'ndvi_classified', 'vegetation', 'non_vegetation')
+        ]
+        m = folium.Map(location=[36.45, 10.85], tiles=None, zoom_start=4)
+        m.add_ee_layers(layers)
+
+    thumbnail_cache = ResultCache(path=os.path.join(cache_dir, 'thumbnails.sqlite'))
+    report_layers = [
+        (images[key], {'min': 0, 'max': 1}, f"{side} {key}")
+        for side, images in (('Initial', analysis.initial), ('Updated', analysis.updated))
+        for key in ('tci', 'ndvi_classified', 'vegetation')
+    ]
+    with measured('report_thumbnails'):
+        fetch_thumbnails(report_layers, geometry_aoi, cache=thumbnail_cache, fetch=lambda url: b'\x89PNG' + bytes(20000))
+    with measured('report_thumbnails_cached'):
+        fetch_thumbnails(report_layers, geometry_aoi, cache=thumbnail_cache, fetch=lambda url: b'\x89PNG' + bytes(20000))
+
+    with measured('lai_section'):
+        calculate_lai_statistics(
+            {'initial': analysis.initial['lai'], 'updated': analysis.updated['lai']},
+            geometry_aoi, analysis.scale
+        )
+
+    with measured('feature_statistics'):
+        analysis.run_features(features)
+
+    with measured('time_series'):
+        windows = time_series_windows(initial_date, updated_date)[:series_weeks]
+        for _ in ndvi_time_series(geometry_aoi, windows, cloud_rate):
+            pass
+
+    cache = ResultCache(path=os.path.join(cache_dir, 'results.sqlite'))
+    Analysis(geometry_aoi, initial_date, updated_date, cloud_rate, cache=cache).run()
+    with measured('two_date_analysis_cached'):
+        Analysis(geometry_aoi, initial_date, updated_date, cloud_rate, cache=cache).run()
+    # The weekly sweep: same baseline, updated date one week later
+    with measured('updated_date_changed'):
+        Analysis(geometry_aoi, initial_date, updated_date + timedelta(days=7), cloud_rate, cache=cache).run()
+
+    # A date no earlier stage used, so nothing is cached yet
+    shared_cache = ResultCache(path=os.path.join(cache_dir, 'shared.sqlite'))
+    other_date = date.fromordinal(updated_date.toordinal() + 30)
+    with measured('concurrent_sessions'):
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            runs = [
+                executor.submit(in_context(Analysis(geometry_aoi, initial_date, other_date, cloud_rate, cache=shared_cache).run))
+                for _ in range(sessions)
+            ]
+            for run in runs:
+                run.result()
+
+    # About 150 km a side: the planner would coarsen it to 20 m, tiling keeps 10 m
+    district = {'type': 'Polygon', 'coordinates': square(10.0, 36.0, 1.5)}
+    with measured('tiled_analysis'):
+        Analysis(district, initial_date, updated_date, cloud_rate, tiled=True).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.1, help='simulated seconds per round trip')
+    parser.add_argument('--features', type=int, default=100, help='polygons in the uploaded GeoJSON')
+    parser.add_argument('--vertices', type=int, default=5, help='vertices per uploaded polygon')
+    parser.add_argument('--aoi-area', type=float, default=1e8, help='AOI area (m²) the fake reports')
+    parser.add_argument('--initial-date', default='2023-06-01')
+    parser.add_argument('--updated-date', default='2024-06-01')
+    parser.add_argument('--cloud-rate', type=int, default=10)
+    parser.add_argument('--series-weeks', type=int, default=26, help='windows in the time series stage')
+    parser.add_argument('--sessions', type=int, default=4, help='concurrent identical analyses')
+    parser.add_argument('--skip-app', action='store_true', help='skip the Streamlit startup and rerun stages')
+    parser.add_argument('--check-budgets', action='store_true', help='exit with status 1 when a startup stage is over budget')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--trace', help='also write the EE call trace (JSON spans) here')
+    args = parser.parse_args(argv)
+
+    fake_ee.recorder.latency = args.latency
+    fake_ee.recorder.aoi_area = args.aoi_area
+    initial_date = date.fromisoformat(args.initial_date)
+    updated_date = date.fromisoformat(args.updated_date)
+
+    trace = start_trace('benchmarks')
+    start = time.perf_counter()
+    if not args.skip_app:
+        bench_cold_start()
+        bench_app_rerun()
+    geometry_aoi, features = bench_upload(args.features, args.vertices)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        bench_analysis(geometry_aoi, features, initial_date, updated_date, args.cloud_rate, args.series_weeks, args.sessions,
+                       cache_dir)
+
+    stages = fake_ee.recorder.report()
+    stages.pop('unstaged', None)
+    report = {
+        'config': vars(args),
+        'total_wall_time_s': round(time.perf_counter() - start, 6),
+        'total_round_trips': sum(stage['round_trips'] for stage in stages.values()),
+        'stages': stages,
+        'startup_budgets': startup_budgets(stages),
+        'scheduler': request_scheduler.stats()
+    }
+    output = json.dumps(report, indent=2)
+    if args.trace:
+        with open(args.trace, 'w') as f:
+            f.write(trace.to_json() + '\n')
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    report = main()
+    if report['config']['check_budgets'] and not all(budget['ok'] for budget in report['startup_budgets'].values()):
+        sys.exit(1)
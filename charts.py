@@ -0,0 +1,148 @@
+"""
+Vega-Lite specs for the result charts under the map.
+
+chart_payload() builds every series once as plain JSON records, and each spec embeds the
+records it draws, so a series shared by two charts is sent with both. They are a few dozen
+rows; one concatenated spec over named datasets would send them once, but Vega-Lite only
+sizes single views to the container width. Streamlit renders Vega-Lite with the copy bundled in its own frontend,
+so the charts need no iframe or CDN script (they work offline), and a rerun that sends
+an identical spec leaves the rendered chart untouched.
+"""
+from analysis import LAI_BIN_LABELS, NDVI_CLASSES
+
+NDVI_CLASS_LABELS = [
+    "Absent Vegetation",
+    "Bare Soil",
+    "Low Vegetation",
+    "Light Vegetation",
+    "Moderate Vegetation",
+    "Strong Vegetation",
+    "Dense Vegetation"
+]
+VEGETATION_COLOR = "#006837"
+NON_VEGETATION_COLOR = "#8B4513"
+LAI_COLORS = ["#78c679", "#238443"]
+PERIOD_AXIS = {'field': 'period', 'type': 'nominal', 'sort': ['Initial', 'Updated'], 'title': None}
+
+
+def chart_payload(areas, initial_class_areas, updated_class_areas, palette, lai_results=None):
+    """
+    All chart series as one JSON-serializable dict. `areas` holds initial/updated veg and
+    non-veg areas (initial_veg_area, ...); `palette` has one color per NDVI class.
+    """
+    periods = [('Initial', 'initial', initial_class_areas), ('Updated', 'updated', updated_class_areas)]
+    payload = {
+        'vegetation': [
+            {'period': period, 'cover': cover, 'area': areas[f'{name}_{key}_area'],
+             'color': VEGETATION_COLOR if key == 'veg' else NON_VEGETATION_COLOR}
+            for period, name, _ in periods
+            for cover, key in (('Vegetation', 'veg'), ('Non-Vegetation', 'nonveg'))
+        ],
+        'ndvi_classes': [
+            {'period': period, 'class': c, 'label': NDVI_CLASS_LABELS[c - 1], 'area': class_areas.get(c, 0),
+             'color': palette[c - 1]}
+            for period, _, class_areas in periods
+            for c in NDVI_CLASSES
+        ],
+        'lai': [],
+        'lai_title': None
+    }
+    if lai_results:
+        payload['lai'] = [
+            {'period': period, 'bin': label, 'pixels': count}
+            for period, name, _ in periods
+            for label, count in zip(LAI_BIN_LABELS, lai_results[f'{name}_dist'])
+        ]
+        initial_stats, updated_stats = lai_results['initial_stats'], lai_results['updated_stats']
+        payload['lai_title'] = (
+            f"Initial Mean: {initial_stats.get('mean', 0):.2f} ± {initial_stats.get('stdDev', 0):.2f} | "
+            f"Updated Mean: {updated_stats.get('mean', 0):.2f} ± {updated_stats.get('stdDev', 0):.2f}"
+        )
+    return payload
+
+
+def vegetation_specs(payload):
+    """Vegetation vs non-vegetation per date, then the same areas stacked."""
+    values = payload['vegetation']
+    color = {'field': 'color', 'type': 'nominal', 'scale': None}
+    return [
+        {
+            'data': {'values': values},
+            'mark': {'type': 'bar', 'tooltip': True},
+            'encoding': {
+                'x': {'field': 'label', 'type': 'nominal', 'sort': None, 'title': None},
+                'y': {'field': 'area', 'type': 'quantitative', 'title': 'Area (m²)'},
+                'color': color
+            },
+            'transform': [{'calculate': "datum.period + ' ' + datum.cover", 'as': 'label'}],
+            'height': 300
+        },
+        {
+            'data': {'values': values},
+            'mark': {'type': 'bar', 'tooltip': True},
+            'encoding': {
+                'x': PERIOD_AXIS,
+                'y': {'field': 'area', 'type': 'quantitative', 'stack': True, 'title': 'Area (m²)'},
+                'color': {'field': 'cover', 'type': 'nominal', 'title': None,
+                          'scale': {'domain': ['Vegetation', 'Non-Vegetation'],
+                                    'range': [VEGETATION_COLOR, NON_VEGETATION_COLOR]}}
+            },
+            'height': 300
+        }
+    ]
+
+
+def ndvi_class_specs(payload):
+    """Areas per NDVI class side by side for both dates, then stacked per date."""
+    values = payload['ndvi_classes']
+    labels = NDVI_CLASS_LABELS
+    colors = [row['color'] for row in values[:len(labels)]]
+    return [
+        {
+            'data': {'values': values},
+            'title': 'NDVI Class Distribution',
+            'mark': {'type': 'bar', 'tooltip': True},
+            'encoding': {
+                'x': {'field': 'label', 'type': 'nominal', 'sort': labels, 'title': None},
+                'xOffset': {'field': 'period', 'sort': ['Initial', 'Updated']},
+                'y': {'field': 'area', 'type': 'quantitative', 'title': 'Area (m²)'},
+                'color': {'field': 'color', 'type': 'nominal', 'scale': None},
+                # Updated bars are drawn lighter, like the original Chart.js version
+                'opacity': {'field': 'period', 'type': 'nominal', 'scale': {'domain': ['Initial', 'Updated'], 'range': [1, 0.5]},
+                            'title': None}
+            },
+            'height': 400
+        },
+        {
+            'data': {'values': values},
+            'title': 'NDVI Classification Comparison',
+            'mark': {'type': 'bar', 'tooltip': True},
+            'encoding': {
+                'x': PERIOD_AXIS,
+                'y': {'field': 'area', 'type': 'quantitative', 'stack': True, 'title': 'Area (m²)'},
+                'color': {'field': 'label', 'type': 'nominal', 'title': None, 'sort': labels,
+                          'scale': {'domain': labels, 'range': colors}},
+                'order': {'field': 'class', 'type': 'quantitative'}
+            },
+            'height': 400
+        }
+    ]
+
+
+def lai_spec(payload):
+    """LAI histogram of both dates, or None without LAI statistics."""
+    if not payload['lai']:
+        return None
+    return {
+        'data': {'values': payload['lai']},
+        'title': {'text': 'LAI Distribution Comparison', 'subtitle': payload['lai_title']},
+        'mark': {'type': 'bar', 'tooltip': True},
+        'encoding': {
+            'x': {'field': 'bin', 'type': 'ordinal', 'sort': LAI_BIN_LABELS, 'title': 'LAI Range'},
+            'xOffset': {'field': 'period', 'sort': ['Initial', 'Updated']},
+            'y': {'field': 'pixels', 'type': 'quantitative', 'title': 'Pixel Count'},
+            'color': {'field': 'period', 'type': 'nominal', 'title': None,
+                      'scale': {'domain': ['Initial', 'Updated'], 'range': LAI_COLORS}}
+        },
+        'height': 400
+    }
@@ -0,0 +1,146 @@
+"""
+Timing of Earth Engine round trips.
+
+Evaluations go through trace_call() with a call-site label:
+
+    result = trace_call(f"class areas {names}", reduction.getInfo)
+
+Calls run through scheduler.request_scheduler (concurrency cap, priorities, retries).
+While a Trace is active (start_trace() in the current context) every call becomes a
+span with its label, stage, start offset, latency, response size, attempts and time
+queued. Stages group the calls of one part of a run, and are recorded as spans of
+their own, and note() records events between calls (a tile split after a failure, ...)
+as zero-length spans. reduceRegion and friends are lazy, so they show up as the getInfo that
+evaluates them. Worker threads don't inherit the trace unless submitted through
+in_context().
+
+Without an active trace, trace_call() is only scheduled.
+"""
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from scheduler import request_scheduler
+
+_trace = contextvars.ContextVar('ee_trace', default=None)
+_stage = contextvars.ContextVar('ee_trace_stage', default=None)
+
+
+class Trace:
+    """Spans of one run (one Streamlit rerun, one benchmark, ...)."""
+
+    def __init__(self, name='run'):
+        self.name = name
+        self.started_at = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []
+
+    def offset(self):
+        return time.perf_counter() - self._start
+
+    def record(self, **span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start_s'])
+        return {'trace': self.name, 'started_at': self.started_at.isoformat(), 'spans': spans}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2, default=str)
+
+    def summary(self):
+        """Calls, summed latency and response bytes per stage."""
+        stages = {}
+        for span in self.to_dict()['spans']:
+            if span['kind'] in ('stage', 'event'):
+                continue
+            stage = stages.setdefault(span['stage'] or '(none)', {'calls': 0, 'latency_s': 0.0, 'response_bytes': 0})
+            stage['calls'] += 1
+            stage['latency_s'] += span['duration_s']
+            stage['response_bytes'] += span['response_bytes']
+        return stages
+
+
+def start_trace(name='run'):
+    """Make a new trace the active one for this context (the rest of the rerun) and return it."""
+    trace = Trace(name)
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+@contextmanager
+def stage(name):
+    token = _stage.set(name)
+    trace = _trace.get()
+    start = trace.offset() if trace is not None else None
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+        if trace is not None:
+            end = trace.offset()
+            trace.record(label=name, kind='stage', stage=name, thread=threading.current_thread().name,
+                         start_s=start, duration_s=end - start, response_bytes=0, error=None,
+                         attempts=None, queued_s=None, priority=None)
+
+
+def note(label, error=None):
+    """Record an event (no Earth Engine call) at this point of the active trace, if any."""
+    trace = _trace.get()
+    if trace is not None:
+        trace.record(label=label, kind='event', stage=_stage.get(), thread=threading.current_thread().name,
+                     start_s=trace.offset(), duration_s=0.0, response_bytes=0, error=error,
+                     attempts=None, queued_s=None, priority=None)
+
+
+def in_context(function):
+    """Wrap `function` to run in a copy of the caller's context, e.g. for executor.submit."""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return run
+
+
+def response_size(result):
+    return len(json.dumps(result, default=str))
+
+
+def trace_call(label, evaluate, *args, **kwargs):
+    """Schedule `evaluate` (a bound getInfo / getMapId), recording a span when a trace is active."""
+    trace = _trace.get()
+    if trace is None:
+        return request_scheduler.run(evaluate, args, kwargs)
+    start = trace.offset()
+    result, error, info = None, None, {}
+    try:
+        result = request_scheduler.run(evaluate, args, kwargs, info)
+        return result
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        end = trace.offset()
+        trace.record(
+            label=label,
+            kind=getattr(evaluate, '__name__', 'call'),
+            stage=_stage.get(),
+            thread=threading.current_thread().name,
+            start_s=start,
+            duration_s=end - start,
+            response_bytes=response_size(result) if error is None else 0,
+            error=error,
+            attempts=info.get('attempts'),
+            queued_s=info.get('queued_s'),
+            priority=info.get('priority')
+        )
@@ -0,0 +1,706 @@
+"""
+Out-of-core engine for local Sentinel-2 GeoTIFFs too large to hold in memory.
+
+Scenes are listed in a JSON manifest, paths relative to it, all on one pixel grid:
+
+    [{"date": "2024-06-01", "cloud": 12.5,
+      "bands": {"B2": "T32SNE_B02.tif", "B3": "T32SNE_B03.tif", "B4": ..., "B8": ...}},
+     {"date": "2024-06-11", "cloud": 3.0, "path": "T32SNE_20240611.tif",
+      "bands": ["B2", "B3", "B4", "B8"]}]
+
+(a "bands" list names the samples of one multi-band file). Band files are uncompressed,
+stripped or tiled, TIFF or BigTIFF, with raw reflectance scaled by 10000 (0 is nodata).
+They are memory-mapped, never read whole: reductions walk the grid in BLOCK_SIZE windows,
+so only the pages of the windows being processed are resident, whatever the scene size.
+
+GeoTiffBackend has the interface of analysis.EarthEngineBackend and, like Earth Engine,
+lazy images: composite(), getNDVI(), classify_ndvi() ... only record the scenes an image
+is made of. A reduction is one pass over the windows that meet the AOI on a process pool:
+workers map the files themselves (the OS page cache is shared between them), read the
+pass description (scene paths, AOI and feature geometries) from shared memory once per
+pass, compute NDVI classes, LAI and pixel areas per window with the local_backend
+functions and return partial sums (class areas, LAI moments and histograms, transitions),
+merged at the end. Per-feature sums go to a shared accumulator with a slot per task, so
+neither the tasks nor their results grow with the number of features. An Analysis announces its images with reduce_together(), so its AOI
+area, class areas, LAI statistics and transitions, for one date or both, all come from a
+single pass over the rasters.
+"""
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import pickle
+import struct
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from analysis import BANDS, FEATURE_ID, LAI_BIN_EDGES, LAI_PERCENTILES, NDVI_CLASSES
+from local_backend import (
+    class_areas,
+    class_transitions,
+    classify_ndvi,
+    getLAI,
+    getNDVI,
+    median_composite,
+    pixel_areas,
+    rasterize_geometry,
+    satImageMask,
+)
+from result_cache import fingerprint, single_flight
+
+BLOCK_SIZE = 1024
+MAX_WORKERS = int(os.environ.get('VEGALYTICS_RASTER_WORKERS', os.cpu_count() or 1))
+# Windows per task: enough tasks to balance the workers, few enough to keep overhead low
+TASKS_PER_WORKER = 4
+# LAI percentiles come from a histogram of this resolution over LAI_FINE_RANGE
+LAI_FINE_STEP = 0.01
+LAI_FINE_RANGE = (-1.0, 10.0)
+MEMO_ENTRIES = 8
+# Image groups announced by reduce_together() remembered per AOI
+GROUP_ENTRIES = 4
+
+# TIFF field types: struct format and values per count
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 1), 4: ('I', 1), 5: ('I', 2), 6: ('b', 1), 7: ('B', 1),
+    8: ('h', 1), 9: ('i', 1), 10: ('i', 2), 11: ('f', 1), 12: ('d', 1), 16: ('Q', 1), 17: ('q', 1), 18: ('Q', 1)
+}
+SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def _read_tags(f, byteorder, bigtiff, offset):
+    """Tags of the IFD at `offset` as {tag: tuple of values} (str for ASCII)."""
+    f.seek(offset)
+    count_format, entry_format, field_size = ('Q', 'HHQ', 8) if bigtiff else ('H', 'HHI', 4)
+    count, = struct.unpack(byteorder + count_format, f.read(struct.calcsize(byteorder + count_format)))
+    entry_size = struct.calcsize(byteorder + entry_format) + field_size
+    entries = f.read(count * entry_size)
+    tags = {}
+    for i in range(count):
+        entry = entries[i * entry_size:(i + 1) * entry_size]
+        tag, field_type, n = struct.unpack(byteorder + entry_format, entry[:-field_size])
+        if field_type not in TIFF_TYPES:
+            continue
+        value_format, per_count = TIFF_TYPES[field_type]
+        size = struct.calcsize(byteorder + value_format) * n * per_count
+        if size <= field_size:
+            data = entry[-field_size:][:size]
+        else:
+            position = f.tell()
+            f.seek(struct.unpack(byteorder + ('Q' if bigtiff else 'I'), entry[-field_size:])[0])
+            data = f.read(size)
+            f.seek(position)
+        if field_type == 2:
+            tags[tag] = data.split(b'\0', 1)[0].decode('latin-1')
+        else:
+            tags[tag] = struct.unpack(f"{byteorder}{n * per_count}{value_format}", data)
+    return tags
+
+
+class GeoTiff:
+    """
+    A memory-mapped, uncompressed (Big)GeoTIFF: `shape`, `samples`, `geotransform`,
+    `geographic`, `epsg`, and read() for windows of one sample.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(16)
+            byteorder = {b'II': '<', b'MM': '>'}.get(header[:2])
+            if byteorder is None:
+                raise ValueError(f"{path} is not a TIFF file")
+            version, = struct.unpack(byteorder + 'H', header[2:4])
+            bigtiff = version == 43
+            if version not in (42, 43):
+                raise ValueError(f"{path} is not a TIFF file")
+            offset = struct.unpack(byteorder + ('Q' if bigtiff else 'I'), header[8:16] if bigtiff else header[4:8])[0]
+            tags = _read_tags(f, byteorder, bigtiff, offset)
+
+        if tags.get(259, (1,))[0] != 1:
+            raise ValueError(f"{path} is compressed; memory mapping needs an uncompressed GeoTIFF "
+                             f"(e.g. gdal_translate -co COMPRESS=NONE -co TILED=YES)")
+        self.shape = (tags[257][0], tags[256][0])
+        self.samples = tags.get(277, (1,))[0]
+        bits = tags.get(258, (16,))[0]
+        kind = SAMPLE_FORMATS.get(tags.get(339, (1,))[0], 'u')
+        self.dtype = np.dtype(f"{byteorder}{kind}{bits // 8}")
+        self.planar = tags.get(284, (1,))[0] == 2
+        if 322 in tags:
+            self.chunk_shape = (tags[323][0], tags[322][0])
+            offsets, counts = tags[324], tags[325]
+        else:
+            self.chunk_shape = (min(tags.get(278, (self.shape[0],))[0], self.shape[0]), self.shape[1])
+            offsets, counts = tags[273], tags[279]
+        self._offsets = np.asarray(offsets, dtype=np.int64)
+        self._counts = np.asarray(counts, dtype=np.int64)
+        self._raw = np.memmap(path, dtype=np.uint8, mode='r')
+        self._planes = self._contiguous_planes()
+        self.geotransform, self.geographic, self.epsg = self._georeference(tags)
+
+    def _georeference(self, tags):
+        if 34264 in tags:
+            matrix = tags[34264]
+            geotransform = (matrix[3], matrix[0], matrix[1], matrix[7], matrix[4], matrix[5])
+        elif 33550 in tags and 33922 in tags:
+            sx, sy = tags[33550][:2]
+            i, j, _, x, y, _ = tags[33922][:6]
+            geotransform = (x - i * sx, sx, 0.0, y + j * sy, 0.0, -sy)
+        else:
+            raise ValueError(f"{self.path} has no georeferencing (ModelPixelScale/ModelTiepoint tags)")
+        keys = tags.get(34735, ())
+        geokeys = {keys[i]: keys[i + 3] for i in range(4, len(keys) - 3, 4) if keys[i + 1] == 0}
+        geographic = geokeys.get(1024) == 2
+        epsg = geokeys.get(2048 if geographic else 3072)
+        return tuple(float(value) for value in geotransform), geographic, epsg if epsg not in (None, 32767) else None
+
+    @property
+    def _chunk_grid(self):
+        return math.ceil(self.shape[0] / self.chunk_shape[0]), math.ceil(self.shape[1] / self.chunk_shape[1])
+
+    def _contiguous_planes(self):
+        """Whole-image views per sample when the strips follow each other, else None."""
+        if self.chunk_shape[1] != self.shape[1]:
+            return None
+        rows, cols = self.shape
+        planes = self.samples if self.planar else 1
+        per_plane = len(self._offsets) // planes
+        depth = 1 if self.planar else self.samples
+        views = []
+        for plane in range(planes):
+            offsets = self._offsets[plane * per_plane:(plane + 1) * per_plane]
+            counts = self._counts[plane * per_plane:(plane + 1) * per_plane]
+            size = rows * cols * depth * self.dtype.itemsize
+            if (offsets[1:] != offsets[:-1] + counts[:-1]).any() or counts.sum() < size:
+                return None
+            image = self._raw[offsets[0]:offsets[0] + size].view(self.dtype).reshape(rows, cols, depth)
+            views.extend(image[:, :, sample] for sample in range(depth))
+        return views
+
+    def _chunk(self, index):
+        ch, cw = self.chunk_shape
+        depth = 1 if self.planar else self.samples
+        offset = self._offsets[index]
+        size = min(self._counts[index], ch * cw * depth * self.dtype.itemsize)
+        return self._raw[offset:offset + size].view(self.dtype).reshape(-1, cw, depth)
+
+    def read(self, rows, cols, sample=0):
+        """Native-endian copy of sample `sample` over rows [r0, r1) and cols [c0, c1)."""
+        (r0, r1), (c0, c1) = rows, cols
+        if self._planes is not None:
+            return self._planes[sample][r0:r1, c0:c1].astype(self.dtype.newbyteorder('='))
+        out = np.zeros((r1 - r0, c1 - c0), dtype=self.dtype.newbyteorder('='))
+        ch, cw = self.chunk_shape
+        down, across = self._chunk_grid
+        first = sample * down * across if self.planar else 0
+        depth = 0 if self.planar else sample
+        for chunk_row in range(r0 // ch, (r1 - 1) // ch + 1):
+            for chunk_col in range(c0 // cw, (c1 - 1) // cw + 1):
+                chunk = self._chunk(first + chunk_row * across + chunk_col)
+                top, left = chunk_row * ch, chunk_col * cw
+                ys = slice(max(r0, top), min(r1, top + chunk.shape[0]))
+                xs = slice(max(c0, left), min(c1, left + cw, self.shape[1]))
+                out[ys.start - r0:ys.stop - r0, xs.start - c0:xs.stop - c0] = \
+                    chunk[ys.start - top:ys.stop - top, xs.start - left:xs.stop - left, depth]
+        return out
+
+
+@lru_cache(maxsize=64)
+def open_geotiff(path):
+    return GeoTiff(path)
+
+
+def within(path, root):
+    """True when `path` resolves (symlinks included) to `root` or a file below it."""
+    path, root = os.path.realpath(path), os.path.realpath(root)
+    return os.path.commonpath([path, root]) == root
+
+
+def load_manifest(path, root=None):
+    """
+    Scenes of a JSON manifest as [{'date', 'cloud', 'bands': {band: (path, sample)}}].
+    With `root`, band files that resolve outside that directory are refused.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    directory = os.path.dirname(os.path.abspath(path))
+    scenes = []
+    for entry in entries:
+        if isinstance(entry['bands'], list):
+            source = os.path.join(directory, entry['path'])
+            bands = {band: (source, sample) for sample, band in enumerate(entry['bands'])}
+        else:
+            bands = {band: (os.path.join(directory, source), 0) for band, source in entry['bands'].items()}
+        if root is not None:
+            outside = sorted({source for source, _ in bands.values() if not within(source, root)})
+            if outside:
+                raise ValueError(f"Scene {entry['date']} in {path} refers to files outside {root}: {', '.join(outside)}")
+        missing = [band for band in BANDS if band not in bands]
+        if missing:
+            raise ValueError(f"Scene {entry['date']} in {path} has no {', '.join(missing)} band")
+        scenes.append({'date': str(entry['date']), 'cloud': float(entry['cloud']), 'bands': bands})
+    return scenes
+
+
+# Window reductions (run in the workers)
+
+def lai_moments(lai, mask):
+    """Mergeable LAI sums: count, sum, sum of squares, LAI_BIN_EDGES counts and the fine histogram."""
+    values = lai[mask & np.isfinite(lai)].astype(np.float64)
+    low, high = LAI_FINE_RANGE
+    bins = int(round((high - low) / LAI_FINE_STEP))
+    fine = np.bincount(np.clip(((values - low) / LAI_FINE_STEP).astype(np.intp), 0, bins - 1), minlength=bins)
+    binned = values[values >= LAI_BIN_EDGES[0]]
+    return {
+        'count': values.size,
+        'sum': float(values.sum()),
+        'sum_sq': float((values * values).sum()),
+        'histogram': np.bincount(np.digitize(binned, LAI_BIN_EDGES) - 1, minlength=len(LAI_BIN_EDGES)),
+        'fine': fine
+    }
+
+
+def lai_summary(moments):
+    """analysis.calculate_lai_statistics output from merged lai_moments()."""
+    count = moments['count'] if moments else 0
+    if not count:
+        return {'mean': 0, 'stdDev': 0, 'percentiles': {p: None for p in LAI_PERCENTILES},
+                'histogram': [0] * len(LAI_BIN_EDGES)}
+    mean = moments['sum'] / count
+    cumulative = np.cumsum(moments['fine'])
+    low, _ = LAI_FINE_RANGE
+    # Percentiles to the fine bin: the centre of the bin holding the p-th value
+    percentiles = {
+        p: float(low + (np.searchsorted(cumulative, p / 100 * count) + 0.5) * LAI_FINE_STEP)
+        for p in LAI_PERCENTILES
+    }
+    return {
+        'mean': mean,
+        'stdDev': math.sqrt(max(moments['sum_sq'] / count - mean * mean, 0.0)),
+        'percentiles': percentiles,
+        'histogram': moments['histogram'].tolist()
+    }
+
+
+def merge_sums(total, part):
+    """Add the partial sums `part` into `total` (nested dicts of numbers and arrays)."""
+    for key, value in part.items():
+        if isinstance(value, dict):
+            merge_sums(total.setdefault(key, {}), value)
+        elif key in total:
+            total[key] = total[key] + value
+        else:
+            total[key] = value
+    return total
+
+
+def _window_composite(job, scene_ids, window):
+    r0, r1, c0, c1 = window
+    if not scene_ids:
+        return {band: np.full((r1 - r0, c1 - c0), np.nan, dtype=np.float32) for band in BANDS}
+    scenes = [
+        {'bands': {band: open_geotiff(path).read((r0, r1), (c0, c1), sample)
+                   for band, (path, sample) in job['sources'][scene_id].items()}}
+        for scene_id in scene_ids
+    ]
+    return median_composite(scenes)
+
+
+# Per feature and image: the NDVI class areas, then the area-weighted LAI sum and the area with LAI
+FEATURE_FIELDS = len(NDVI_CLASSES) + 2
+
+
+def reduce_window(job, window, feature_sums=None):
+    """
+    Partial sums of one (r0, r1, c0, c1) window of the pass described by `job`. Per-feature
+    sums are added into `feature_sums`, a (features, images, FEATURE_FIELDS) array.
+    """
+    r0, r1, c0, c1 = window
+    x0, dx, _, y0, _, dy = job['geotransform']
+    geotransform = (x0 + c0 * dx, dx, 0.0, y0 + r0 * dy, 0.0, dy)
+    shape = (r1 - r0, c1 - c0)
+    areas = pixel_areas(geotransform, shape, job['geographic'])
+    mask = rasterize_geometry(job['aoi'], geotransform, shape) if job['aoi'] else np.ones(shape, dtype=bool)
+    sums = {'aoi_area': float(np.broadcast_to(areas, shape)[mask].sum()) if job['aoi'] else 0.0}
+    # Only the features whose bounding box (in pixels) meets the window are rasterized
+    feature_masks = []
+    if job['features']:
+        first_row, last_row, first_col, last_col = job['feature_pixels'].T
+        near = np.flatnonzero((first_row < r1) & (last_row >= r0) & (first_col < c1) & (last_col >= c0))
+        feature_masks = [(slot, rasterize_geometry(job['features'][slot][1], geotransform, shape)) for slot in near]
+        feature_masks = [(slot, feature_mask) for slot, feature_mask in feature_masks if feature_mask.any()]
+    if not job['images'] or not (mask.any() if job['aoi'] else feature_masks):
+        return sums
+
+    classified, lai = {}, {}
+    for image in job['images']:
+        composite = _window_composite(job, image, window)
+        classified[image] = classify_ndvi(satImageMask(getNDVI(composite)))
+        lai[image] = getLAI(composite)
+        if job['aoi']:
+            sums[image] = {'class_areas': class_areas(classified[image], areas, mask),
+                           'lai': lai_moments(lai[image], mask)}
+    if job['aoi'] and len(job['images']) == 2:
+        initial, updated = job['images']
+        sums['transitions'] = class_transitions(classified[initial], classified[updated], areas, mask)
+    weights = np.broadcast_to(areas, shape)
+    for slot, feature_mask in feature_masks:
+        for position, image in enumerate(job['images']):
+            with_lai = feature_mask & np.isfinite(lai[image])
+            feature_sums[slot, position, :len(NDVI_CLASSES)] += list(class_areas(classified[image], areas, feature_mask).values())
+            feature_sums[slot, position, -2] += (lai[image] * weights)[with_lai].sum()
+            feature_sums[slot, position, -1] += weights[with_lai].sum()
+    return sums
+
+
+def feature_sums_shape(job, tasks=None):
+    """Shape of the per-feature accumulator of `job`, with a leading slot per task if `tasks`."""
+    shape = (len(job['features']), len(job['images']), FEATURE_FIELDS)
+    return shape if tasks is None else (tasks,) + shape
+
+
+def reduce_windows(job, windows, feature_sums=None):
+    """Merged sums of `windows`, in process; per-feature sums go to `feature_sums` (created if None)."""
+    if feature_sums is None:
+        feature_sums = np.zeros(feature_sums_shape(job))
+    total = {}
+    for window in windows:
+        merge_sums(total, reduce_window(job, window, feature_sums))
+    return total, feature_sums
+
+
+_worker_job = (None, None)
+
+
+def _load_job(name):
+    """The job pickled in shared memory block `name`, unpickled once per worker and pass."""
+    global _worker_job
+    if _worker_job[0] != name:
+        # Workers share the parent's resource tracker, so attaching doesn't take ownership:
+        # the parent unlinks the blocks when the pass is done
+        block = shared_memory.SharedMemory(name=name)
+        try:
+            job = pickle.loads(block.buf)
+        finally:
+            block.close()
+        _worker_job = (name, job)
+    return _worker_job[1]
+
+
+def reduce_task(job_name, sums_name, slot, windows):
+    """
+    Worker side of a pass: the job comes from shared memory, and per-feature sums are added
+    into slot `slot` of the shared accumulator, so neither grows the task or its result.
+    """
+    job = _load_job(job_name)
+    block = shared_memory.SharedMemory(name=sums_name)
+    try:
+        feature_sums = np.ndarray(feature_sums_shape(job, slot + 1), dtype=np.float64, buffer=block.buf)[slot]
+        total, _ = reduce_windows(job, windows, feature_sums)
+        del feature_sums
+    finally:
+        block.close()
+    return total
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def worker_pool(workers):
+    """Process pool of `workers` processes, kept for the life of the process."""
+    with _pools_lock:
+        if workers not in _pools:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            _pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+        return _pools[workers]
+
+
+class LazyImage:
+    """An image of the GeoTIFF engine: the ids of the scenes it is a composite of."""
+
+    def __init__(self, scene_ids):
+        self.scene_ids = tuple(scene_ids)
+
+
+def _geometry_bounds(geometry):
+    if geometry['type'] == 'Polygon':
+        rings = geometry['coordinates']
+    else:
+        rings = [ring for polygon in geometry['coordinates'] for ring in polygon]
+    points = np.concatenate([np.asarray(ring, dtype=float)[:, :2] for ring in rings])
+    return points.min(axis=0), points.max(axis=0)
+
+
+class GeoTiffBackend:
+    """
+    Engine over memory-mapped GeoTIFF scenes with the interface of analysis.EarthEngineBackend.
+    GeoJSON AOIs (lon/lat) are reprojected to the raster CRS with pyproj when it is projected;
+    `scale`, `plan` and `tiles` are accepted for compatibility, the native grid is always used.
+    """
+    name = 'geotiff'
+
+    def __init__(self, scenes, block_size=BLOCK_SIZE, workers=MAX_WORKERS):
+        self.scenes = sorted(scenes, key=lambda scene: scene['date'])
+        if not self.scenes:
+            raise ValueError("No scenes in the manifest")
+        reference = open_geotiff(self.scenes[0]['bands']['B4'][0])
+        self.shape = reference.shape
+        self.geotransform = reference.geotransform
+        self.geographic = reference.geographic
+        self.epsg = reference.epsg
+        for scene in self.scenes:
+            for band, (path, _) in scene['bands'].items():
+                if open_geotiff(path).shape != self.shape:
+                    raise ValueError(f"{path} ({band}, {scene['date']}) is not on the grid of {reference.path}")
+        self.block_size = block_size
+        self.workers = workers
+        self.collection_id = f"geotiff:{self._digest()}"
+        self._memo = OrderedDict()
+        self._groups = OrderedDict()
+        self._memo_lock = threading.Lock()
+
+    @classmethod
+    def from_manifest(cls, path, root=None, **kwargs):
+        return cls(load_manifest(path, root), **kwargs)
+
+    def _digest(self):
+        digest = hashlib.sha256(json.dumps([self.geotransform, self.geographic, self.epsg]).encode('utf-8'))
+        for scene in self.scenes:
+            digest.update(f"{scene['date']}|{scene['cloud']}".encode('utf-8'))
+            for band in BANDS:
+                path, sample = scene['bands'][band]
+                stat = os.stat(path)
+                digest.update(f"{band}|{path}|{sample}|{stat.st_size}|{stat.st_mtime_ns}".encode('utf-8'))
+        return digest.hexdigest()[:16]
+
+    def to_raster_crs(self, geometry):
+        """`geometry` (GeoJSON, lon/lat) in the CRS of the rasters."""
+        if self.geographic or self.epsg is None:
+            return geometry
+        try:
+            from pyproj import Transformer
+        except ImportError as e:
+            raise ValueError(f"Reprojecting the AOI to EPSG:{self.epsg} needs pyproj ({e})")
+        transform = Transformer.from_crs(4326, self.epsg, always_xy=True).transform
+
+        def project(ring):
+            x, y = transform(*np.asarray(ring, dtype=float)[:, :2].T)
+            return np.column_stack([x, y]).tolist()
+        if geometry['type'] == 'Polygon':
+            return {'type': 'Polygon', 'coordinates': [project(ring) for ring in geometry['coordinates']]}
+        return {'type': 'MultiPolygon',
+                'coordinates': [[project(ring) for ring in polygon] for polygon in geometry['coordinates']]}
+
+    def pixel_bounds(self, geometry):
+        """(first_row, last_row, first_col, last_col) of the pixels meeting the bounding box of `geometry`, clipped to the grid."""
+        x0, dx, _, y0, _, dy = self.geotransform
+        rows, cols = self.shape
+        (min_x, min_y), (max_x, max_y) = _geometry_bounds(geometry)
+        col_range = sorted(((min_x - x0) / dx, (max_x - x0) / dx))
+        row_range = sorted(((min_y - y0) / dy, (max_y - y0) / dy))
+        return (max(int(row_range[0]), 0), min(int(row_range[1]), rows - 1),
+                max(int(col_range[0]), 0), min(int(col_range[1]), cols - 1))
+
+    def windows(self, geometries):
+        """BLOCK_SIZE windows (r0, r1, c0, c1) meeting the bounding box of any of `geometries`."""
+        rows, cols = self.shape
+        size = self.block_size
+        selected = set()
+        for geometry in geometries:
+            first_row, last_row, first_col, last_col = (bound // size for bound in self.pixel_bounds(geometry))
+            selected.update((r, c) for r in range(first_row, last_row + 1) for c in range(first_col, last_col + 1))
+        return [
+            (r * size, min((r + 1) * size, rows), c * size, min((c + 1) * size, cols))
+            for r, c in sorted(selected)
+        ]
+
+    def _run_pass(self, job, windows):
+        """Merged sums of `windows`, with the per-feature sums as a (features, images, FEATURE_FIELDS) array."""
+        if not windows:
+            return {}, np.zeros(feature_sums_shape(job))
+        workers = min(self.workers, len(windows))
+        if workers <= 1:
+            return reduce_windows(job, windows)
+        per_task = max(1, math.ceil(len(windows) / (workers * TASKS_PER_WORKER)))
+        tasks = [windows[i:i + per_task] for i in range(0, len(windows), per_task)]
+        # The job (scene paths and every feature geometry) is written once per pass and read
+        # once per worker; tasks only carry their windows, and per-feature sums go to their
+        # own slot of a shared accumulator instead of being pickled back
+        payload = pickle.dumps(job, protocol=pickle.HIGHEST_PROTOCOL)
+        shape = feature_sums_shape(job, len(tasks))
+        job_block = shared_memory.SharedMemory(create=True, size=len(payload))
+        sums_block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * 8, 1))
+        try:
+            job_block.buf[:len(payload)] = payload
+            slots = np.ndarray(shape, dtype=np.float64, buffer=sums_block.buf)
+            slots[...] = 0
+            total = {}
+            parts = worker_pool(self.workers).map(
+                reduce_task, [job_block.name] * len(tasks), [sums_block.name] * len(tasks), range(len(tasks)), tasks
+            )
+            for part in parts:
+                merge_sums(total, part)
+            feature_sums = slots.sum(axis=0)
+            del slots
+            return total, feature_sums
+        finally:
+            for block in (job_block, sums_block):
+                block.close()
+                block.unlink()
+
+    def reduce_together(self, images, aoi):
+        """
+        Announce that reductions of `images` (LazyImages) over `aoi` are coming: any of them,
+        and the AOI area, is then computed by one pass over all of them.
+        """
+        group = tuple(dict.fromkeys(image.scene_ids for image in images))
+        key = fingerprint(aoi=aoi)
+        with self._memo_lock:
+            groups = [other for other in self._groups.pop(key, []) if other != group]
+            self._groups[key] = [group] + groups[:GROUP_ENTRIES - 1]
+            while len(self._groups) > MEMO_ENTRIES:
+                self._groups.popitem(last=False)
+
+    def _group_of(self, images, aoi):
+        """The most recently announced group over `aoi` holding all of `images`, else `images`."""
+        with self._memo_lock:
+            groups = self._groups.get(fingerprint(aoi=aoi), [])
+        return next((group for group in groups if set(images) <= set(group)), images)
+
+    def reduce(self, images, aoi=None, features=None):
+        """
+        One pass over the windows of `aoi` (or of the features): merged sums per image
+        (class areas, LAI moments), 'transitions' of a pair of images, 'aoi_area' and
+        per-feature sums. Over an AOI, the pass covers the announced group of `images`;
+        identical passes are computed once and remembered.
+        """
+        images = tuple(dict.fromkeys(images))
+        if aoi is not None and not features:
+            images = self._group_of(images, aoi)
+        aoi = self.to_raster_crs(aoi) if aoi is not None else None
+        features = [(index, self.to_raster_crs(geometry)) for index, geometry in features or []]
+        job = {
+            'images': images,
+            'sources': {scene_id: self.scenes[scene_id]['bands'] for image in images for scene_id in image},
+            'aoi': aoi,
+            'features': features,
+            'feature_pixels': np.array([self.pixel_bounds(geometry) for _, geometry in features], dtype=np.intp).reshape(-1, 4),
+            'geotransform': self.geotransform,
+            'geographic': self.geographic
+        }
+        key = fingerprint(result='geotiff_pass', collection=self.collection_id, images=images, aoi=aoi,
+                          features=features)
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+        windows = self.windows([aoi] if aoi is not None else [geometry for _, geometry in features])
+        sums = single_flight.do(key, lambda: self._pass_sums(job, windows))[0]
+        with self._memo_lock:
+            self._memo[key] = sums
+            while len(self._memo) > MEMO_ENTRIES:
+                self._memo.popitem(last=False)
+        return sums
+
+    def _pass_sums(self, job, windows):
+        """_run_pass() with the per-feature sums as {feature: {image: {'class_areas', 'lai_sum', 'lai_area'}}}."""
+        sums, feature_sums = self._run_pass(job, windows)
+        if job['features']:
+            sums['features'] = {
+                index: {
+                    image: {
+                        'class_areas': dict(zip(NDVI_CLASSES, map(float, feature_sums[slot, position, :len(NDVI_CLASSES)]))),
+                        'lai_sum': float(feature_sums[slot, position, -2]),
+                        'lai_area': float(feature_sums[slot, position, -1])
+                    }
+                    for position, image in enumerate(job['images'])
+                }
+                for slot, (index, _) in enumerate(job['features'])
+            }
+        return sums
+
+    def _pair_pass(self, images, aoi):
+        """A pass over one or two LazyImages, including their transitions (so they share it)."""
+        return self.reduce([image.scene_ids for image in images], aoi)
+
+    def satCollection(self, cloud_rate, start_date, end_date, aoi):
+        # Same filters as the Earth Engine collection: cloud percentage and [start, end)
+        return [
+            scene_id for scene_id, scene in enumerate(self.scenes)
+            if scene['cloud'] < cloud_rate and start_date <= scene['date'] < end_date
+        ]
+
+    def composite(self, collection, aoi=None):
+        return LazyImage(collection)
+
+    # Every product of a composite is derived per window by the reductions
+    def getNDVI(self, image):
+        return image
+
+    def satImageMask(self, image):
+        return image
+
+    def classify_ndvi(self, image):
+        return image
+
+    def classify_vegetation_ndvi(self, image):
+        return image, image
+
+    def getLAI(self, image):
+        return image
+
+    def scene_counts(self, collections):
+        return {name: len(collection) for name, collection in collections.items()}
+
+    def _image_sums(self, sums, image):
+        return sums.get(image.scene_ids, {})
+
+    def class_areas(self, classified_images, aoi, scale=10, plan=None, tiles=None, progress=None):
+        sums = self._pair_pass(classified_images.values(), aoi)
+        return {
+            name: self._image_sums(sums, image).get('class_areas', {c: 0.0 for c in NDVI_CLASSES})
+            for name, image in classified_images.items()
+        }
+
+    def class_transitions(self, initial_classified, updated_classified, aoi, scale=10, plan=None, tiles=None, progress=None):
+        sums = self._pair_pass([initial_classified, updated_classified], aoi)
+        if 'transitions' in sums:
+            return sums['transitions']
+        if initial_classified.scene_ids == updated_classified.scene_ids:
+            # Same composite on both dates: every pixel keeps its class
+            areas = self._image_sums(sums, initial_classified).get('class_areas', {})
+            return {a: {b: areas.get(a, 0.0) if a == b else 0.0 for b in NDVI_CLASSES} for a in NDVI_CLASSES}
+        return {a: {b: 0.0 for b in NDVI_CLASSES} for a in NDVI_CLASSES}
+
+    def lai_statistics(self, lai_images, aoi, scale=10, plan=None):
+        sums = self._pair_pass(lai_images.values(), aoi)
+        return {name: lai_summary(self._image_sums(sums, image).get('lai')) for name, image in lai_images.items()}
+
+    def feature_statistics(self, classified_images, lai_images, features, scale=10, plan=None):
+        sums = self.reduce(
+            [image.scene_ids for image in classified_images.values()],
+            features=[(feature['properties'][FEATURE_ID], feature['geometry']) for feature in features['features']]
+        ).get('features', {})
+        statistics = {}
+        for feature in features['features']:
+            index = feature['properties'][FEATURE_ID]
+            statistics[index] = {}
+            for name, image in classified_images.items():
+                feature_sums = sums.get(index, {}).get(image.scene_ids, {})
+                statistics[index][name] = {
+                    'class_areas': feature_sums.get('class_areas', {c: 0.0 for c in NDVI_CLASSES}),
+                    'lai_mean': feature_sums['lai_sum'] / feature_sums['lai_area'] if feature_sums.get('lai_area') else None
+                }
+        return statistics
+
+    def aoi_area(self, aoi):
+        if aoi is None:
+            rows, cols = self.shape
+            return float(np.broadcast_to(pixel_areas(self.geotransform, self.shape, self.geographic), (rows, cols)).sum())
+        return self.reduce([], aoi).get('aoi_area', 0.0)
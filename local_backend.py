@@ -0,0 +1,332 @@
+"""
+NumPy implementation of the NDVI / LAI / area pipeline for imagery held in memory.
+
+Mirrors the Earth Engine functions in analysis.py (satCollection, getNDVI, satImageMask,
+classify_ndvi, classify_vegetation_ndvi, getLAI and the area reductions) as vectorized
+array operations, so the same analysis can run on our own Sentinel-2 scenes, offline.
+
+A scene is a dict {'date': 'YYYY-MM-DD', 'cloud': percent, 'bands': {'B2': ..., 'B3': ...,
+'B4': ..., 'B8': ...}} of raw (scaled by 10000) reflectance arrays on a shared grid
+described by a GDAL-style geotransform (x0, dx, 0, y0, 0, dy). Pixel value 0 is nodata.
+"""
+import hashlib
+import io
+import json
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+
+from analysis import (
+    BANDS,
+    EARTH_RADIUS,
+    FEATURE_ID,
+    LAI_BIN_EDGES,
+    LAI_PERCENTILES,
+    NDVI_CLASS_BREAKS,
+    NDVI_CLASSES,
+    TRANSITION_BASE,
+    VEGETATION_CLASSES,
+)
+
+# Rasterized AOIs kept per backend (each is a full-size boolean mask)
+AOI_MASK_ENTRIES = 8
+
+
+def median_composite(scenes):
+    """Per-pixel nan-aware median of every band over the scenes, scaled to reflectance."""
+    composite = {}
+    for band in BANDS:
+        stack = np.stack([scene['bands'][band] for scene in scenes]).astype(np.float32)
+        stack[stack == 0] = np.nan
+        with warnings.catch_warnings():
+            # All-nan pixels (no valid scene) legitimately stay nan
+            warnings.simplefilter('ignore', RuntimeWarning)
+            composite[band] = np.nanmedian(stack, axis=0) / 10000
+    return composite
+
+def getNDVI(image):
+    nir, red = image['B8'], image['B4']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (nir - red) / (nir + red)
+
+def satImageMask(sat_image):
+    with np.errstate(invalid='ignore'):
+        return np.where(sat_image >= 0, sat_image, np.nan)
+
+def classify_ndvi(masked_image):
+    # np.digitize gives i for NDVI_CLASS_BREAKS[i-1] <= x < NDVI_CLASS_BREAKS[i], i.e. the
+    # class value; negative NDVI gives 0 and masked (nan) pixels are forced to 0
+    classified = np.digitize(masked_image, NDVI_CLASS_BREAKS).astype(np.uint8)
+    classified[np.isnan(masked_image)] = 0
+    return classified
+
+def classify_vegetation_ndvi(masked_image):
+    with np.errstate(invalid='ignore'):
+        vegetation_binary = masked_image >= NDVI_CLASS_BREAKS[VEGETATION_CLASSES[0] - 1]
+        non_vegetation_binary = (masked_image >= 0) & ~vegetation_binary
+    return vegetation_binary, non_vegetation_binary
+
+def getLAI(image):
+    """LAI from the EVI of the B8/B4/B2 bands, or None when any of them is missing."""
+    if not all(band in image for band in ('B8', 'B4', 'B2')):
+        return None
+    nir, red, blue = image['B8'], image['B4'], image['B2']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        evi = 2.5 * ((nir - red) / (nir + 6 * red - 7.5 * blue + 1))
+    return 3.618 * evi - 0.118
+
+def pixel_areas(geotransform, shape, geographic=False):
+    """Area of each pixel in m², shaped to broadcast against a (rows, cols) raster."""
+    x0, dx, _, y0, _, dy = geotransform
+    rows = shape[0]
+    if not geographic:
+        return np.full((rows, 1), abs(dx * dy))
+    edges = np.radians(y0 + np.arange(rows + 1) * dy)
+    band_areas = EARTH_RADIUS ** 2 * abs(np.radians(dx)) * np.abs(np.diff(np.sin(edges)))
+    return band_areas[:, None]
+
+def rasterize_geometry(geometry, geotransform, shape):
+    """
+    Boolean mask of the pixels whose centres fall inside a GeoJSON (Multi)Polygon.
+
+    Scanline fill: the crossings of every ring edge with the pixel-centre rows are found
+    with a searchsorted over all edges at once, sorted along each row and paired up, and
+    the spans between pairs are filled. Pairing is even-odd, so holes are carved out; the
+    cost grows with the crossings and the filled pixels, not with vertices × pixels.
+    """
+    if geometry['type'] == 'Polygon':
+        polygons = [geometry['coordinates']]
+    elif geometry['type'] == 'MultiPolygon':
+        polygons = geometry['coordinates']
+    else:
+        raise ValueError(f"Unsupported geometry type: {geometry['type']}")
+
+    x0, dx, _, y0, _, dy = geotransform
+    rows, cols = shape
+    mask = np.zeros(shape, dtype=bool)
+    # Pixel centres in ascending order, as searchsorted needs them
+    ys = y0 + (np.arange(rows) + 0.5) * abs(dy) * (1 if dy > 0 else -1)
+    xs = x0 + (np.arange(cols) + 0.5) * abs(dx) * (1 if dx > 0 else -1)
+    ys, xs = (ys if dy > 0 else ys[::-1]), (xs if dx > 0 else xs[::-1])
+
+    span_rows, span_starts, span_ends = [], [], []
+    for polygon in polygons:
+        rings = [np.asarray(ring, dtype=float)[:, :2] for ring in polygon if len(ring)]
+        if not rings or len(rings[0]) < 3:
+            continue
+        (x1, y1), (x2, y2) = np.concatenate(rings).T, np.concatenate([np.roll(ring, -1, axis=0) for ring in rings]).T
+        # An edge crosses the rows with min(y1, y2) <= y < max(y1, y2)
+        first = np.searchsorted(ys, np.minimum(y1, y2))
+        counts = np.searchsorted(ys, np.maximum(y1, y2)) - first
+        total = int(counts.sum())
+        if not total:
+            continue
+        edge = np.repeat(np.arange(len(x1)), counts)
+        row = first[edge] + np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        x_cross = x1[edge] + (ys[row] - y1[edge]) * (x2[edge] - x1[edge]) / (y2[edge] - y1[edge])
+        order = np.lexsort((x_cross, row))
+        row, x_cross = row[order], x_cross[order]
+        # Closed rings cross every row an even number of times: pixels are inside between
+        # crossings 2k and 2k+1
+        span_rows.append(row[0::2])
+        span_starts.append(np.searchsorted(xs, x_cross[0::2]))
+        span_ends.append(np.searchsorted(xs, x_cross[1::2]))
+    if not span_rows:
+        return mask
+
+    span_rows, starts, ends = np.concatenate(span_rows), np.concatenate(span_starts), np.concatenate(span_ends)
+    keep = ends > starts
+    span_rows, starts, ends = span_rows[keep], starts[keep], ends[keep]
+    if not span_rows.size:
+        return mask
+    # +1 at each span start and -1 past its end; a running sum > 0 is inside some polygon
+    top, left = span_rows.min(), starts.min()
+    height, width = span_rows.max() - top + 1, ends.max() - left + 1
+    rows_in = (span_rows - top) * width
+    edges = (np.bincount(rows_in + starts - left, minlength=height * width)
+             - np.bincount(rows_in + ends - left, minlength=height * width))
+    window = np.cumsum(edges.reshape(height, width), axis=1)[:, :-1] > 0
+    mask[top:top + height, left:left + width - 1] = window
+    if dy < 0:
+        mask = mask[::-1]
+    if dx < 0:
+        mask = mask[:, ::-1]
+    return mask
+
+def class_areas(classified, areas, aoi_mask=None):
+    """Per-class pixel-area sums for a classify_ndvi raster."""
+    valid = classified > 0
+    if aoi_mask is not None:
+        valid &= aoi_mask
+    weights = np.broadcast_to(areas, classified.shape)[valid]
+    sums = np.bincount(classified[valid], weights=weights, minlength=len(NDVI_CLASSES) + 1)
+    return {class_value: float(sums[class_value]) for class_value in NDVI_CLASSES}
+
+def class_transitions(initial, updated, areas, aoi_mask=None):
+    """Pixel-area sums per (initial class, updated class) pair, like analysis.reduce_transitions."""
+    valid = (initial > 0) & (updated > 0)
+    if aoi_mask is not None:
+        valid &= aoi_mask
+    codes = initial[valid].astype(np.intp) * TRANSITION_BASE + updated[valid]
+    weights = np.broadcast_to(areas, initial.shape)[valid]
+    sums = np.bincount(codes, weights=weights, minlength=(len(NDVI_CLASSES) + 1) * TRANSITION_BASE)
+    return {
+        initial_class: {updated_class: float(sums[initial_class * TRANSITION_BASE + updated_class]) for updated_class in NDVI_CLASSES}
+        for initial_class in NDVI_CLASSES
+    }
+
+def lai_statistics(lai, aoi_mask=None):
+    """Same summary as analysis.calculate_lai_statistics for one LAI raster."""
+    valid = np.isfinite(lai)
+    if aoi_mask is not None:
+        valid &= aoi_mask
+    values = lai[valid]
+    histogram = [0] * len(LAI_BIN_EDGES)
+    if not values.size:
+        return {'mean': 0, 'stdDev': 0, 'percentiles': {p: None for p in LAI_PERCENTILES}, 'histogram': histogram}
+
+    binned = values[values >= LAI_BIN_EDGES[0]]
+    counts = np.bincount(np.digitize(binned, LAI_BIN_EDGES) - 1, minlength=len(LAI_BIN_EDGES))
+    return {
+        'mean': float(values.mean()),
+        'stdDev': float(values.std()),
+        'percentiles': dict(zip(LAI_PERCENTILES, np.percentile(values, LAI_PERCENTILES).tolist())),
+        'histogram': counts.tolist()
+    }
+
+def lai_mean(lai, areas, aoi_mask=None):
+    """Pixel-area weighted LAI mean, like the per-feature Earth Engine reduction; None when empty."""
+    valid = np.isfinite(lai)
+    if aoi_mask is not None:
+        valid &= aoi_mask
+    weights = np.broadcast_to(areas, lai.shape)[valid]
+    total = weights.sum()
+    return float((lai[valid] * weights).sum() / total) if total else None
+
+
+def load_npz_scenes(source):
+    """
+    Load scenes from an .npz archive (path, file object or bytes) holding B2/B3/B4/B8
+    stacks shaped (scene, row, col) plus 'dates', 'cloud' and 'geotransform' arrays and
+    an optional 'geographic' flag. Returns (scenes, geotransform, geographic).
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with np.load(source) as archive:
+        dates = [str(d) for d in archive['dates']]
+        cloud = archive['cloud'].tolist()
+        stacks = {band: archive[band] for band in BANDS}
+        geotransform = tuple(archive['geotransform'].tolist())
+        geographic = bool(archive['geographic']) if 'geographic' in archive else False
+    scenes = [
+        {'date': date, 'cloud': cloud[i], 'bands': {band: stacks[band][i] for band in BANDS}}
+        for i, date in enumerate(dates)
+    ]
+    return scenes, geotransform, geographic
+
+
+class NumpyBackend:
+    """
+    Local engine with the same interface as analysis.EarthEngineBackend.
+    AOIs are GeoJSON geometry dicts; `scale` and `plan` are accepted for compatibility
+    but the native pixel grid of the scenes is always used.
+    """
+    name = 'local'
+
+    def __init__(self, scenes, geotransform, geographic=False):
+        self.scenes = sorted(scenes, key=lambda scene: scene['date'])
+        self.geotransform = tuple(geotransform)
+        self.geographic = geographic
+        self.shape = self.scenes[0]['bands']['B4'].shape if self.scenes else (0, 0)
+        self.pixel_areas = pixel_areas(self.geotransform, self.shape, geographic)
+        self.collection_id = f"local:{self._digest()}"
+        self._aoi_masks = OrderedDict()
+        self._aoi_masks_lock = threading.Lock()
+
+    @classmethod
+    def from_npz(cls, source):
+        return cls(*load_npz_scenes(source))
+
+    def _digest(self):
+        digest = hashlib.sha256(json.dumps([self.geotransform, self.geographic]).encode('utf-8'))
+        for scene in self.scenes:
+            digest.update(f"{scene['date']}|{scene['cloud']}".encode('utf-8'))
+            for band in BANDS:
+                digest.update(np.ascontiguousarray(scene['bands'][band]).tobytes())
+        return digest.hexdigest()[:16]
+
+    def aoi_mask(self, aoi):
+        if aoi is None:
+            return None
+        key = json.dumps(aoi, sort_keys=True)
+        with self._aoi_masks_lock:
+            mask = self._aoi_masks.get(key)
+            if mask is not None:
+                self._aoi_masks.move_to_end(key)
+                return mask
+        mask = rasterize_geometry(aoi, self.geotransform, self.shape)
+        with self._aoi_masks_lock:
+            self._aoi_masks[key] = mask
+            while len(self._aoi_masks) > AOI_MASK_ENTRIES:
+                self._aoi_masks.popitem(last=False)
+        return mask
+
+    def satCollection(self, cloud_rate, start_date, end_date, aoi):
+        # Same filters as the Earth Engine collection: cloud percentage and [start, end)
+        return [
+            scene for scene in self.scenes
+            if scene['cloud'] < cloud_rate and start_date <= scene['date'] < end_date
+        ]
+
+    def composite(self, collection, aoi=None):
+        if not collection:
+            # Like an empty Earth Engine composite: nothing valid anywhere
+            return {band: np.full(self.shape, np.nan, dtype=np.float32) for band in BANDS}
+        return median_composite(collection)
+
+    def scene_counts(self, collections):
+        return {name: len(collection) for name, collection in collections.items()}
+
+    getNDVI = staticmethod(getNDVI)
+    satImageMask = staticmethod(satImageMask)
+    classify_ndvi = staticmethod(classify_ndvi)
+    classify_vegetation_ndvi = staticmethod(classify_vegetation_ndvi)
+
+    def getLAI(self, image):
+        lai = getLAI(image)
+        return lai if lai is not None else np.full(self.shape, np.nan, dtype=np.float32)
+
+    # tiles / progress: scenes already in memory are never tiled
+    def class_areas(self, classified_images, aoi, scale=10, plan=None, tiles=None, progress=None):
+        mask = self.aoi_mask(aoi)
+        return {
+            name: class_areas(classified, self.pixel_areas, mask)
+            for name, classified in classified_images.items()
+        }
+
+    def class_transitions(self, initial_classified, updated_classified, aoi, scale=10, plan=None, tiles=None, progress=None):
+        return class_transitions(initial_classified, updated_classified, self.pixel_areas, self.aoi_mask(aoi))
+
+    def lai_statistics(self, lai_images, aoi, scale=10, plan=None):
+        mask = self.aoi_mask(aoi)
+        return {name: lai_statistics(lai, mask) for name, lai in lai_images.items()}
+
+    def feature_statistics(self, classified_images, lai_images, features, scale=10, plan=None):
+        statistics = {}
+        for feature in features['features']:
+            mask = rasterize_geometry(feature['geometry'], self.geotransform, self.shape)
+            statistics[feature['properties'][FEATURE_ID]] = {
+                name: {
+                    'class_areas': class_areas(classified, self.pixel_areas, mask),
+                    'lai_mean': lai_mean(lai_images[name], self.pixel_areas, mask)
+                }
+                for name, classified in classified_images.items()
+            }
+        return statistics
+
+    def aoi_area(self, aoi):
+        mask = self.aoi_mask(aoi)
+        areas = np.broadcast_to(self.pixel_areas, self.shape)
+        return float(areas[mask].sum() if mask is not None else areas.sum())
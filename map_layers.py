@@ -0,0 +1,133 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import ee
+import requests
+
+from ee_trace import in_context, trace_call
+
+# Earth Engine map IDs stop serving tiles after a while; refresh them well before that
+MAP_ID_TTL = 60 * 60
+MAX_WORKERS = 8
+
+
+def layer_key(ee_image_object, vis_params):
+    """Hash of the image expression graph plus the visualization parameters."""
+    graph = ee.Image(ee_image_object).serialize()
+    params = json.dumps(vis_params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{graph}|{params}".encode('utf-8')).hexdigest()
+
+
+class TileUrlCache:
+    """Process-wide cache of tile URL templates that expire with the map ID token."""
+
+    def __init__(self, ttl=MAP_ID_TTL, max_entries=512):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            url_format, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return url_format
+
+    def set(self, key, url_format):
+        with self._lock:
+            self._entries[key] = (url_format, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+tile_url_cache = TileUrlCache()
+
+
+def get_tile_url(ee_image_object, vis_params, cache=tile_url_cache, name=None):
+    key = layer_key(ee_image_object, vis_params)
+    url_format = cache.get(key)
+    if url_format is None:
+        map_id_dict = trace_call(f"map id {name or 'layer'}", ee.Image(ee_image_object).getMapId, vis_params)
+        url_format = map_id_dict['tile_fetcher'].url_format
+        cache.set(key, url_format)
+    return url_format
+
+
+def resolve_tile_urls(layers, max_workers=MAX_WORKERS, cache=tile_url_cache):
+    """
+    Resolve tile URL templates for (ee_image_object, vis_params, name) layers.
+    Cache misses are requested concurrently on a bounded thread pool; the result
+    keeps the input order and holds None for layers that failed.
+    """
+    def resolve(layer):
+        ee_image_object, vis_params, name = layer
+        try:
+            return get_tile_url(ee_image_object, vis_params, cache, name)
+        except Exception as e:
+            print(f"Error adding Earth Engine layer {name}: {e}")
+            return None
+
+    if not layers:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(layers))) as executor:
+        # Workers record their map ID requests into the caller's trace
+        return list(executor.map(in_context(resolve), layers))
+
+
+# Report thumbnails: one PNG per layer, at most THUMBNAIL_DIMENSIONS pixels on the long side
+THUMBNAIL_DIMENSIONS = 512
+THUMBNAIL_TIMEOUT = 60
+
+
+def download_png(url):
+    response = requests.get(url, timeout=THUMBNAIL_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+def get_thumbnail(ee_image_object, vis_params, region, cache=None, ttl=None, name=None, fetch=download_png):
+    """
+    PNG bytes of the image rendered over `region`. With a result_cache.ResultCache the PNG
+    is stored on disk under the image expression and visualization parameters.
+    """
+    params = dict(vis_params, dimensions=THUMBNAIL_DIMENSIONS, region=region, format='png')
+
+    def render():
+        url = trace_call(f"thumbnail {name or 'layer'}", ee.Image(ee_image_object).getThumbURL, params)
+        return fetch(url)
+
+    if cache is None:
+        return render()
+    # The image expression already holds the AOI it is clipped to
+    key = f"thumbnail:{layer_key(ee_image_object, dict(vis_params, dimensions=THUMBNAIL_DIMENSIONS))}"
+    return cache.get_or_compute(key, render, ttl)
+
+
+def fetch_thumbnails(layers, region, cache=None, ttl=None, max_workers=MAX_WORKERS, fetch=download_png):
+    """
+    Thumbnails for (ee_image_object, vis_params, name) layers, requested concurrently like
+    resolve_tile_urls(); the result keeps the input order and holds None for failures.
+    """
+    def render(layer):
+        ee_image_object, vis_params, name = layer
+        try:
+            return get_thumbnail(ee_image_object, vis_params, region, cache, ttl, name, fetch)
+        except Exception as e:
+            print(f"Error rendering thumbnail {name}: {e}")
+            return None
+
+    if not layers:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(layers))) as executor:
+        return list(executor.map(in_context(render), layers))
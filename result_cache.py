@@ -0,0 +1,327 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+DEFAULT_CACHE_DIR = os.environ.get('VEGALYTICS_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'vegalytics'))
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+# Recently used entries are also kept in process memory, shared by every session
+DEFAULT_MEMORY_BYTES = 64 * 1024 * 1024
+# Sentinel-2 scenes keep arriving for a few days after acquisition, so results for
+# windows ending this recently are only trusted for RECENT_TTL seconds.
+RECENT_DAYS = 5
+RECENT_TTL = 6 * 60 * 60
+
+
+def _round_coordinates(coordinates, ndigits=7):
+    if isinstance(coordinates, (list, tuple)):
+        return [_round_coordinates(c, ndigits) for c in coordinates]
+    return round(coordinates, ndigits)
+
+def normalize_geometry(geometry):
+    """
+    Canonical, JSON-serializable form of an AOI for fingerprinting.
+    Accepts a GeoJSON dict or an ee.Geometry; client-side geometries are reduced to
+    rounded coordinates, computed ones fall back to their serialized expression.
+    """
+    if geometry is None:
+        return None
+    if isinstance(geometry, dict):
+        geojson = geometry
+    else:
+        try:
+            geojson = geometry.toGeoJSON()
+        except Exception:
+            return geometry.serialize()
+    return {'type': geojson['type'], 'coordinates': _round_coordinates(geojson['coordinates'])}
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (range, tuple, set)):
+        return list(value)
+    raise TypeError(f"Cannot fingerprint {type(value).__name__}")
+
+def fingerprint(**parts):
+    """sha256 of the canonical JSON of the given computation parameters."""
+    if 'geometry' in parts:
+        parts['geometry'] = normalize_geometry(parts['geometry'])
+    canonical = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=_json_default)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class SingleFlight:
+    """
+    Request coalescing: while a computation for a key is running, other callers with the
+    same key wait for it and share its result (or its exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, compute):
+        """Return (value, shared): shared is True when another caller's computation was reused."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'value': None, 'error': None}
+            else:
+                self.shared += 1
+        if not leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['value'], True
+        try:
+            call['value'] = compute()
+        except BaseException as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+        return call['value'], False
+
+    def do_many(self, keys, compute):
+        """
+        Coalesce per key: compute(led) is called with the keys no one else is computing and
+        returns {key: value} for them (or None, giving None for each); keys already in flight
+        are waited for. Returns ({key: value}, shared keys). Every led key is filled before
+        any of their waiters is released.
+        """
+        led, waiting = [], {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = {'done': threading.Event(), 'value': None, 'error': None}
+                    led.append((key, call))
+                else:
+                    self.shared += 1
+                    waiting[key] = call
+        values = {}
+        if led:
+            try:
+                computed = compute([key for key, _ in led])
+                for key, call in led:
+                    call['value'] = values[key] = computed.get(key) if computed is not None else None
+            except BaseException as e:
+                for _, call in led:
+                    call['error'] = e
+                raise
+            finally:
+                with self._lock:
+                    for key, _ in led:
+                        del self._calls[key]
+                for _, call in led:
+                    call['done'].set()
+        # Leaders never wait before computing, so flights can't wait on each other in a cycle
+        for key, call in waiting.items():
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            values[key] = call['value']
+        return values, set(waiting)
+
+
+# Process-wide, so identical computations from different sessions (or batch workers) run once
+single_flight = SingleFlight()
+
+
+class ResultCache:
+    """
+    Persistent SQLite-backed cache for computed results.
+
+    Entries are pickled, evicted least-recently-used once the total stored size
+    exceeds max_bytes, and may carry a TTL after which they are treated as missing.
+    The most recently used entries (up to memory_bytes of pickles) are also served from
+    memory, and concurrent get_or_compute() calls for a missing key share one computation.
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES, recent_days=RECENT_DAYS, recent_ttl=RECENT_TTL,
+                 memory_bytes=DEFAULT_MEMORY_BYTES):
+        self.path = path or os.path.join(DEFAULT_CACHE_DIR, 'results.sqlite')
+        self.max_bytes = max_bytes
+        self.recent_days = recent_days
+        self.recent_ttl = recent_ttl
+        self.memory_bytes = memory_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        # Access times of memory hits, written to the store before it evicts anything
+        self._touched = {}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed REAL NOT NULL,
+                    expires REAL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def ttl_for(self, end_dates):
+        """TTL for results over windows ending on `end_dates`; None means no expiry."""
+        cutoff = date.today() - timedelta(days=self.recent_days)
+        for end_date in end_dates:
+            if isinstance(end_date, str):
+                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+            elif isinstance(end_date, datetime):
+                end_date = end_date.date()
+            if end_date >= cutoff:
+                return self.recent_ttl
+        return None
+
+    def _remember(self, key, blob, expires):
+        """Keep a pickle in the in-memory tier (caller holds the lock)."""
+        self._forget(key)
+        if len(blob) > self.memory_bytes:
+            return
+        self._memory[key] = (blob, expires)
+        self._memory_size += len(blob)
+        while self._memory_size > self.memory_bytes:
+            _, (evicted, _) = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    def _forget(self, key):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_size -= len(entry[0])
+
+    def _lookup(self, key, now):
+        """The stored pickle for key, or None (caller holds the lock)."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            if entry[1] is None or entry[1] > now:
+                self._memory.move_to_end(key)
+                self._touched[key] = now
+                return entry[0]
+            self._forget(key)
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or (row[1] is not None and row[1] <= now):
+                if row is not None:
+                    conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+        self._remember(key, row[0], row[1])
+        return row[0]
+
+    def get(self, key, default=None):
+        with self._lock:
+            blob = self._lookup(key, time.time())
+            if blob is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+        # Every caller gets its own copy, even of entries served from memory
+        return pickle.loads(blob)
+
+    def set(self, key, value, ttl=None):
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, accessed, expires) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, expires)
+            )
+            # An entry larger than max_bytes evicts itself; don't serve it from memory either
+            if key not in self._evict(conn):
+                self._remember(key, blob, expires)
+
+    def _evict(self, conn):
+        """Delete least recently used rows until the store fits max_bytes; returns their keys."""
+        evicted = []
+        conn.executemany("UPDATE results SET accessed = ? WHERE key = ?",
+                         [(accessed, key) for key, accessed in self._touched.items()])
+        self._touched.clear()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return evicted
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed ASC").fetchall():
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            # The memory tier must not keep serving what the store dropped
+            self._forget(key)
+            evicted.append(key)
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+        return evicted
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """
+        Return the cached value for key, computing and storing it on a miss. None is never
+        stored. Concurrent misses for the same key (from any session) wait for one computation.
+        """
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+
+        def compute_and_store():
+            # The previous computation for this key may have finished since our lookup
+            with self._lock:
+                blob = self._lookup(key, time.time())
+            if blob is not None:
+                return pickle.loads(blob)
+            value = compute()
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+
+        value, shared = single_flight.do(key, compute_and_store)
+        if shared:
+            with self._lock:
+                self.coalesced += 1
+            # Don't hand the leader's object to another session
+            value = pickle.loads(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        return value
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM results")
+            self._memory.clear()
+            self._memory_size = 0
+            self._touched.clear()
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'coalesced': self.coalesced,
+                'entries': entries,
+                'bytes': size
+            }
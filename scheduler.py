@@ -0,0 +1,171 @@
+"""
+Central scheduler for Earth Engine requests.
+
+Every evaluation (ee_trace.trace_call) runs through request_scheduler, which:
+
+- caps the number of requests in flight across the whole process (all sessions, batch
+  workers and background refinements share MAX_CONCURRENT_REQUESTS),
+- hands free slots to waiting requests by priority: INTERACTIVE before BATCH before
+  PREFETCH, first come first served within a priority,
+- retries rate-limit, timeout and unavailable errors with exponential backoff and full
+  jitter, without holding a slot while waiting.
+
+The priority of a request comes from the calling context (request_priority()), so it
+carries into ee_trace.in_context() workers. stats() exposes queue depth and retry counts.
+"""
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+INTERACTIVE, BATCH, PREFETCH = 0, 1, 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BATCH: 'batch', PREFETCH: 'prefetch'}
+
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('VEGALYTICS_EE_CONCURRENCY', 10))
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+# Earth Engine / HTTP error messages worth retrying (matched case-insensitively), e.g.
+# "Too many concurrent aggregations.", "Earth Engine capacity exceeded.", "Computation
+# timed out.", "<HttpError 503 when requesting ...>". Only whole phrases and HTTP statuses
+# match, not words or digits that happen to appear in a message (asset ids, band names)
+RETRYABLE_ERRORS = [
+    (re.compile(r'too many (concurrent aggregations|requests)|rate limit|concurrency limit|\bhttp ?error 429\b'),
+     'rate limit'),
+    (re.compile(r'quota exceeded|capacity exceeded|resource[ _]exhausted'), 'quota'),
+    (re.compile(r'computation timed out|(read|operation|request) timed out|deadline[ _]exceeded'), 'timeout'),
+    (re.compile(r'service unavailable|internal error|backend error|\bhttp ?error 50[0234]\b'), 'unavailable'),
+]
+
+_priority = contextvars.ContextVar('ee_request_priority', default=INTERACTIVE)
+
+
+@contextmanager
+def request_priority(priority):
+    """Run the enclosed requests (and those of in_context() workers) at `priority`."""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def with_priority(priority, function):
+    """`function` wrapped to run its requests at `priority`, e.g. for executor.submit."""
+    def run(*args, **kwargs):
+        with request_priority(priority):
+            return function(*args, **kwargs)
+    return run
+
+
+def retry_reason(error):
+    """Why `error` is worth retrying ('rate limit', 'timeout', ...), or None."""
+    if isinstance(error, TimeoutError):
+        return 'timeout'
+    if isinstance(error, ConnectionError):
+        return 'unavailable'
+    message = str(error).lower()
+    for pattern, reason in RETRYABLE_ERRORS:
+        if pattern.search(message):
+            return reason
+    return None
+
+
+class RequestScheduler:
+    def __init__(self, max_concurrent=MAX_CONCURRENT_REQUESTS, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, sleep=time.sleep):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # How backoffs are waited out (tests pass a fake clock)
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._tickets = itertools.count()
+        self._active = 0
+        self._counts = Counter()
+        self._retry_reasons = Counter()
+        self._wait_s = 0.0
+
+    def _acquire(self, priority):
+        start = time.perf_counter()
+        with self._cond:
+            ticket = (priority, next(self._tickets))
+            heapq.heappush(self._waiting, ticket)
+            while self._active >= self.max_concurrent or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._active += 1
+            waited = time.perf_counter() - start
+            self._wait_s += waited
+            # Another slot may still be free for the next in line
+            self._cond.notify_all()
+        return waited
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def backoff(self, attempt):
+        """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def run(self, evaluate, args=(), kwargs=None, info=None):
+        """
+        Call evaluate(*args, **kwargs) in a slot, retrying retryable errors. `info`, if given,
+        is filled with the attempts made and the seconds spent queued.
+        """
+        priority = _priority.get()
+        info = {} if info is None else info
+        info.update(attempts=0, queued_s=0.0, priority=PRIORITY_NAMES.get(priority, priority))
+        with self._cond:
+            self._counts['submitted'] += 1
+        while True:
+            info['queued_s'] += self._acquire(priority)
+            info['attempts'] += 1
+            try:
+                result = evaluate(*args, **(kwargs or {}))
+            except Exception as e:
+                reason = retry_reason(e)
+                if reason is None or info['attempts'] > self.max_retries:
+                    with self._cond:
+                        self._counts['failed'] += 1
+                    raise
+                with self._cond:
+                    self._counts['retries'] += 1
+                    self._retry_reasons[reason] += 1
+            else:
+                with self._cond:
+                    self._counts['completed'] += 1
+                return result
+            finally:
+                self._release()
+            self._sleep(self.backoff(info['attempts']))
+
+    def stats(self):
+        with self._cond:
+            queued = Counter(PRIORITY_NAMES.get(priority, priority) for priority, _ in self._waiting)
+            return {
+                'active': self._active,
+                'queued': len(self._waiting),
+                'queued_by_priority': dict(queued),
+                'max_concurrent': self.max_concurrent,
+                'submitted': self._counts['submitted'],
+                'completed': self._counts['completed'],
+                'failed': self._counts['failed'],
+                'retries': self._counts['retries'],
+                'retry_reasons': dict(self._retry_reasons),
+                'queued_s': round(self._wait_s, 3)
+            }
+
+
+request_scheduler = RequestScheduler()
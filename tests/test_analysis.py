@@ -0,0 +1,313 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import numpy as np
+import pytest
+
+import analysis
+from analysis import BANDS, TRANSITION_BASE, Analysis, parse_transitions
+from benchmarks import fake_ee
+from ee_trace import start_trace
+from local_backend import NumpyBackend
+from result_cache import ResultCache
+
+
+def test_parse_transitions_decodes_initial_times_base_plus_updated():
+    assert TRANSITION_BASE == 10
+    result = {'groups': [
+        {'code': 23, 'sum': 1500.0},
+        {'code': 77, 'sum': 20.5},
+        {'code': 71, 'sum': 3.0},
+        # Unclassified on either date
+        {'code': 5, 'sum': 99.0},
+        {'code': 30, 'sum': 99.0},
+    ]}
+    matrix = parse_transitions(result)
+    assert sorted(matrix) == list(range(1, 8))
+    assert all(sorted(row) == list(range(1, 8)) for row in matrix.values())
+    assert matrix[2][3] == 1500.0
+    assert matrix[3][2] == 0
+    assert matrix[7][7] == 20.5
+    assert matrix[7][1] == 3.0
+    assert sum(sum(row.values()) for row in matrix.values()) == 1523.5
+
+
+def test_parse_transitions_of_an_empty_reduction_is_all_zero():
+    for result in (None, {}, {'groups': None}, {'groups': [{'code': 12, 'sum': None}]}):
+        matrix = parse_transitions(result)
+        assert all(value == 0 for row in matrix.values() for value in row.values())
+
+
+class CountingBackend(NumpyBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.class_area_dates = []
+
+    def class_areas(self, classified_images, aoi, *args, **kwargs):
+        self.class_area_dates.append(sorted(classified_images))
+        return super().class_areas(classified_images, aoi, *args, **kwargs)
+
+
+def make_backend():
+    rng = np.random.default_rng(0)
+    scenes = [
+        {'date': day, 'cloud': 5.0,
+         'bands': {band: rng.uniform(0.01, 0.5, (8, 8)).astype(np.float32) for band in BANDS}}
+        for day in ('2024-05-30', '2024-06-10', '2024-06-20')
+    ]
+    return CountingBackend(scenes, (0.0, 10.0, 0.0, 80.0, 0.0, -10.0))
+
+
+AOI = {'type': 'Polygon', 'coordinates': [[[0, 0], [80, 0], [80, 80], [0, 80], [0, 0]]]}
+
+
+def test_changing_one_date_only_evaluates_that_date(tmp_path):
+    backend = make_backend()
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    first = Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 50, time_range=3, cache=cache, backend=backend)
+    first_areas = first._run_class_areas()
+    assert backend.class_area_dates == [['initial', 'updated']]
+
+    second = Analysis(AOI, date(2024, 5, 31), date(2024, 6, 21), 50, time_range=3, cache=cache, backend=backend)
+    second_areas = second._run_class_areas()
+    assert backend.class_area_dates[1:] == [['updated']]
+    assert second_areas['initial'] == first_areas['initial']
+    assert second_areas['updated'] != first_areas['updated']
+
+    # The changed date now comes from the cache as well, whatever its role
+    swapped = Analysis(AOI, date(2024, 6, 21), date(2024, 5, 31), 50, time_range=3, cache=cache, backend=backend)
+    assert swapped._run_class_areas() == {'initial': second_areas['updated'], 'updated': second_areas['initial']}
+    assert len(backend.class_area_dates) == 2
+
+
+class SlowCache(ResultCache):
+    """Stores slowly, so other sessions look the dates up between two stores."""
+
+    def set(self, key, value, ttl=None):
+        time.sleep(0.02)
+        super().set(key, value, ttl)
+
+
+def test_concurrent_sessions_evaluate_each_date_once(tmp_path):
+    backend = make_backend()
+    cache = SlowCache(str(tmp_path / 'results.sqlite'))
+    sessions = 8
+    barrier = threading.Barrier(sessions)
+
+    def run_session(index):
+        analysis = Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 50, time_range=3, cache=cache, backend=backend)
+        # Staggered, so sessions arrive before, between and after the stores
+        barrier.wait()
+        time.sleep(0.005 * index)
+        return analysis._run_class_areas()
+
+    with ThreadPoolExecutor(sessions) as executor:
+        results = list(executor.map(run_session, range(sessions)))
+    evaluated = [date for dates in backend.class_area_dates for date in dates]
+    assert sorted(evaluated) == ['initial', 'updated']
+    assert all(result == results[0] for result in results)
+
+
+def test_aoi_area_is_cached_per_engine(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    backend = make_backend()
+    # The same scenes on a grid half as wide: the AOI covers half the pixels
+    narrow = NumpyBackend(
+        [dict(scene, bands={band: values[:, :4] for band, values in scene['bands'].items()}) for scene in backend.scenes],
+        backend.geotransform
+    )
+    areas = [
+        Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 50, cache=cache, backend=engine).aoi_area
+        for engine in (backend, narrow)
+    ]
+    assert areas == [6400.0, 3200.0]
+
+
+class FailingLaiBackend(NumpyBackend):
+    def lai_statistics(self, lai_images, aoi, scale=10, plan=None):
+        raise RuntimeError("Computation timed out.")
+
+
+def test_lai_failures_propagate_out_of_run():
+    backend = make_backend()
+    failing = FailingLaiBackend(backend.scenes, backend.geotransform)
+    analysis = Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 50, time_range=3, backend=failing)
+    with pytest.raises(RuntimeError, match="timed out"):
+        analysis.run()
+
+
+def test_calculate_lai_statistics_raises_instead_of_returning_none(monkeypatch):
+    def fail(name, function):
+        raise fake_ee.EEException("User memory limit exceeded.")
+
+    monkeypatch.setattr(analysis, 'ee', fake_ee)
+    monkeypatch.setattr(analysis, 'trace_call', fail)
+    with pytest.raises(fake_ee.EEException):
+        analysis.calculate_lai_statistics({'initial': fake_ee.Image('lai')}, fake_ee.Geometry.Polygon([]))
+
+
+# A lattice of 1 m² "pixels" with classes 1-7, reduced per rectangle by tiling_reduce()
+LATTICE = [(10.00013 + 0.0007 * i, 45.00017 + 0.0007 * j, 1 + (i * 3 + j) % 7) for i in range(60) for j in range(40)]
+TILED_AOI = {'type': 'MultiPolygon', 'coordinates': [
+    [[[10.0, 45.0], [10.03, 45.0], [10.03, 45.02], [10.0, 45.02], [10.0, 45.0]]],
+    [[[10.035, 45.0], [10.042, 45.0], [10.042, 45.028], [10.035, 45.028], [10.035, 45.0]]],
+]}
+
+
+def tiling_reduce(rectangle, fail_wider_than=None, calls=None):
+    """reduce(region) for tiled_reduction over fake_ee regions: class areas of the lattice in the tile."""
+    def reduce(region):
+        # region is aoi.intersection(Rectangle(tile, ...)) in the fake's expression chain
+        west, south, east, north = region._chain[-1][1][0]._chain[0][1][0] if rectangle is None else rectangle
+        if calls is not None:
+            calls.append((west, south, east, north))
+        if fail_wider_than is not None and east - west > fail_wider_than:
+            raise fake_ee.EEException("User memory limit exceeded.")
+        areas = {}
+        for polygon in TILED_AOI['coordinates']:
+            (x0, y0), (x1, y1) = polygon[0][0], polygon[0][2]
+            for x, y, value in LATTICE:
+                if x0 <= x < x1 and y0 <= y < y1 and west <= x < east and south <= y < north:
+                    areas[value] = areas.get(value, 0) + 1
+        return {'class_areas': areas}
+    return reduce
+
+
+def test_plan_tiles_cover_the_aoi_on_a_fixed_grid():
+    tiles = analysis.plan_tiles(TILED_AOI, scale=10, tile_pixels=100)
+    step = tiles[0][3] - tiles[0][1]
+    assert step == pytest.approx(1000 / analysis.EARTH_RADIUS * 180 / np.pi)
+    assert all(tile[3] - tile[1] == pytest.approx(step) for tile in tiles)
+    # Every lattice point of the AOI falls in exactly one tile
+    for x, y, _ in LATTICE:
+        if any(p[0][0][0] <= x < p[0][2][0] and p[0][0][1] <= y < p[0][2][1] for p in TILED_AOI['coordinates']):
+            assert sum(t[0] <= x < t[2] and t[1] <= y < t[3] for t in tiles) == 1
+    # Tiles between two distant polygons are left out
+    far = {'type': 'MultiPolygon', 'coordinates': TILED_AOI['coordinates'][:1] + [
+        [[[10.5, 45.0], [10.501, 45.0], [10.501, 45.001], [10.5, 45.001], [10.5, 45.0]]]]}
+    far_tiles = analysis.plan_tiles(far, scale=10, tile_pixels=100)
+    assert all(tile[0] < 10.03 or tile[2] > 10.5 for tile in far_tiles)
+    assert analysis.plan_tiles(fake_ee.Geometry.Polygon([]), scale=10) is None
+
+
+def test_tiled_reduction_splits_failed_tiles_and_matches_the_untiled_total(monkeypatch):
+    monkeypatch.setattr(analysis, 'ee', fake_ee)
+    untiled = tiling_reduce((-180, -90, 180, 90))(None)
+    tiles = analysis.plan_tiles(TILED_AOI, scale=10, tile_pixels=100)
+    calls = []
+
+    def run():
+        trace = start_trace('tiles')
+        # Whole tiles fail; their quarters go through
+        return trace, analysis.tiled_reduction(tiling_reduce(None, fail_wider_than=0.01, calls=calls), TILED_AOI, tiles)
+
+    trace, total = contextvars.copy_context().run(run)
+    assert total == untiled
+    assert len(calls) == 5 * len(tiles)
+    notes = [span for span in trace.to_dict()['spans'] if span['kind'] == 'event']
+    assert len(notes) == len(tiles) and "memory limit" in notes[0]['error']
+    assert trace.summary() == {}
+
+
+def test_tiled_reduction_gives_up_after_the_last_split(monkeypatch):
+    monkeypatch.setattr(analysis, 'ee', fake_ee)
+    tiles = analysis.plan_tiles(TILED_AOI, scale=10, tile_pixels=100)
+    calls = []
+    with pytest.raises(fake_ee.EEException):
+        analysis.tiled_reduction(tiling_reduce(None, fail_wider_than=0, calls=calls), TILED_AOI, tiles[:1],
+                                 splits=2)
+    # The tile, its first quarter, and that quarter's first quarter
+    assert len(calls) == 3
+
+
+def lon_lat_box(west, south, east, north):
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+def test_geojson_area_of_a_lon_lat_box():
+    # A box between two meridians and two parallels: R² · Δλ · (sin φ₁ − sin φ₀)
+    expected = analysis.EARTH_RADIUS ** 2 * np.radians(1.0) * (np.sin(np.radians(46.0)) - np.sin(np.radians(45.0)))
+    box = lon_lat_box(10.0, 45.0, 11.0, 46.0)
+    assert analysis.geojson_area({'type': 'Polygon', 'coordinates': [box]}) == pytest.approx(expected, rel=1e-3)
+    # Winding doesn't matter; holes are subtracted and parts added
+    assert analysis.geojson_area({'type': 'Polygon', 'coordinates': [box[::-1]]}) == pytest.approx(expected, rel=1e-3)
+    hole = lon_lat_box(10.25, 45.25, 10.75, 45.75)
+    with_hole = analysis.geojson_area({'type': 'Polygon', 'coordinates': [box, hole]})
+    assert with_hole == pytest.approx(expected - analysis.geojson_area({'type': 'Polygon', 'coordinates': [hole]}))
+    parts = {'type': 'MultiPolygon', 'coordinates': [[box], [lon_lat_box(20.0, 45.0, 21.0, 46.0)]]}
+    assert analysis.geojson_area(parts) == pytest.approx(2 * expected, rel=1e-3)
+    assert analysis.geojson_area({'type': 'Point', 'coordinates': [10.0, 45.0]}) is None
+    assert analysis.geojson_area(fake_ee.Geometry.Polygon([])) is None
+
+
+def test_plan_reduction_coarsens_as_the_aoi_grows():
+    plans = [analysis.plan_reduction(area) for area in (1e6, 1e9, 1e10, 1e11, 1e12)]
+    scales = [plan['scale'] for plan in plans]
+    assert scales[0] == 10 and scales == sorted(scales) and scales[-1] > scales[2]
+    assert all(plan['pixels'] <= analysis.PLANNED_MAX_PIXELS for plan in plans)
+    # At one scale, tileScale grows with the pixel count
+    assert [analysis.plan_reduction(area)['tileScale'] for area in (1e6, 5e8, 2e9, 9e9)] == [1, 2, 4, 8]
+    assert not any(plan['bestEffort'] for plan in plans)
+    # Never finer than asked, and bestEffort without an area
+    assert analysis.plan_reduction(1e6, scale=30)['scale'] == 30
+    assert analysis.plan_reduction(None)['bestEffort']
+
+
+@pytest.mark.parametrize('size, tiled, scale, tiles', [
+    (0.01, True, 10, False),  # small: the requested scale
+    (1.5, False, 20, False),  # large: coarser
+    (1.5, True, 10, True),  # large and tiled: the requested scale, per tile
+])
+def test_large_aois_are_coarsened_or_tiled(monkeypatch, size, tiled, scale, tiles):
+    monkeypatch.setattr(analysis, 'ee', fake_ee)
+    aoi = {'type': 'Polygon', 'coordinates': [lon_lat_box(10.0, 45.0, 10.0 + size, 45.0 + size)]}
+    engine = analysis.EarthEngineBackend()
+    planned = Analysis(aoi, date(2024, 5, 31), date(2024, 6, 11), 50, tiled=tiled, backend=engine)
+    assert planned.area_plan['scale'] == scale
+    assert bool(planned.tiles) == tiles
+
+
+def test_class_areas_of_several_images_take_one_grouped_reduction(monkeypatch):
+    monkeypatch.setattr(analysis, 'ee', fake_ee)
+    images = {name: fake_ee.Image(name) for name in ('initial', 'updated', 'third')}
+    with fake_ee.recorder.stage('grouped class areas') as recorded:
+        areas = analysis.reduce_class_areas(images, fake_ee.Geometry.Polygon([]))
+    assert dict(recorded['calls']) == {'reduceRegion': 1, 'getInfo': 1}
+    assert list(areas) == list(images)
+    assert all(sorted(per_class) == list(range(1, 8)) for per_class in areas.values())
+
+
+def test_parse_class_areas_reads_each_prefixed_group():
+    result = {
+        'groups': [{'class': 0, 'sum': 50.0}, {'class': 3, 'sum': 100.0}],
+        'updated_groups': [{'class': 3, 'sum': 20.0}, {'class': 7, 'sum': None}, {'class': 5.0, 'sum': 7.5}],
+    }
+    areas = analysis.parse_class_areas(result, ['initial', 'updated'])
+    # Unclassified (0) is dropped, missing classes are 0
+    assert areas['initial'] == {1: 0, 2: 0, 3: 100.0, 4: 0, 5: 0, 6: 0, 7: 0}
+    assert areas['updated'] == {1: 0, 2: 0, 3: 20.0, 4: 0, 5: 7.5, 6: 0, 7: 0}
+
+
+def test_dates_sharing_a_window_are_evaluated_once(tmp_path):
+    backend = make_backend()
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    same = Analysis(AOI, date(2024, 6, 11), date(2024, 6, 11), 50, time_range=3, cache=cache, backend=backend)
+    areas = same._run_class_areas()
+    assert backend.class_area_dates == [['initial']]
+    assert areas['initial'] == areas['updated']
+
+
+def test_date_keys_follow_the_window_and_parameters(tmp_path):
+    backend = make_backend()
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 50, time_range=3, cache=cache, backend=backend)._run_class_areas()
+    # Another cloud rate or window length is another result
+    Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 20, time_range=3, cache=cache, backend=backend)._run_class_areas()
+    Analysis(AOI, date(2024, 5, 31), date(2024, 6, 11), 50, time_range=5, cache=cache, backend=backend)._run_class_areas()
+    assert backend.class_area_dates == [['initial', 'updated']] * 3
+    # The updated date of one analysis is the initial date of the next
+    Analysis(AOI, date(2024, 6, 11), date(2024, 6, 21), 50, time_range=3, cache=cache, backend=backend)._run_class_areas()
+    assert backend.class_area_dates[3:] == [['updated']]
@@ -0,0 +1,31 @@
+from aoi_upload import repair_ring, rings_are_simple, simplify_polygon
+
+SQUARE = [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+BOW_TIE = [[0, 0], [1, 1], [1, 0], [0, 1], [0, 0]]
+
+
+def test_self_intersecting_rings_are_rejected():
+    assert repair_ring(SQUARE) is not None
+    assert repair_ring(BOW_TIE) is None
+    assert simplify_polygon([BOW_TIE], 1) is None
+
+
+def test_holes_must_lie_inside_the_exterior():
+    inside = [[0.2, 0.2], [0.2, 0.8], [0.8, 0.8], [0.8, 0.2], [0.2, 0.2]]
+    outside = [[2, 2], [3, 2], [3, 3], [2, 3], [2, 2]]
+    assert rings_are_simple([SQUARE, inside])
+    assert not rings_are_simple([SQUARE, outside])
+    assert simplify_polygon([SQUARE, outside], 1) is None
+
+
+def test_simplification_that_would_drop_a_hole_out_is_undone():
+    # A ~4 m bump on the top edge holding a small hole: simplifying to 10 m flattens the
+    # bump and would leave the hole outside the exterior
+    d = 1e-4
+    exterior = [[0, 0], [10 * d, 0], [10 * d, 10 * d], [6 * d, 10 * d], [5 * d, 10.4 * d], [4 * d, 10 * d],
+                [0, 10 * d], [0, 0]]
+    hole = [[4.8 * d, 10.1 * d], [4.8 * d, 10.25 * d], [5.2 * d, 10.25 * d], [5.2 * d, 10.1 * d], [4.8 * d, 10.1 * d]]
+    assert len(simplify_polygon([exterior], 10)[0]) == 5
+    rings = simplify_polygon([exterior, hole], 10)
+    assert [len(ring) for ring in rings] == [8, 5]
+    assert rings_are_simple(rings)
@@ -0,0 +1,58 @@
+import csv
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import batch
+from analysis import BANDS
+
+SQUARE = {'type': 'Polygon', 'coordinates': [[[0, 0], [80, 0], [80, 80], [0, 80], [0, 0]]]}
+
+
+def write_inputs(tmp_path):
+    rng = np.random.default_rng(0)
+    np.savez(
+        tmp_path / 'scenes.npz',
+        dates=np.array(['2024-05-30', '2024-06-10']),
+        cloud=np.array([5.0, 5.0]),
+        geotransform=np.array([0.0, 10.0, 0.0, 80.0, 0.0, -10.0]),
+        **{band: rng.uniform(0.01, 0.5, (2, 8, 8)).astype(np.float32) for band in BANDS}
+    )
+    (tmp_path / 'field.geojson').write_text(json.dumps(
+        {'type': 'FeatureCollection', 'features': [{'type': 'Feature', 'properties': {}, 'geometry': SQUARE}]}))
+    (tmp_path / 'empty.geojson').write_text(json.dumps({'type': 'FeatureCollection', 'features': []}))
+    with open(tmp_path / 'jobs.csv', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['name', 'aoi', 'initial_date', 'updated_date', 'cloud_rate'])
+        writer.writerow(['field', 'field.geojson', '2024-05-31', '2024-06-11', '50'])
+        writer.writerow(['', 'empty.geojson', '2024-05-31', '2024-06-11', ''])
+
+
+def test_batch_never_imports_streamlit():
+    code = "import sys, batch; sys.exit(any(m.split('.')[0] in ('streamlit', 'folium') for m in sys.modules))"
+    assert subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(batch.__file__)).returncode == 0
+
+
+def test_batch_writes_one_csv_row_per_job(tmp_path):
+    write_inputs(tmp_path)
+    output = tmp_path / 'results.csv'
+    failed = batch.main([str(tmp_path / 'jobs.csv'), '--output', str(output), '--scenes', str(tmp_path / 'scenes.npz'),
+                         '--time-range', '3', '--workers', '2', '--no-cache'])
+    assert failed == 1
+    with open(output, newline='') as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames == batch.COLUMNS
+        rows = {row['name']: row for row in reader}
+    assert sorted(rows) == ['empty-1', 'field']
+
+    field = rows['field']
+    assert field['status'] == 'ok' and not field['error']
+    assert float(field['aoi_area']) == 6400
+    classes = [float(field[f'initial_class_{c}_area']) for c in range(1, 8)]
+    assert sum(classes) == pytest.approx(float(field['initial_veg_area']) + float(field['initial_nonveg_area']))
+    assert json.loads(field['report'])['analysis_period']
+    assert rows['empty-1']['status'] == 'error' and 'No polygons' in rows['empty-1']['error']
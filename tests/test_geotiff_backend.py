@@ -0,0 +1,199 @@
+import math
+import struct
+from datetime import date
+
+import numpy as np
+import pytest
+
+from analysis import BANDS, FEATURE_ID, Analysis
+from geotiff_backend import LAI_FINE_RANGE, GeoTiff, GeoTiffBackend, merge_sums
+from local_backend import NumpyBackend
+
+# 0.001° pixels near the equator (geographic, so no reprojection is involved)
+GEOTRANSFORM = (10.0, 0.001, 0.0, 1.0, 0.0, -0.001)
+SHAPE = (150, 130)
+DATES = ['2024-05-30', '2024-06-10', '2024-06-20']
+LAYOUTS = {
+    'stripped': {},
+    'tiled': {'tile': (32, 48)},
+    'planar tiled': {'tile': (64, 64), 'planar': True},
+    'bigtiff': {'big': True, 'tile': (64, 32)},
+    'big-endian': {'byteorder': '>'},
+}
+
+
+def write_geotiff(path, samples, geotransform=GEOTRANSFORM, epsg=4326, tile=None, planar=False, big=False,
+                  byteorder='<', rows_per_strip=37):
+    """Uncompressed uint16 (Big)GeoTIFF of `samples` (2D arrays), stripped or tiled, chunky or planar."""
+    dtype = np.dtype(byteorder + 'u2')
+    rows, cols = np.shape(samples[0])
+    planes = [np.asarray(sample)[:, :, None] for sample in samples] if planar else [np.stack(samples, axis=-1)]
+    chunks = []
+    for plane in planes:
+        if tile:
+            height, width = tile
+            padded = np.zeros((-(-rows // height) * height, -(-cols // width) * width, plane.shape[2]), plane.dtype)
+            padded[:rows, :cols] = plane
+            chunks += [padded[r:r + height, c:c + width].astype(dtype).tobytes()
+                       for r in range(0, padded.shape[0], height) for c in range(0, padded.shape[1], width)]
+        else:
+            chunks += [plane[r:r + rows_per_strip].astype(dtype).tobytes() for r in range(0, rows, rows_per_strip)]
+    x0, dx, _, y0, _, dy = geotransform
+    offset_type = 16 if big else 4
+    model = [1, 1, 0, 2, 1024, 0, 1, 2 if epsg == 4326 else 1, 2048 if epsg == 4326 else 3072, 0, 1, epsg]
+    tags = {256: (3, [cols]), 257: (3, [rows]), 258: (3, [16] * len(samples)), 259: (3, [1]), 262: (3, [1]),
+            277: (3, [len(samples)]), 284: (3, [2 if planar else 1]), 339: (3, [1] * len(samples)),
+            33550: (12, [dx, -dy, 0.0]), 33922: (12, [0.0, 0.0, 0.0, x0, y0, 0.0]), 34735: (3, model)}
+    header_size = 16 if big else 8
+    offsets = list(np.cumsum([header_size] + [len(chunk) for chunk in chunks[:-1]]))
+    if tile:
+        tags.update({322: (3, [tile[1]]), 323: (3, [tile[0]]), 324: (offset_type, offsets),
+                     325: (offset_type, [len(chunk) for chunk in chunks])})
+    else:
+        tags.update({278: (3, [rows_per_strip]), 273: (offset_type, offsets),
+                     279: (offset_type, [len(chunk) for chunk in chunks])})
+    formats = {3: 'H', 4: 'I', 12: 'd', 16: 'Q'}
+    data = b''.join(chunks)
+    ifd = header_size + len(data) + len(data) % 2
+    entry_size, field_size = (20, 8) if big else (12, 4)
+    extra_at = ifd + (8 if big else 2) + len(tags) * entry_size + (8 if big else 4)
+    entries, extra = b'', b''
+    for tag in sorted(tags):
+        kind, values = tags[tag]
+        payload = struct.pack(byteorder + formats[kind] * len(values), *[int(v) if kind != 12 else v for v in values])
+        if len(payload) <= field_size:
+            value = payload.ljust(field_size, b'\0')
+        else:
+            value = struct.pack(byteorder + ('Q' if big else 'I'), extra_at + len(extra))
+            extra += payload + b'\0' * (len(payload) % 2)
+        entries += struct.pack(byteorder + ('HHQ' if big else 'HHI'), tag, kind, len(values)) + value
+    magic = b'II' if byteorder == '<' else b'MM'
+    header = magic + (struct.pack(byteorder + 'HHHQ', 43, 8, 0, ifd) if big else struct.pack(byteorder + 'HI', 42, ifd))
+    with open(path, 'wb') as f:
+        f.write(header + data + b'\0' * (ifd - header_size - len(data)))
+        f.write(struct.pack(byteorder + ('Q' if big else 'H'), len(tags)) + entries)
+        f.write(struct.pack(byteorder + ('Q' if big else 'I'), 0) + extra)
+
+
+def make_scenes(seed=0):
+    rng = np.random.default_rng(seed)
+    scenes = []
+    for day in DATES:
+        bands = {band: rng.integers(100, 6000 if band == 'B8' else 3000, size=SHAPE).astype(np.uint16) for band in BANDS}
+        for band in ('B2', 'B4', 'B8'):
+            bands[band][rng.random(SHAPE) < 0.02] = 0
+        scenes.append({'date': day, 'cloud': 5.0, 'bands': bands})
+    return scenes
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_reader_returns_the_written_samples(tmp_path, layout):
+    scenes = make_scenes()
+    samples = [scenes[0]['bands'][band] for band in BANDS]
+    path = tmp_path / 'scene.tif'
+    write_geotiff(path, samples, **LAYOUTS[layout])
+    tiff = GeoTiff(str(path))
+    assert tiff.shape == SHAPE and tiff.samples == 4
+    assert tiff.geographic and tiff.epsg == 4326
+    assert tiff.geotransform == pytest.approx(GEOTRANSFORM)
+    for sample, expected in enumerate(samples):
+        assert np.array_equal(tiff.read((0, SHAPE[0]), (0, SHAPE[1]), sample), expected)
+        # Windows across chunk edges, and the ragged last row and column
+        assert np.array_equal(tiff.read((30, 101), (45, 130), sample), expected[30:101, 45:130])
+        assert np.array_equal(tiff.read((149, 150), (0, 1), sample), expected[149:, :1])
+
+
+def test_compressed_files_are_refused(tmp_path):
+    path = tmp_path / 'scene.tif'
+    write_geotiff(path, [np.ones(SHAPE)])
+    data = bytearray(path.read_bytes())
+    # Compression tag (259) entry: set LZW (5)
+    position = data.find(struct.pack('<HHI', 259, 3, 1))
+    data[position + 8:position + 10] = struct.pack('<H', 5)
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="compressed"):
+        GeoTiff(str(path))
+
+
+def write_manifest_backend(tmp_path, scenes, **kwargs):
+    """GeoTiffBackend over `scenes`, one layout per scene, separate and multi-band files."""
+    layouts = list(LAYOUTS.values())
+    manifest = []
+    for position, scene in enumerate(scenes):
+        path = tmp_path / f'scene{position}.tif'
+        write_geotiff(path, [scene['bands'][band] for band in BANDS], **layouts[position % len(layouts)])
+        manifest.append({'date': scene['date'], 'cloud': scene['cloud'],
+                         'bands': {band: (str(path), sample) for sample, band in enumerate(BANDS)}})
+    return GeoTiffBackend(manifest, **kwargs)
+
+
+def test_windows_cover_the_bounding_box_in_blocks(tmp_path):
+    backend = write_manifest_backend(tmp_path, make_scenes()[:1], block_size=64)
+    # Columns 20-69 and rows 10-79 of the grid
+    geometry = {'type': 'Polygon', 'coordinates': [[[10.0205, 0.9795], [10.0695, 0.9795], [10.0695, 0.9205],
+                                                    [10.0205, 0.9205], [10.0205, 0.9795]]]}
+    assert backend.pixel_bounds(geometry) == (20, 79, 20, 69)
+    assert backend.windows([geometry]) == [(0, 64, 0, 64), (0, 64, 64, 128), (64, 128, 0, 64), (64, 128, 64, 128)]
+    # Clipped to the grid, with the ragged last blocks
+    everything = {'type': 'Polygon', 'coordinates': [[[9, 2], [11, 2], [11, 0], [9, 0], [9, 2]]]}
+    assert backend.windows([everything])[-1] == (128, 150, 128, 130)
+    assert len(backend.windows([everything])) == 9
+
+
+def test_merge_sums_adds_nested_partials():
+    total = {'aoi_area': 1.0, 'image': {'class_areas': {1: 2.0}, 'lai': {'histogram': np.array([1, 2])}}}
+    merge_sums(total, {'aoi_area': 2.0, 'image': {'class_areas': {1: 1.0, 2: 5.0}, 'lai': {'histogram': np.array([3, 4])}},
+                       'transitions': {1: {1: 1.0}}})
+    assert total['aoi_area'] == 3.0
+    assert total['image']['class_areas'] == {1: 3.0, 2: 5.0}
+    assert total['image']['lai']['histogram'].tolist() == [4, 6]
+    assert total['transitions'] == {1: {1: 1.0}}
+
+
+AOI = {'type': 'Polygon', 'coordinates': [
+    [[10.011, 0.987], [10.118, 0.975], [10.101, 0.861], [10.02, 0.872], [10.011, 0.987]],
+    [[10.05, 0.95], [10.05, 0.92], [10.08, 0.92], [10.08, 0.95], [10.05, 0.95]],
+]}
+FEATURES = {'type': 'FeatureCollection', 'features': [
+    {'type': 'Feature', 'properties': {FEATURE_ID: index, 'name': f'field {index}'},
+     'geometry': {'type': 'Polygon', 'coordinates': [[[x, y], [x + 0.03, y], [x + 0.03, y - 0.02], [x, y - 0.02], [x, y]]]}}
+    for index, (x, y) in enumerate([(10.005, 0.995), (10.06, 0.9), (10.09, 0.96), (11.0, 2.0)])
+]}
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_windowed_results_match_the_numpy_backend(tmp_path, workers):
+    scenes = make_scenes()
+    local = NumpyBackend(scenes, GEOTRANSFORM, geographic=True)
+    geotiff = write_manifest_backend(tmp_path, scenes, block_size=48, workers=workers)
+
+    def analyse(backend):
+        analysis = Analysis(AOI, date(2024, 5, 31), date(2024, 6, 21), 50, time_range=3, backend=backend)
+        return analysis.run(), analysis.run_features(FEATURES)
+
+    (expected, expected_features), (result, result_features) = analyse(local), analyse(geotiff)
+    assert result['scene_counts'] == expected['scene_counts']
+    for key in ('initial_ndvi_class_areas', 'updated_ndvi_class_areas', 'transitions'):
+        assert expected[key]
+        assert _approx_nested(result[key], expected[key]), key
+    assert geotiff.aoi_area(AOI) == pytest.approx(local.aoi_area(AOI))
+    for name in ('initial_stats', 'updated_stats'):
+        assert result['lai'][name]['mean'] == pytest.approx(expected['lai'][name]['mean'])
+        assert result['lai'][name]['stdDev'] == pytest.approx(expected['lai'][name]['stdDev'])
+        assert result['lai'][name]['histogram'] == expected['lai'][name]['histogram']
+        for p, value in expected['lai'][name]['percentiles'].items():
+            # Percentiles come from a 0.01 histogram over LAI_FINE_RANGE
+            assert result['lai'][name]['percentiles'][p] == pytest.approx(np.clip(value, *LAI_FINE_RANGE), abs=0.01)
+    assert len(result_features) == len(expected_features)
+    for row, expected_row in zip(result_features, expected_features):
+        assert row.keys() == expected_row.keys()
+        for key, value in expected_row.items():
+            if isinstance(value, float) and math.isnan(value):
+                assert math.isnan(row[key])
+            else:
+                assert row[key] == pytest.approx(value), key
+
+def _approx_nested(result, expected):
+    if isinstance(expected, dict):
+        return result.keys() == expected.keys() and all(_approx_nested(result[k], expected[k]) for k in expected)
+    return result == pytest.approx(expected, rel=1e-9)
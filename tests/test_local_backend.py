@@ -0,0 +1,56 @@
+import numpy as np
+
+from local_backend import class_areas, class_transitions, pixel_areas, rasterize_geometry
+
+# 10 m pixels, projected: every pixel is 100 m²
+GEOTRANSFORM = (0.0, 10.0, 0.0, 30.0, 0.0, -10.0)
+AREAS = pixel_areas(GEOTRANSFORM, (3, 3))
+
+INITIAL = np.array([
+    [1, 1, 2],
+    [0, 3, 3],
+    [7, 7, 7],
+], dtype=np.uint8)
+UPDATED = np.array([
+    [1, 2, 2],
+    [4, 0, 3],
+    [7, 6, 5],
+], dtype=np.uint8)
+
+
+def test_class_areas_sum_pixel_areas_per_class():
+    areas = class_areas(INITIAL, AREAS)
+    assert areas == {1: 200.0, 2: 100.0, 3: 200.0, 4: 0.0, 5: 0.0, 6: 0.0, 7: 300.0}
+
+
+def test_class_areas_inside_aoi_mask_only():
+    mask = np.array([
+        [True, False, False],
+        [True, True, False],
+        [False, False, True],
+    ])
+    # The unclassified pixel (0) inside the mask counts for no class
+    assert class_areas(INITIAL, AREAS, mask) == {1: 100.0, 2: 0.0, 3: 100.0, 4: 0.0, 5: 0.0, 6: 0.0, 7: 100.0}
+
+
+def test_class_transitions_pairs_pixels_classified_on_both_dates():
+    transitions = class_transitions(INITIAL, UPDATED, AREAS)
+    expected = {a: {b: 0.0 for b in range(1, 8)} for a in range(1, 8)}
+    expected[1][1] = 100.0
+    expected[1][2] = 100.0
+    expected[2][2] = 100.0
+    expected[3][3] = 100.0
+    expected[7][7] = 100.0
+    expected[7][6] = 100.0
+    expected[7][5] = 100.0
+    assert transitions == expected
+    # Pixel (1, 0) is unclassified initially and (1, 1) on the update, so both are left out
+    assert sum(sum(row.values()) for row in transitions.values()) == 700.0
+
+
+def test_rasterize_geometry_carves_holes():
+    # 3×3 square with the centre pixel as a hole
+    exterior = [[0, 0], [30, 0], [30, 30], [0, 30], [0, 0]]
+    hole = [[10, 10], [10, 20], [20, 20], [20, 10], [10, 10]]
+    mask = rasterize_geometry({'type': 'Polygon', 'coordinates': [exterior, hole]}, GEOTRANSFORM, (3, 3))
+    assert mask.tolist() == [[True, True, True], [True, False, True], [True, True, True]]
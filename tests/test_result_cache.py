@@ -0,0 +1,133 @@
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache, SingleFlight
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+def test_entries_expire_after_their_ttl(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, 'time', clock.time)
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    cache.set('recent', {'area': 1.0}, ttl=60)
+    cache.set('archive', {'area': 2.0})
+
+    clock.now += 59
+    assert cache.get('recent') == {'area': 1.0}
+    clock.now += 2
+    assert cache.get('recent') is None
+    # Expired entries are gone from the store too, not only from the memory tier
+    assert ResultCache(cache.path).get('recent') is None
+    assert cache.get('archive') == {'area': 2.0}
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(result_cache.time, 'time', clock.time)
+    value = 'x' * 1000
+    entry_size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), max_bytes=3 * entry_size)
+    for key in ('a', 'b', 'c'):
+        clock.now += 1
+        cache.set(key, value)
+    clock.now += 1
+    cache.get('a')
+
+    clock.now += 1
+    cache.set('d', value)
+    assert cache.stats()['evictions'] == 1
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in ('a', 'c', 'd')] == [True, True, True]
+
+
+def test_an_entry_larger_than_the_store_is_not_kept(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'), max_bytes=100)
+    cache.set('large', 'x' * 1000)
+    assert cache.get('large') is None
+
+
+def test_single_flight_runs_concurrent_identical_computations_once():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {'area': 1.0}
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flight.do, 'key', compute)
+        started.wait(5)
+        followers = [executor.submit(flight.do, 'key', compute) for _ in range(3)]
+        # Followers register under the lock before waiting; give them time to get there
+        wait_for(lambda: flight.shared == 3)
+        release.set()
+        results = [leader.result()] + [follower.result() for follower in followers]
+
+    assert len(calls) == 1
+    assert results[0] == ({'area': 1.0}, False)
+    assert all(result == ({'area': 1.0}, True) for result in results[1:])
+    # Once done, the same key computes again
+    assert flight.do('key', lambda: 2) == (2, False)
+
+
+def test_single_flight_shares_the_error():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("quota exceeded")
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flight.do, 'key', fail)
+        started.wait(5)
+        follower = executor.submit(flight.do, 'key', fail)
+        wait_for(lambda: flight.shared == 1)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(ValueError):
+                future.result()
+
+
+def test_get_or_compute_coalesces_concurrent_misses(tmp_path):
+    cache = ResultCache(str(tmp_path / 'results.sqlite'))
+    barrier = threading.Barrier(4)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return [1, 2, 3]
+
+    def request():
+        barrier.wait()
+        return cache.get_or_compute('shared-key', compute)
+
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: request(), range(4)))
+    assert len(calls) == 1
+    assert results == [[1, 2, 3]] * 4
+    # Every caller gets its own copy
+    assert len({id(result) for result in results}) == 4
@@ -0,0 +1,157 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scheduler import INTERACTIVE, PREFETCH, RequestScheduler, request_priority, retry_reason
+
+
+class FakeClock:
+    """Records the backoffs instead of sleeping through them."""
+
+    def __init__(self):
+        self.sleeps = []
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+
+
+class Flaky:
+    """Raises each of `errors` in turn, then returns `value`."""
+
+    def __init__(self, errors, value=None):
+        self.errors = list(errors)
+        self.value = value
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.value
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize('message, reason', [
+    ("Too many concurrent aggregations.", 'rate limit'),
+    ("<HttpError 429 when requesting https://earthengine.googleapis.com/v1/value:compute>", 'rate limit'),
+    ("Earth Engine capacity exceeded.", 'quota'),
+    ("Quota exceeded for quota metric 'Requests'", 'quota'),
+    ("Computation timed out.", 'timeout'),
+    ("Deadline exceeded", 'timeout'),
+    ("<HttpError 503 when requesting ... returned \"Service Unavailable\">", 'unavailable'),
+    ("An internal error has occurred (request: 1234).", 'unavailable'),
+])
+def test_earth_engine_transient_errors_are_retryable(message, reason):
+    assert retry_reason(Exception(message)) == reason
+
+
+@pytest.mark.parametrize('message', [
+    "User memory limit exceeded.",
+    "Image.load: Image asset 'users/fields/tile_429' not found.",
+    "Image.select: Pattern 'quota_band' did not match any bands.",
+    "Collection.loadTable: Table asset 'timeout_zones' not found.",
+    "Geometry.area: Invalid geometry, 503 vertices out of range.",
+])
+def test_other_errors_are_not_retried(message):
+    assert retry_reason(Exception(message)) is None
+
+
+def test_connection_errors_are_retryable():
+    assert retry_reason(TimeoutError()) == 'timeout'
+    assert retry_reason(ConnectionResetError()) == 'unavailable'
+
+
+def test_retries_with_backoff_then_succeeds():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_retries=5, backoff_base=1.0, backoff_max=30.0, sleep=clock.sleep)
+    flaky = Flaky([Exception("Too many concurrent aggregations."), Exception("Computation timed out.")], value=42)
+    info = {}
+    assert scheduler.run(flaky, info=info) == 42
+    assert flaky.calls == 3
+    assert info['attempts'] == 3
+    # Full jitter: each wait is below base * 2 ** attempt
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 2.0 and 0 <= clock.sleeps[1] <= 4.0
+    stats = scheduler.stats()
+    assert (stats['completed'], stats['failed'], stats['retries']) == (1, 0, 2)
+    assert stats['retry_reasons'] == {'rate limit': 1, 'timeout': 1}
+
+
+def test_gives_up_on_a_non_retryable_error():
+    clock = FakeClock()
+    scheduler = RequestScheduler(sleep=clock.sleep)
+    flaky = Flaky([Exception("User memory limit exceeded.")], value=1)
+    with pytest.raises(Exception, match="memory limit"):
+        scheduler.run(flaky)
+    assert flaky.calls == 1
+    assert clock.sleeps == []
+    assert scheduler.stats()['failed'] == 1
+
+
+def test_gives_up_after_max_retries():
+    clock = FakeClock()
+    scheduler = RequestScheduler(max_retries=3, sleep=clock.sleep)
+    flaky = Flaky([Exception("Service Unavailable")] * 10)
+    with pytest.raises(Exception, match="Unavailable"):
+        scheduler.run(flaky)
+    assert flaky.calls == 4
+    assert len(clock.sleeps) == 3
+    stats = scheduler.stats()
+    assert (stats['retries'], stats['failed']) == (3, 1)
+
+
+def test_interactive_requests_run_before_prefetch():
+    scheduler = RequestScheduler(max_concurrent=1)
+    started, release = threading.Event(), threading.Event()
+    order = []
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    def request(name, priority):
+        with request_priority(priority):
+            scheduler.run(order.append, (name,))
+
+    with ThreadPoolExecutor(3) as executor:
+        executor.submit(scheduler.run, blocker)
+        started.wait(5)
+        executor.submit(request, 'prefetch', PREFETCH)
+        wait_for(lambda: scheduler.stats()['queued'] == 1)
+        executor.submit(request, 'interactive', INTERACTIVE)
+        wait_for(lambda: scheduler.stats()['queued'] == 2)
+        stats = scheduler.stats()
+        assert stats['queued_by_priority'] == {'prefetch': 1, 'interactive': 1}
+        assert stats['active'] == 1
+        release.set()
+    assert order == ['interactive', 'prefetch']
+    assert scheduler.stats()['queued'] == 0
+
+
+def test_the_concurrency_cap_is_never_exceeded():
+    scheduler = RequestScheduler(max_concurrent=3)
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def request():
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.01)
+        with lock:
+            active[0] -= 1
+
+    with ThreadPoolExecutor(12) as executor:
+        for future in [executor.submit(scheduler.run, request) for _ in range(24)]:
+            future.result()
+    assert peak[0] == 3
+    stats = scheduler.stats()
+    assert (stats['submitted'], stats['completed'], stats['active']) == (24, 24, 0)
+    assert stats['queued_s'] > 0